@@ -1,15 +1,26 @@
 BACKEND_VERSION = '0.0.2'
 
-import os, time, tempfile, logging
-from multiprocessing import Pool
+import hashlib, os, time, logging
+from typing import BinaryIO, Union
 
-import numpy as np
 import jax.numpy as jnp
 from jax.experimental.compilation_cache import compilation_cache as cc
-from transformers.pipelines.audio_utils import ffmpeg_read
-import yt_dlp as youtube_dl
 
-from whisper_jax import FlaxWhisperPipline
+from whisper_jax import (
+    ChunkResultCache,
+    ContinuousBatchScheduler,
+    FlaxWhisperPipline,
+    InflightBatchScheduler,
+    InMemoryJobStore,
+    JobQueue,
+    HTTPMediaFetcher,
+    LiveTranscriber,
+    MediaCache,
+    SingleFlight,
+    TranscriptionCache,
+    YoutubeAudioFetcher,
+)
+from whisper_jax.audio import hash_file
 
 
 cc.initialize_cache("./jax_cache")
@@ -17,8 +28,34 @@ checkpoint = "openai/whisper-large-v3" #"openai/whisper-medium"
 
 BATCH_SIZE = 32
 CHUNK_LENGTH_S = 30
-NUM_PROC = 32
+NUM_PROC = 32  # log-mel feature extraction workers
 YT_LENGTH_LIMIT_S = 7200  # limit to 2 hour YouTube files
+# refill the decoding slot of each chunk as soon as it finishes, rather than decoding fixed batches to completion
+INFLIGHT_BATCHING = os.environ.get("INFLIGHT_BATCHING", "false").lower() == "true"
+# skip the chunks that hold no speech rather than decoding them (and risking hallucinated text on silence)
+VAD = os.environ.get("VAD", "false").lower() == "true"
+# end chunks in pauses and stitch them by timestamp, rather than overlapping fixed chunks by 5s strides
+ADAPTIVE_CHUNKING = os.environ.get("ADAPTIVE_CHUNKING", "false").lower() == "true"
+# maximum number of asynchronous jobs waiting to run, further jobs are rejected until the queue drains
+JOB_QUEUE_SIZE = int(os.environ.get("JOB_QUEUE_SIZE", 64))
+# serve re-submitted recordings from a cache keyed by the decoded audio, in memory and on disk
+TRANSCRIPTION_CACHE = os.environ.get("TRANSCRIPTION_CACHE", "true").lower() == "true"
+TRANSCRIPTION_CACHE_DIR = os.environ.get("TRANSCRIPTION_CACHE_DIR", "./transcription_cache")
+TRANSCRIPTION_CACHE_MEMORY_MB = int(os.environ.get("TRANSCRIPTION_CACHE_MEMORY_MB", 256))
+TRANSCRIPTION_CACHE_TTL_S = float(os.environ.get("TRANSCRIPTION_CACHE_TTL_S", 7 * 24 * 3600))
+# downloaded YouTube audio is kept on disk by video ID, up to this size in GB (0 disables the media cache)
+MEDIA_CACHE_DIR = os.environ.get("MEDIA_CACHE_DIR", "./media_cache")
+MEDIA_CACHE_GB = float(os.environ.get("MEDIA_CACHE_GB", 20))
+# `http` treats the URLs passed to /infer_youtube as direct media URLs, e.g. to serve test media from a local server
+MEDIA_FETCHER = os.environ.get("MEDIA_FETCHER", "youtube")
+# number of chunks whose token ids are cached by the hash of their audio window, such that audio recurring across
+# files (intros, jingles, re-cut uploads) skips the device; 0 disables the chunk cache
+CHUNK_CACHE_SIZE = int(os.environ.get("CHUNK_CACHE_SIZE", 10000))
+# concurrent requests for the same video or audio wait for a single download and transcription rather than each
+# running their own
+COALESCE_REQUESTS = os.environ.get("COALESCE_REQUESTS", "true").lower() == "true"
+# interval in seconds at which the window of a live (microphone) stream is re-decoded
+LIVE_STEP_S = float(os.environ.get("LIVE_STEP_S", 0.5))
 
 logger = logging.getLogger("whisper-jax-app")
 logger.setLevel(logging.INFO)
@@ -28,28 +65,47 @@ formatter = logging.Formatter("%(asctime)s;%(levelname)s;%(message)s", "%Y-%m-%d
 ch.setFormatter(formatter)
 logger.addHandler(ch)
 
-pipeline = FlaxWhisperPipline(checkpoint, dtype=jnp.bfloat16, batch_size=BATCH_SIZE) # use jnp.float16 on small GPU
+pipeline = FlaxWhisperPipline(
+    checkpoint,
+    dtype=jnp.bfloat16,
+    batch_size=BATCH_SIZE,
+    vad=VAD,
+    num_feature_workers=NUM_PROC,
+    chunk_cache=ChunkResultCache(max_entries=CHUNK_CACHE_SIZE) if CHUNK_CACHE_SIZE else None,
+)  # use jnp.float16 on small GPU
 stride_length_s = CHUNK_LENGTH_S / 6
 chunk_len = round(CHUNK_LENGTH_S * pipeline.feature_extractor.sampling_rate)
 stride_left = stride_right = round(stride_length_s * pipeline.feature_extractor.sampling_rate)
 step = chunk_len - stride_left - stride_right
-pool = Pool(NUM_PROC)
 
 # do a pre-compile step so that the first user to use the demo isn't hit with a long transcription time
 logger.info("compiling forward call...")
 start = time.time()
-random_inputs = {
-    "input_features": np.ones(
-        (BATCH_SIZE, pipeline.model.config.num_mel_bins, 2 * pipeline.model.config.max_source_positions)
-    )
-}
-random_timestamps = pipeline.forward(random_inputs, batch_size=BATCH_SIZE, return_timestamps=True)
+# compile each of the batch size buckets, such that short requests and tail batches are not padded to BATCH_SIZE
+pipeline.precompile(return_timestamps=True)
 compile_time = time.time() - start
 logger.info(f"compiled in {compile_time}s")
 
+# chunks from all in-flight requests share the same fixed-shape batches, so concurrent uploads fill each
+# `generate` call instead of each padding its own batch up to BATCH_SIZE
+scheduler_cls = InflightBatchScheduler if INFLIGHT_BATCHING else ContinuousBatchScheduler
+scheduler = scheduler_cls(pipeline, batch_size=BATCH_SIZE).start()
+
+transcription_cache = None
+if TRANSCRIPTION_CACHE:
+    transcription_cache = TranscriptionCache(
+        max_memory_bytes=TRANSCRIPTION_CACHE_MEMORY_MB * 1024 * 1024,
+        cache_dir=TRANSCRIPTION_CACHE_DIR,
+        ttl_s=TRANSCRIPTION_CACHE_TTL_S,
+    )
+
+single_flight = SingleFlight() if COALESCE_REQUESTS else None
+
+media_fetcher = HTTPMediaFetcher() if MEDIA_FETCHER == "http" else YoutubeAudioFetcher()
+media_cache = None
+if MEDIA_CACHE_GB:
+    media_cache = MediaCache(MEDIA_CACHE_DIR, max_bytes=int(MEDIA_CACHE_GB * 1024**3))
 
-def identity(batch):
-    return batch
 
 # Copied from https://github.com/openai/whisper/blob/c09a7ae299c4c34c5839a76380ae407e7d785914/whisper/utils.py#L50
 def format_timestamp(seconds: float, always_include_hours: bool = False, decimal_marker: str = "."):
@@ -71,89 +127,303 @@ def format_timestamp(seconds: float, always_include_hours: bool = False, decimal
         # we have a malformed timestamp so just return it as is
         return seconds
     
-def download_yt_audio(yt_url, filename):
-    info_loader = youtube_dl.YoutubeDL()
-    try:
-        info = info_loader.extract_info(yt_url, download=False)
-    except youtube_dl.utils.DownloadError as err:
-        raise RuntimeError(str(err))
-
-    file_length = info["duration_string"]
-    file_h_m_s = file_length.split(":")
-    file_h_m_s = [int(sub_length) for sub_length in file_h_m_s]
-    if len(file_h_m_s) == 1:
-        file_h_m_s.insert(0, 0)
-    if len(file_h_m_s) == 2:
-        file_h_m_s.insert(0, 0)
-
-    file_length_s = file_h_m_s[0] * 3600 + file_h_m_s[1] * 60 + file_h_m_s[2]
-    if file_length_s > YT_LENGTH_LIMIT_S:
+def check_youtube_length(file_length_s):
+    if file_length_s is not None and file_length_s > YT_LENGTH_LIMIT_S:
         yt_length_limit_hms = time.strftime("%HH:%MM:%SS", time.gmtime(YT_LENGTH_LIMIT_S))
         file_length_hms = time.strftime("%HH:%MM:%SS", time.gmtime(file_length_s))
         raise ValueError(f"Maximum YouTube length is {yt_length_limit_hms}, got {file_length_hms} YouTube video.")
 
-    ydl_opts = {"outtmpl": filename, "format": "worstvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best"}
-    with youtube_dl.YoutubeDL(ydl_opts) as ydl:
-        try:
-            ydl.download([yt_url])
-        except youtube_dl.utils.ExtractorError as err:
-            raise RuntimeError(str(err))
-
-def tqdm_generate(inputs: dict, task: str, return_timestamps: bool):
-    dataloader = pipeline.preprocess_batch(inputs, chunk_length_s=CHUNK_LENGTH_S, batch_size=BATCH_SIZE)
-    logger.info("pre-processing audio file...")
-    dataloader = pool.map(identity, dataloader)
-    logger.info("done post-processing")
+def fetch_youtube_audio(yt_url, media_id):
+    # returns the path of the cached audio of the video, or a file object that yields its audio-only stream while it
+    # downloads, such that ffmpeg decodes it as it arrives, and copies it into the media cache
+    if media_cache is not None:
+        filepath = media_cache.get(media_id)
+        if filepath is not None:
+            logger.info("media cache hit")
+            return filepath
+    media = media_fetcher.resolve(yt_url)
+    check_youtube_length(media["duration"])
+    stream = media_fetcher.open(media)
+    return media_cache.tee(media_id, stream) if media_cache is not None else stream
 
-    model_outputs = []
+def tqdm_generate(inputs, task: str, return_timestamps: bool, progress_callback=None, audio_digest=None):
     start_time = time.time()
     logger.info("transcribing...")
-    # iterate over our chunked audio samples - always predict timestamps to reduce hallucinations
-    for batch in dataloader:
-        model_outputs.append(pipeline.forward(batch, batch_size=BATCH_SIZE, task=task, return_timestamps=True))
+    # pre-processing runs in the calling thread, generation is shared with all other in-flight requests
+    # always predict timestamps to reduce hallucinations
+    request = scheduler.submit(
+        inputs,
+        chunk_length_s=CHUNK_LENGTH_S,
+        task=task,
+        return_timestamps=True,
+        adaptive_chunking=ADAPTIVE_CHUNKING,
+        progress_callback=None if progress_callback is None else lambda request: progress_callback(request.progress),
+        audio_digest=audio_digest,
+    )
+    if progress_callback is not None:
+        # keep reporting while the remaining chunks decode, and stop as soon as the last one is routed
+        while not request.wait_done(timeout=1.0):
+            progress_callback(request.progress)
+    model_outputs = request.model_outputs()
     runtime = time.time() - start_time
-    logger.info("done transcription")
+    logger.info(
+        f"done transcription of {request.num_chunks} chunks (batch fill ratio {scheduler.fill_ratio:.2f}, "
+        f"host/device overlap ratio {scheduler.overlap_ratio:.2f})"
+    )
+    if ADAPTIVE_CHUNKING:
+        # adaptive chunks tile the audio, so their lengths add up to the length of the file
+        num_samples = sum(stride[0] for stride in request.strides.values())
+        num_fixed_chunks = pipeline.num_fixed_chunks(num_samples, CHUNK_LENGTH_S)
+        logger.info(
+            f"adaptive chunking: {request.num_chunks} chunks instead of {num_fixed_chunks} "
+            f"({1 - request.num_chunks / num_fixed_chunks:.0%} compute saved)"
+        )
+    if pipeline.chunk_cache is not None:
+        logger.info(
+            f"chunk cache: {request.num_cached_chunks} of {request.num_cache_lookups} chunks cached "
+            f"(hit rate {request.chunk_hit_rate:.2f}, overall {pipeline.chunk_cache.hit_rate:.2f})"
+        )
 
     logger.info("post-processing...")
     post_processed = pipeline.postprocess(model_outputs, return_timestamps=True)
+    text = format_transcription(post_processed, return_timestamps)
+    logger.info("done post-processing")
+    return text, runtime
+
+def transcription_cache_key(audio_hash: str, task: str, return_timestamps: bool):
+    # every setting that changes the transcription is part of the key
+    return TranscriptionCache.make_key(
+        audio_hash,
+        checkpoint=checkpoint,
+        task=task,
+        language=None,
+        return_timestamps=return_timestamps,
+        chunk_length_s=CHUNK_LENGTH_S,
+        vad=VAD,
+        adaptive_chunking=ADAPTIVE_CHUNKING,
+    )
+
+def transcribe_once(key: str, transcribe):
+    # runs `transcribe` for the first of the concurrent requests with the same key, the others wait for its result
+    if single_flight is None:
+        return transcribe()
+    result, shared = single_flight.do(key, transcribe)
+    if shared:
+        logger.info(
+            f"joined an in-flight transcription ({single_flight.num_coalesced} of {single_flight.num_calls} "
+            "requests coalesced)"
+        )
+    return result
+
+def cached_generate(inputs, task: str, return_timestamps: bool, progress_callback=None, alias: str = None):
+    # `tqdm_generate` behind the transcription cache. The transcription is stored under the hash of the decoded audio,
+    # computed from the blocks ffmpeg decodes for the transcription itself, and under aliases that are looked up
+    # without decoding: the hash of the file bytes, and optionally an `alias` (e.g. a URL).
+    # Concurrent requests for the same file share a single transcription
+    start_time = time.time()
+    is_streamed = hasattr(inputs, "read") and not inputs.seekable()
+    # streamed inputs (e.g. a download) can only be read once, so their file bytes are not hashed
+    file_hash = None if is_streamed or (transcription_cache is None and single_flight is None) else hash_file(inputs)
+    file_key = None if file_hash is None else transcription_cache_key(file_hash, task, return_timestamps)
+
+    def transcribe():
+        # the cache is checked in flight, such that a request arriving just after an identical one has finished is
+        # served from the cache rather than transcribed again
+        if file_key is not None and transcription_cache is not None:
+            text = transcription_cache.get(file_key)
+            if text is not None:
+                log_cache_hit(time.time() - start_time)
+                return text
+        audio_digest = hashlib.sha256()
+        text, _ = tqdm_generate(
+            inputs,
+            task=task,
+            return_timestamps=return_timestamps,
+            progress_callback=progress_callback,
+            audio_digest=audio_digest,
+        )
+        if transcription_cache is not None:
+            for audio_hash in (audio_digest.hexdigest(), file_hash, alias):
+                if audio_hash is not None:
+                    transcription_cache.put(transcription_cache_key(audio_hash, task, return_timestamps), text)
+        return text
+
+    text = transcribe() if file_key is None else transcribe_once(file_key, transcribe)
+    return text, time.time() - start_time
+
+def log_cache_hit(runtime: float):
+    logger.info(f"transcription cache hit in {runtime * 1000:.0f}ms (hit rate {transcription_cache.hit_rate:.2f})")
+
+def format_segment(chunk: dict):
+    return f"[{format_timestamp(chunk['timestamp'][0])} -> {format_timestamp(chunk['timestamp'][1])}] {chunk['text']}"
+
+def format_transcription(post_processed: dict, return_timestamps: bool):
     text = post_processed["text"]
     if return_timestamps:
         timestamps = post_processed.get("chunks")
-        timestamps = [
-            f"[{format_timestamp(chunk['timestamp'][0])} -> {format_timestamp(chunk['timestamp'][1])}] {chunk['text']}"
-            for chunk in timestamps
-        ]
+        timestamps = [format_segment(chunk) for chunk in timestamps]
         text = "\n".join(str(feature) for feature in timestamps)
-    logger.info("done post-processing")
-    return text, runtime
+    return text
+
+def stream_generate(inputs, task: str, return_timestamps: bool):
+    start_time = time.time()
+    logger.info("transcribing (streaming)...")
+    # pre-processing runs in the background, such that the first chunks are decoded while the file is still read
+    request = scheduler.submit_nowait(
+        inputs,
+        chunk_length_s=CHUNK_LENGTH_S,
+        task=task,
+        return_timestamps=True,
+        adaptive_chunking=ADAPTIVE_CHUNKING,
+    )
+    time_to_first_segment = None
+    for segment in pipeline.postprocess_stream(request.iter_model_outputs()):
+        if time_to_first_segment is None:
+            time_to_first_segment = time.time() - start_time
+        yield {
+            "timestamp": segment["timestamp"],
+            "text": segment["text"],
+            "formatted": format_segment(segment) if return_timestamps else segment["text"],
+        }
+    runtime = time.time() - start_time
+    logger.info(
+        f"done streaming transcription of {request.num_chunks} chunks in {runtime:.1f}s "
+        f"(first segment after {time_to_first_segment or runtime:.1f}s)"
+    )
+    yield {"done": True, "runtime_seconds": runtime, "time_to_first_segment_seconds": time_to_first_segment}
+
+def multi_task_generate(inputs, tasks: list, return_timestamps: bool):
+    start_time = time.time()
+    logger.info(f"transcribing for tasks {tasks}...")
+    # the encoder runs once per chunk, and only the decoder is run for each task
+    # always predict timestamps to reduce hallucinations
+    generate_configs = [{"task": task, "return_timestamps": True} for task in tasks]
+    post_processed = pipeline.transcribe_multi(
+        inputs,
+        generate_configs,
+        chunk_length_s=CHUNK_LENGTH_S,
+        batch_size=BATCH_SIZE,
+        adaptive_chunking=ADAPTIVE_CHUNKING,
+    )
+    runtime = time.time() - start_time
+    logger.info("done transcription")
+    texts = {task: format_transcription(output, return_timestamps) for task, output in zip(tasks, post_processed)}
+    return texts, runtime
+
+def batch_generate(inputs: list, task: str, return_timestamps: bool):
+    start_time = time.time()
+    logger.info(f"transcribing a batch of {len(inputs)} files...")
+    # the chunks of all files are packed into full batches, rather than each short file padding a batch of its own
+    # as it would through the scheduler. Always predict timestamps to reduce hallucinations
+    post_processed = pipeline.transcribe_batch(
+        inputs,
+        chunk_length_s=CHUNK_LENGTH_S,
+        batch_size=BATCH_SIZE,
+        task=task,
+        return_timestamps=True,
+        adaptive_chunking=ADAPTIVE_CHUNKING,
+    )
+    runtime = time.time() - start_time
+    logger.info(f"done transcription of {len(inputs)} files in {runtime:.1f}s ({len(inputs) / runtime:.1f} files/s)")
+    return [format_transcription(output, return_timestamps) for output in post_processed], runtime
 
-def infer_audio(task: str, return_timestamps: str, contents: bytes):
-    inputs = ffmpeg_read(contents, pipeline.feature_extractor.sampling_rate)
-    inputs = {"array": inputs, "sampling_rate": pipeline.feature_extractor.sampling_rate}
-    logger.info("done loading")
+def infer_audio(task: str, return_timestamps: str, contents: Union[bytes, BinaryIO, str], progress_callback=None):
     return_timestamps_bool = True if return_timestamps.lower() == "true" else False
-    text, runtime = tqdm_generate(inputs, task=task, return_timestamps=return_timestamps_bool)
+    # the file is decoded by ffmpeg while its first chunks are already being transcribed
+    text, runtime = cached_generate(
+        contents, task=task, return_timestamps=return_timestamps_bool, progress_callback=progress_callback
+    )
     response_data = {
         "transcription": text,
         "runtime_seconds": runtime
     }
     return response_data
 
-def infer_youtube(youtube_url:str, task: str, return_timestamps: str):
-    with tempfile.TemporaryDirectory() as tmpdirname:
-        filepath = os.path.join(tmpdirname, "video.mp4")
-        download_yt_audio(youtube_url, filepath)
+def infer_audio_stream(task: str, return_timestamps: str, contents: Union[bytes, BinaryIO, str]):
+    return_timestamps_bool = True if return_timestamps.lower() == "true" else False
+    # yields each segment of the transcription as soon as it is stable, followed by a final "done" event
+    yield from stream_generate(contents, task=task, return_timestamps=return_timestamps_bool)
 
-        with open(filepath, "rb") as f:
-            inputs = f.read()
-    
-    inputs = ffmpeg_read(inputs, pipeline.feature_extractor.sampling_rate)
-    inputs = {"array": inputs, "sampling_rate": pipeline.feature_extractor.sampling_rate}
-    logger.info("done loading...")
+def infer_audio_multi(tasks: str, return_timestamps: str, contents: Union[bytes, BinaryIO]):
     return_timestamps_bool = True if return_timestamps.lower() == "true" else False
-    text, runtime = tqdm_generate(inputs, task=task, return_timestamps=return_timestamps_bool)
+    tasks = [task.strip() for task in tasks.split(",") if task.strip()]
+    texts, runtime = multi_task_generate(contents, tasks=tasks, return_timestamps=return_timestamps_bool)
+    response_data = {
+        "transcriptions": texts,
+        "runtime_seconds": runtime
+    }
+    return response_data
+
+def infer_batch(task: str, return_timestamps: str, contents: list):
+    return_timestamps_bool = True if return_timestamps.lower() == "true" else False
+    texts, runtime = batch_generate(contents, task=task, return_timestamps=return_timestamps_bool)
+    response_data = {
+        "transcriptions": texts,
+        "runtime_seconds": runtime
+    }
+    return response_data
+
+def infer_youtube(youtube_url:str, task: str, return_timestamps: str, progress_callback=None):
+    return_timestamps_bool = True if return_timestamps.lower() == "true" else False
+    # the many URL forms of a video (youtu.be links, shorts, extra query parameters) share its ID
+    alias = media_fetcher.media_id(youtube_url)
+    alias_key = transcription_cache_key(alias, task, return_timestamps_bool)
+
+    def transcribe():
+        if transcription_cache is not None:
+            # a video that was transcribed before is served without downloading it again
+            start_time = time.time()
+            text = transcription_cache.get(alias_key)
+            if text is not None:
+                runtime = time.time() - start_time
+                log_cache_hit(runtime)
+                return text, runtime
+        inputs = fetch_youtube_audio(youtube_url, alias)
+        try:
+            return cached_generate(
+                inputs,
+                task=task,
+                return_timestamps=return_timestamps_bool,
+                progress_callback=progress_callback,
+                alias=alias,
+            )
+        finally:
+            if hasattr(inputs, "close"):
+                inputs.close()
+
+    # concurrent requests for the same video share a single download and transcription
+    text, runtime = transcribe_once(alias_key, transcribe)
     response_data = {
         "transcription": text,
         "runtime_seconds": runtime
     }
-    return response_data
\ No newline at end of file
+    return response_data
+
+def run_job(payload: dict, report_progress):
+    # runs in the single worker thread of the job queue, the chunks are decoded by the shared scheduler
+    task, return_timestamps = payload["task"], payload["return_timestamps"]
+    if "youtube_url" in payload:
+        report_progress({"stage": "downloading"})
+        return infer_youtube(
+            payload["youtube_url"],
+            task,
+            return_timestamps,
+            progress_callback=lambda progress: report_progress({"stage": "transcribing", **progress}),
+        )
+    try:
+        return infer_audio(
+            task,
+            return_timestamps,
+            payload["filepath"],
+            progress_callback=lambda progress: report_progress({"stage": "transcribing", **progress}),
+        )
+    finally:
+        # the upload was saved for the job by the API, and is no longer needed
+        os.remove(payload["filepath"])
+
+# long transcriptions are submitted as jobs and polled for, rather than holding a connection until they finish
+job_queue = JobQueue(run_job, store=InMemoryJobStore(), max_queue_size=JOB_QUEUE_SIZE).start()
+
+def live_transcriber(task: str, language: str = None):
+    # each live stream decodes a single window at a time, in the smallest compiled batch size bucket
+    return LiveTranscriber(pipeline, language=language, task=task, step_s=LIVE_STEP_S)
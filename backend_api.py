@@ -1,7 +1,12 @@
 VERSION = '0.0.2'
 
-from fastapi import FastAPI, File, UploadFile
-from fastapi.responses import JSONResponse
+import asyncio, json, os, queue, shutil, tempfile
+from typing import List, Optional
+
+import numpy as np
+from fastapi import FastAPI, File, HTTPException, Query, UploadFile, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
 
 from backend import *
 
@@ -9,13 +14,158 @@ from backend import *
 app = FastAPI()
 
 
+def save_upload(file: UploadFile):
+    # the spooled upload is closed once the request handler returns, so it is saved for work that outlives it
+    with tempfile.NamedTemporaryFile(prefix="whisper-jax-upload-", delete=False) as f:
+        shutil.copyfileobj(file.file, f, 1024 * 1024)
+    return f.name
+
+
 @app.post("/infer_audio")
 def call_infer_audio(task: str, return_timestamps: str, file: UploadFile = File(...)):
-    contents = file.file.read()
-    response_data = infer_audio(task, return_timestamps, contents)
+    # the upload is spooled to disk by the server, hand the file object on so that it is streamed into ffmpeg
+    # rather than read into memory as a whole
+    response_data = infer_audio(task, return_timestamps, file.file)
+    return JSONResponse(content=response_data)
+
+@app.post("/infer_audio_stream")
+def call_infer_audio_stream(
+    task: str, return_timestamps: str, stream_format: str = "jsonl", file: UploadFile = File(...)
+):
+    # segments are sent as JSON lines, or as server-sent events with `stream_format=sse`
+    if stream_format not in ("jsonl", "sse"):
+        raise HTTPException(status_code=400, detail=f"`stream_format` must be 'jsonl' or 'sse', got {stream_format}.")
+    filepath = save_upload(file)
+
+    def events():
+        try:
+            for event in infer_audio_stream(task, return_timestamps, filepath):
+                data = json.dumps(event)
+                yield f"data: {data}\n\n" if stream_format == "sse" else f"{data}\n"
+        finally:
+            os.remove(filepath)
+
+    media_type = "text/event-stream" if stream_format == "sse" else "application/x-ndjson"
+    return StreamingResponse(events(), media_type=media_type)
+
+@app.post("/infer_audio_multi")
+def call_infer_audio_multi(tasks: str, return_timestamps: str, file: UploadFile = File(...)):
+    # `tasks` is a comma-separated list, e.g. "transcribe,translate"
+    response_data = infer_audio_multi(tasks, return_timestamps, file.file)
+    return JSONResponse(content=response_data)
+
+@app.post("/infer_batch")
+def call_infer_batch(
+    task: str, return_timestamps: str, urls: List[str] = Query([]), files: List[UploadFile] = File([])
+):
+    if not files and not urls:
+        raise HTTPException(status_code=400, detail="Pass audio `files`, media `urls` or both.")
+    # the chunks of all files are packed into shared batches, and the transcriptions are returned in the file order,
+    # followed by the URLs, which download in the background while the files before them are transcribed
+    response_data = infer_batch(task, return_timestamps, [file.file for file in files] + urls)
+    response_data["filenames"] = [file.filename for file in files] + urls
     return JSONResponse(content=response_data)
 
 @app.post("/infer_youtube")
 def call_infer_youtube(youtube_url:str, task: str, return_timestamps: str):
     response_data = infer_youtube(youtube_url, task, return_timestamps)
-    return JSONResponse(content=response_data)
\ No newline at end of file
+    return JSONResponse(content=response_data)
+
+@app.get("/cache_stats")
+def call_cache_stats():
+    # hit / miss counts of the transcription cache, and of the chunk and media caches if enabled
+    if transcription_cache is None:
+        raise HTTPException(status_code=404, detail="The transcription cache is disabled.")
+    stats = transcription_cache.stats
+    if pipeline.chunk_cache is not None:
+        stats["chunk_cache"] = pipeline.chunk_cache.stats
+    if media_cache is not None:
+        stats["media_cache"] = media_cache.stats
+    return stats
+
+@app.post("/jobs", status_code=202)
+def call_create_job(
+    task: str, return_timestamps: str, youtube_url: Optional[str] = None, file: Optional[UploadFile] = File(None)
+):
+    if (file is None) == (youtube_url is None):
+        raise HTTPException(status_code=400, detail="Pass either an audio `file` or a `youtube_url`.")
+    payload = {"task": task, "return_timestamps": return_timestamps}
+    if youtube_url is not None:
+        payload["youtube_url"] = youtube_url
+    else:
+        payload["filepath"] = save_upload(file)
+    try:
+        job_id = job_queue.submit(payload)
+    except queue.Full:
+        if "filepath" in payload:
+            os.remove(payload["filepath"])
+        raise HTTPException(
+            status_code=503, detail="Too many jobs are queued, retry later.", headers={"Retry-After": "60"}
+        )
+    return {"job_id": job_id, "status": "queued"}
+
+@app.get("/jobs/{job_id}")
+def call_get_job(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}.")
+    job.pop("result")
+    return job
+
+@app.get("/jobs/{job_id}/result")
+def call_get_job_result(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}.")
+    if job["status"] == "failed":
+        raise HTTPException(status_code=500, detail=f"Job {job_id} failed: {job['error']}")
+    if job["status"] != "succeeded":
+        raise HTTPException(
+            status_code=409, detail=f"Job {job_id} is {job['status']}, poll /jobs/{job_id} until it has succeeded."
+        )
+    return JSONResponse(content=job["result"])
+
+@app.websocket("/stream")
+async def stream_microphone(websocket: WebSocket, task: str = "transcribe", language: Optional[str] = None):
+    # the client sends 16kHz mono 16-bit PCM frames as binary messages, and the text message "end" once done. Each
+    # decode of the window is answered with the newly committed and the tentative text
+    await websocket.accept()
+    transcriber = live_transcriber(task, language)
+    ended = asyncio.Event()
+    disconnected = False
+
+    async def receive_audio():
+        nonlocal disconnected
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    disconnected = True
+                    break
+                if message.get("text") == "end":
+                    break
+                if message.get("bytes"):
+                    pcm = np.frombuffer(message["bytes"], dtype=np.int16)
+                    transcriber.add_audio(pcm.astype(np.float32) / 32768.0)
+        finally:
+            ended.set()
+
+    receiver = asyncio.create_task(receive_audio())
+    try:
+        while not ended.is_set():
+            try:
+                await asyncio.wait_for(ended.wait(), timeout=LIVE_STEP_S)
+            except asyncio.TimeoutError:
+                pass
+            # decoding blocks on the device, so it runs outside of the event loop
+            result = await run_in_threadpool(transcriber.update)
+            if result is not None and not disconnected:
+                await websocket.send_json(result)
+        if not disconnected:
+            result = await run_in_threadpool(transcriber.finish)
+            await websocket.send_json({**result, "done": True})
+            await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
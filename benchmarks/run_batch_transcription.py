@@ -0,0 +1,51 @@
+import argparse
+import time
+
+import jax.numpy as jnp
+from datasets import load_dataset
+from jax.experimental.compilation_cache import compilation_cache as cc
+
+from whisper_jax import FlaxWhisperPipline
+
+
+cc.initialize_cache("./jax_cache")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark transcribing many short clips one by one against packing their chunks into shared batches"
+    )
+    parser.add_argument("--checkpoint", type=str, default="openai/whisper-tiny", help="Checkpoint to benchmark.")
+    parser.add_argument("--batch_size", type=int, default=32, help="Number of chunks per batch.")
+    parser.add_argument("--num_clips", type=int, default=256, help="Number of clips to transcribe.")
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    args = parse_args()
+    pipeline = FlaxWhisperPipline(args.checkpoint, dtype=jnp.bfloat16, batch_size=args.batch_size)
+    pipeline.precompile()
+
+    # the dummy LibriSpeech utterances are a few seconds long, i.e. a single chunk each, like voicemail clips
+    librispeech = load_dataset("hf-internal-testing/librispeech_asr_dummy", "clean", split="validation")
+    audio = list(librispeech["audio"])
+    clips = [{"array": audio[idx % len(audio)]["array"], "sampling_rate": 16000} for idx in range(args.num_clips)]
+
+    start = time.time()
+    outputs = [pipeline(clip, batch_size=args.batch_size) for clip in clips]
+    per_clip_time = time.time() - start
+
+    start = time.time()
+    packed_outputs = pipeline.transcribe_batch(clips, batch_size=args.batch_size)
+    packed_time = time.time() - start
+
+    num_same = sum(output["text"] == packed["text"] for output, packed in zip(outputs, packed_outputs))
+    print(f"clips: {args.num_clips}, batch size: {args.batch_size}")
+    print(f"one by one: {per_clip_time:.2f}s ({args.num_clips / per_clip_time:.1f} clips/s)")
+    print(f"packed:     {packed_time:.2f}s ({args.num_clips / packed_time:.1f} clips/s)")
+    print(f"speed-up: {per_clip_time / packed_time:.1f}x, identical transcriptions: {num_same}/{args.num_clips}")
+
+
+if __name__ == "__main__":
+    main()
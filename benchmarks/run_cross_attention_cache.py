@@ -0,0 +1,74 @@
+import argparse
+import time
+
+import jax
+import jax.numpy as jnp
+import numpy as np
+from jax.experimental.compilation_cache import compilation_cache as cc
+from transformers import WhisperConfig
+
+from whisper_jax import FlaxWhisperForConditionalGeneration
+
+
+cc.initialize_cache("./jax_cache")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark per-token decoding latency with a cross-attention cache")
+    parser.add_argument("--checkpoint", type=str, default="openai/whisper-large-v3", help="Checkpoint config to use.")
+    parser.add_argument("--batch_size", type=int, default=32, help="Number of chunks decoded in parallel.")
+    parser.add_argument("--num_tokens", type=int, default=100, help="Number of decoding steps to time.")
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    args = parse_args()
+
+    config = WhisperConfig.from_pretrained(args.checkpoint)
+    model = FlaxWhisperForConditionalGeneration(config, _do_init=False, dtype=jnp.bfloat16)
+    # random weights are sufficient for timing
+    params = model.to_bf16(model.init_weights(model.key, model.input_shape))
+    max_length = model.config.max_target_positions
+
+    input_features = np.random.randn(args.batch_size, config.num_mel_bins, 2 * config.max_source_positions)
+    encoder_outputs = jax.jit(lambda params, x: model.encode(x, params=params))(params, input_features)
+    decoder_input_ids = jnp.full((args.batch_size, 1), config.decoder_start_token_id, dtype="i4")
+
+    @jax.jit
+    def decode_step(params, decoder_input_ids, model_kwargs):
+        outputs = model.decode(decoder_input_ids, params=params, **model_kwargs)
+        model_kwargs = model.update_inputs_for_generation(outputs, model_kwargs)
+        return jnp.argmax(outputs.logits[:, -1], axis=-1)[:, None], model_kwargs
+
+    def time_decoding(cross_attention_cache):
+        model_kwargs = model.prepare_inputs_for_generation(
+            decoder_input_ids,
+            max_length,
+            encoder_outputs=encoder_outputs,
+            cross_attention_cache=cross_attention_cache,
+        )
+        # warm-up step
+        next_tokens, model_kwargs = decode_step(params, decoder_input_ids, model_kwargs)
+        next_tokens.block_until_ready()
+
+        start = time.time()
+        for _ in range(args.num_tokens):
+            next_tokens, model_kwargs = decode_step(params, next_tokens, model_kwargs)
+        next_tokens.block_until_ready()
+        return (time.time() - start) / args.num_tokens
+
+    no_cache_latency = time_decoding(cross_attention_cache=None)
+    cross_attention_cache = jax.jit(lambda params, enc: model.init_cross_attention_cache(enc, params=params))(
+        params, encoder_outputs
+    )
+    cache_latency = time_decoding(cross_attention_cache=cross_attention_cache)
+
+    print(f"batch size: {args.batch_size}, decoding steps: {args.num_tokens}")
+    print(f"per-token latency without cross-attention cache: {1000 * no_cache_latency:.3f}ms")
+    print(f"per-token latency with cross-attention cache:    {1000 * cache_latency:.3f}ms")
+    print(f"speed-up: {no_cache_latency / cache_latency:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
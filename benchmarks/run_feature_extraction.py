@@ -0,0 +1,76 @@
+import argparse
+import time
+
+import numpy as np
+from transformers import WhisperFeatureExtractor
+
+from whisper_jax.feature_extraction import WhisperLogMelExtractor
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark batched log-mel feature extraction on long audio")
+    parser.add_argument("--audio_length_s", type=float, default=7200, help="Length of the (random) audio in seconds.")
+    parser.add_argument("--num_mel_bins", type=int, default=128, help="Number of mel bins (128 for large-v3).")
+    parser.add_argument("--batch_size", type=int, default=32, help="Number of chunks per feature extraction call.")
+    parser.add_argument("--chunk_length_s", type=float, default=30.0, help="Chunk length in seconds.")
+    parser.add_argument(
+        "--max_reference_batches",
+        type=int,
+        default=None,
+        help="Only time the first N batches with the reference `WhisperFeatureExtractor` (it is slow on long inputs).",
+    )
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    args = parse_args()
+
+    feature_extractor = WhisperFeatureExtractor(feature_size=args.num_mel_bins)
+    log_mel_extractor = WhisperLogMelExtractor.from_feature_extractor(feature_extractor)
+    sampling_rate = feature_extractor.sampling_rate
+
+    inputs = 0.1 * np.random.randn(int(args.audio_length_s * sampling_rate)).astype(np.float32)
+
+    # same chunking as `FlaxWhisperPipline.chunk_iter_with_batch` with the default stride of chunk_length_s / 6
+    chunk_len = round(args.chunk_length_s * sampling_rate)
+    stride = round(args.chunk_length_s / 6 * sampling_rate)
+    all_chunk_start_idx = np.arange(0, inputs.shape[0], chunk_len - 2 * stride)
+    batches = [
+        all_chunk_start_idx[idx]
+        for idx in np.array_split(
+            np.arange(len(all_chunk_start_idx)), int(np.ceil(len(all_chunk_start_idx) / args.batch_size))
+        )
+    ]
+    reference_batches = batches[: args.max_reference_batches] if args.max_reference_batches else batches
+
+    start = time.time()
+    reference_features = []
+    for chunk_start_idx in reference_batches:
+        chunks = [inputs[chunk_start : chunk_start + chunk_len] for chunk_start in chunk_start_idx]
+        reference_features.append(
+            feature_extractor(chunks, sampling_rate=sampling_rate, return_tensors="np").input_features
+        )
+    reference_runtime = time.time() - start
+
+    start = time.time()
+    features = [log_mel_extractor(inputs, chunk_start_idx, chunk_len) for chunk_start_idx in batches]
+    runtime = time.time() - start
+
+    max_diff = max(np.abs(ref - feat).max() for ref, feat in zip(reference_features, features))
+    num_reference_chunks = sum(len(chunk_start_idx) for chunk_start_idx in reference_batches)
+
+    print(f"audio length: {args.audio_length_s}s, {len(all_chunk_start_idx)} chunks of {args.chunk_length_s}s")
+    print(
+        f"WhisperFeatureExtractor: {num_reference_chunks / reference_runtime:.2f} chunks/s "
+        f"({reference_runtime:.2f}s for {num_reference_chunks} chunks)"
+    )
+    print(
+        f"WhisperLogMelExtractor:  {len(all_chunk_start_idx) / runtime:.2f} chunks/s "
+        f"({runtime:.2f}s for {len(all_chunk_start_idx)} chunks, {args.audio_length_s / runtime:.1f}x real-time)"
+    )
+    print(f"max abs difference: {max_diff:.2e}")
+
+
+if __name__ == "__main__":
+    main()
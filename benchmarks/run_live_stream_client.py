@@ -0,0 +1,88 @@
+import argparse
+import asyncio
+import json
+import time
+import wave
+
+import numpy as np
+import websockets
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Replays a WAV file at real-time speed to the live transcription WebSocket and measures the latency"
+    )
+    parser.add_argument("wav_file", type=str, help="WAV file (16-bit PCM) to replay.")
+    parser.add_argument("--url", type=str, default="ws://0.0.0.0:8000/stream", help="URL of the WebSocket endpoint.")
+    parser.add_argument("--task", type=str, default="transcribe", help="Task to run, transcribe or translate.")
+    parser.add_argument("--language", type=str, default=None, help="Language of the audio, detected if not set.")
+    parser.add_argument("--frame_ms", type=int, default=100, help="Duration of the audio frames sent to the server.")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed, relative to real-time.")
+    args = parser.parse_args()
+    return args
+
+
+def read_wav(path, sampling_rate=16000):
+    """Reads a 16-bit PCM WAV file as 16kHz mono int16 samples."""
+    with wave.open(path, "rb") as f:
+        if f.getsampwidth() != 2:
+            raise ValueError(f"Expected a 16-bit PCM WAV file, got {8 * f.getsampwidth()}-bit samples.")
+        audio = np.frombuffer(f.readframes(f.getnframes()), dtype=np.int16).astype(np.float32)
+        audio = audio.reshape(-1, f.getnchannels()).mean(axis=-1)
+        if f.getframerate() != sampling_rate:
+            num_samples = round(len(audio) * sampling_rate / f.getframerate())
+            audio = np.interp(np.arange(num_samples) * f.getframerate() / sampling_rate, np.arange(len(audio)), audio)
+    return audio.astype(np.int16)
+
+
+async def replay(args, audio, sampling_rate=16000):
+    frame_len = sampling_rate * args.frame_ms // 1000
+    frame_s = args.frame_ms / 1000
+    url = f"{args.url}?task={args.task}" + (f"&language={args.language}" if args.language else "")
+    latencies, decode_times = [], []
+    committed = []
+
+    async with websockets.connect(url, max_size=None) as websocket:
+        start = time.time()
+
+        async def send_audio():
+            for idx, frame_start in enumerate(range(0, len(audio), frame_len)):
+                # frame k holds the audio up to (k + 1) * frame_s, and is sent once that much audio was "recorded"
+                await asyncio.sleep(max(0.0, start + (idx + 1) * frame_s / args.speed - time.time()))
+                await websocket.send(audio[frame_start : frame_start + frame_len].tobytes())
+            await websocket.send("end")
+
+        sender = asyncio.create_task(send_audio())
+        async for message in websocket:
+            result = json.loads(message)
+            # time between sending the newest decoded sample and receiving its transcription
+            latencies.append(time.time() - (start + result["audio_time"] / args.speed))
+            if "decode_time" in result:
+                decode_times.append(result["decode_time"])
+            if result["committed"]:
+                committed.append(result["committed"])
+            print(f"[{result['audio_time']:7.2f}s] {''.join(committed)[-60:]!r} + {result['tentative']!r}")
+            if result.get("done"):
+                break
+        await sender
+
+    return latencies, decode_times, "".join(committed)
+
+
+def main():
+    args = parse_args()
+    audio = read_wav(args.wav_file)
+    latencies, decode_times, text = asyncio.run(replay(args, audio))
+
+    print(f"\ntranscription: {text}\n")
+    print(f"audio: {len(audio) / 16000:.1f}s replayed at {args.speed}x in frames of {args.frame_ms}ms")
+    if decode_times:
+        print(f"decodes: {len(decode_times)}, mean {np.mean(decode_times):.3f}s, max {np.max(decode_times):.3f}s")
+    print(
+        f"end-to-end latency: mean {np.mean(latencies):.3f}s, p50 {np.percentile(latencies, 50):.3f}s, "
+        f"p95 {np.percentile(latencies, 95):.3f}s, max {np.max(latencies):.3f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import argparse
+import time
+
+import jax
+import jax.numpy as jnp
+import numpy as np
+from datasets import load_dataset
+from jax.experimental.compilation_cache import compilation_cache as cc
+from transformers import WhisperProcessor
+
+from whisper_jax import FlaxWhisperForConditionalGeneration
+
+
+cc.initialize_cache("./jax_cache")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark decoding of batches padded with empty rows")
+    parser.add_argument("--checkpoint", type=str, default="openai/whisper-tiny", help="Checkpoint to benchmark.")
+    parser.add_argument("--batch_size", type=int, default=32, help="Number of rows in each (padded) batch.")
+    parser.add_argument(
+        "--num_real_rows",
+        type=int,
+        nargs="+",
+        default=[1, 4, 8, 16, 32],
+        help="Number of rows holding real audio, the remaining rows are zero padding.",
+    )
+    parser.add_argument("--num_batches", type=int, default=5, help="Number of batches to time for each setting.")
+    args = parser.parse_args()
+    return args
+
+
+def num_decoder_iterations(sequences, eos_token_id):
+    # the decoding loop runs until the last row emits EOS (padding rows emit it straight away)
+    is_eos = sequences[:, 1:] == eos_token_id
+    finished_at = np.where(is_eos.any(axis=-1), is_eos.argmax(axis=-1) + 1, sequences.shape[-1])
+    return finished_at.max()
+
+
+def main():
+    args = parse_args()
+
+    model, params = FlaxWhisperForConditionalGeneration.from_pretrained(
+        args.checkpoint, _do_init=False, dtype=jnp.bfloat16
+    )
+    processor = WhisperProcessor.from_pretrained(args.checkpoint)
+    eos_token_id = model.generation_config.eos_token_id
+    forced_decoder_ids = processor.get_decoder_prompt_ids(language="en", task="transcribe", no_timestamps=True)
+
+    librispeech = load_dataset("hf-internal-testing/librispeech_asr_dummy", "clean", split="validation")
+    audio = [sample["array"] for sample in librispeech["audio"][: args.batch_size]]
+    input_features = processor(audio, sampling_rate=16000, return_tensors="np").input_features
+
+    @jax.jit
+    def generate(params, input_features, row_mask):
+        return model.pipeline_generate(
+            input_features, forced_decoder_ids=forced_decoder_ids, params=params, row_mask=row_mask
+        ).sequences
+
+    def time_generate(batch, row_mask):
+        # warm-up step
+        sequences = np.asarray(generate(params, batch, row_mask))
+        start = time.time()
+        for _ in range(args.num_batches):
+            sequences = generate(params, batch, row_mask)
+        sequences = np.asarray(sequences)
+        return (time.time() - start) / args.num_batches, num_decoder_iterations(sequences, eos_token_id)
+
+    print(f"batch size: {args.batch_size}")
+    for num_real_rows in args.num_real_rows:
+        batch = np.zeros_like(input_features[: args.batch_size])
+        batch[:num_real_rows] = input_features[:num_real_rows]
+
+        # decode the padding rows as if they held audio, as the pipeline used to
+        padded_time, padded_steps = time_generate(batch, np.ones((args.batch_size,), dtype=bool))
+        masked_time, masked_steps = time_generate(batch, np.arange(args.batch_size) < num_real_rows)
+
+        print(
+            f"real rows: {num_real_rows:3d} | decoder iterations: {padded_steps:3d} -> {masked_steps:3d} "
+            f"({padded_steps - masked_steps} saved) | time per batch: {padded_time:.3f}s -> {masked_time:.3f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
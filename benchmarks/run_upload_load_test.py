@@ -0,0 +1,137 @@
+import argparse
+import os
+import struct
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Load test of the backend API with parallel large uploads, sampling the RSS of the server"
+    )
+    parser.add_argument("--url", type=str, default="http://0.0.0.0:8000", help="Base URL of the backend API.")
+    parser.add_argument("--pid", type=int, required=True, help="Process id of the API server, whose RSS is sampled.")
+    parser.add_argument("--num_uploads", type=int, default=4, help="Number of parallel uploads.")
+    parser.add_argument("--file_size_mb", type=float, default=1000, help="Size of each uploaded WAV file in MB.")
+    parser.add_argument(
+        "--sampling_rate",
+        type=int,
+        default=48000,
+        help="Sampling rate of the uploaded stereo float32 WAV file. A high rate gives a large file for little audio.",
+    )
+    parser.add_argument("--sample_interval_s", type=float, default=0.1, help="Interval between RSS samples.")
+    args = parser.parse_args()
+    return args
+
+
+def write_wav(path, size_bytes, sampling_rate, num_channels=2, block_s=10):
+    """Writes a stereo float32 WAV file of (about) `size_bytes` with low-level noise, block by block."""
+    bytes_per_frame = 4 * num_channels
+    num_frames = int(size_bytes // bytes_per_frame)
+    data_size = num_frames * bytes_per_frame
+    with open(path, "wb") as f:
+        f.write(b"RIFF" + struct.pack("<I", 36 + data_size) + b"WAVE")
+        # format 3: IEEE float
+        f.write(
+            b"fmt "
+            + struct.pack(
+                "<IHHIIHH", 16, 3, num_channels, sampling_rate, sampling_rate * bytes_per_frame, bytes_per_frame, 32
+            )
+        )
+        f.write(b"data" + struct.pack("<I", data_size))
+        rng = np.random.default_rng(0)
+        block_frames = block_s * sampling_rate
+        for start in range(0, num_frames, block_frames):
+            frames = min(block_frames, num_frames - start)
+            f.write((0.01 * rng.standard_normal((frames, num_channels))).astype(np.float32).tobytes())
+
+
+def multipart_body(path, boundary, block_size=1024 * 1024):
+    """Streams a multipart/form-data body with the file at `path`, such that the client does not load it either."""
+    yield (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="{os.path.basename(path)}"\r\n'
+        "Content-Type: audio/wav\r\n\r\n"
+    ).encode()
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            yield block
+    yield f"\r\n--{boundary}--\r\n".encode()
+
+
+def get_rss_mb(pid):
+    """Resident set size of `pid` and of all its descendants (e.g. ffmpeg decoders) in MB."""
+    rss_kb = 0
+    pids = [pid]
+    while pids:
+        pid = pids.pop()
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                rss_kb += next((int(line.split()[1]) for line in f if line.startswith("VmRSS:")), 0)
+            for task in os.listdir(f"/proc/{pid}/task"):
+                with open(f"/proc/{pid}/task/{task}/children") as f:
+                    pids.extend(int(child) for child in f.read().split())
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+    return rss_kb / 1024
+
+
+def upload(url, path):
+    boundary = uuid.uuid4().hex
+    start = time.time()
+    response = requests.post(
+        f"{url}/infer_audio",
+        params={"task": "transcribe", "return_timestamps": "false"},
+        data=multipart_body(path, boundary),
+        headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
+    )
+    response.raise_for_status()
+    return time.time() - start
+
+
+def main():
+    args = parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        path = os.path.join(tmpdirname, "upload.wav")
+        print(f"writing {args.file_size_mb:.0f}MB test file...")
+        write_wav(path, args.file_size_mb * 1024 * 1024, args.sampling_rate)
+
+        baseline_rss = get_rss_mb(args.pid)
+        samples = []
+        done = threading.Event()
+
+        def sample_rss():
+            while not done.is_set():
+                samples.append(get_rss_mb(args.pid))
+                time.sleep(args.sample_interval_s)
+
+        sampler = threading.Thread(target=sample_rss, daemon=True)
+        sampler.start()
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=args.num_uploads) as pool:
+            runtimes = list(pool.map(lambda _: upload(args.url, path), range(args.num_uploads)))
+        total_time = time.time() - start
+        done.set()
+        sampler.join()
+
+    peak_rss = max(samples, default=baseline_rss)
+    print(f"uploads: {args.num_uploads} x {args.file_size_mb:.0f}MB in {total_time:.1f}s")
+    print(f"request time: mean {np.mean(runtimes):.1f}s, max {np.max(runtimes):.1f}s")
+    print(
+        f"server RSS: baseline {baseline_rss:.0f}MB, peak {peak_rss:.0f}MB "
+        f"(+{peak_rss - baseline_rss:.0f}MB, {(peak_rss - baseline_rss) / args.num_uploads:.0f}MB per upload)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import argparse
+import functools
+import http.server
+import os
+import threading
+import time
+
+import requests
+
+from whisper_jax.media import HTTPStream, URLPrefetcher
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Compares fetching URL inputs one after the other with fetching them through the pooled, streaming "
+        "and prefetching download path"
+    )
+    parser.add_argument("urls", type=str, nargs="*", help="URLs of the media files to fetch.")
+    parser.add_argument(
+        "--serve_dir", type=str, default=None, help="Serve the files of this directory locally and fetch them instead."
+    )
+    parser.add_argument(
+        "--process_s", type=float, default=1.0, help="Simulated transcription time per file in seconds."
+    )
+    parser.add_argument("--max_prefetch", type=int, default=4, help="Number of files downloaded ahead.")
+    args = parser.parse_args()
+    return args
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(directory):
+    handler = functools.partial(QuietHandler, directory=directory)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    return [f"{base_url}/{name}" for name in sorted(os.listdir(directory))]
+
+
+def run_baseline(urls, process_s):
+    # a new connection per file, and the whole body is downloaded before it is processed
+    start = time.time()
+    first_bytes = None
+    for url in urls:
+        requests.get(url).content
+        first_bytes = first_bytes or time.time() - start
+        time.sleep(process_s)
+    return time.time() - start, first_bytes
+
+
+def run_streamed(urls, process_s):
+    # pooled connections, and processing starts with the first bytes of each file
+    start = time.time()
+    first_bytes = None
+    for url in urls:
+        with HTTPStream(url) as stream:
+            stream.read(64 * 1024)
+            first_bytes = first_bytes or time.time() - start
+            while stream.read(1024 * 1024):
+                pass
+        time.sleep(process_s)
+    return time.time() - start, first_bytes
+
+
+def run_prefetched(urls, process_s, max_prefetch):
+    # the next files download in the background while the current one is processed
+    start = time.time()
+    first_file = None
+    for _, file in URLPrefetcher(urls, max_prefetch=max_prefetch):
+        first_file = first_file or time.time() - start
+        file.read()
+        time.sleep(process_s)
+    return time.time() - start, first_file
+
+
+def main():
+    args = parse_args()
+    urls = serve(args.serve_dir) if args.serve_dir is not None else args.urls
+    if not urls:
+        raise ValueError("Pass the URLs to fetch, or a directory of files with --serve_dir.")
+
+    runtime, first_bytes = run_baseline(urls, args.process_s)
+    print(f"requests.get per file: {runtime:.2f}s for {len(urls)} files, first file after {first_bytes:.3f}s")
+    runtime, first_bytes = run_streamed(urls, args.process_s)
+    print(f"pooled streaming:      {runtime:.2f}s for {len(urls)} files, first bytes after {first_bytes:.3f}s")
+    runtime, first_file = run_prefetched(urls, args.process_s, args.max_prefetch)
+    print(
+        f"prefetch ({args.max_prefetch} ahead):    {runtime:.2f}s for {len(urls)} files, first file after "
+        f"{first_file:.3f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -29,18 +29,7 @@ def _return_yt_html_embed(yt_url: str):
 BACKEND_VERSION = '0.0.2'
 
 import time, tempfile, logging
-from multiprocessing import Pool
 
-import numpy as np
-import jax.numpy as jnp
-from jax.experimental.compilation_cache import compilation_cache as cc
-from transformers.pipelines.audio_utils import ffmpeg_read
-import yt_dlp as youtube_dl
-
-from whisper_jax import FlaxWhisperPipline
-
-
-cc.initialize_cache("./jax_cache")
 checkpoint = "openai/whisper-large-v3" #"openai/whisper-medium"
 
 BATCH_SIZE = 32
@@ -57,9 +46,6 @@ ch.setFormatter(formatter)
 logger.addHandler(ch)
 
 
-def identity(batch):
-    return batch
-
 # Copied from https://github.com/openai/whisper/blob/c09a7ae299c4c34c5839a76380ae407e7d785914/whisper/utils.py#L50
 def format_timestamp(seconds: float, always_include_hours: bool = False, decimal_marker: str = "."):
     if seconds is not None:
@@ -84,24 +70,32 @@ def format_timestamp(seconds: float, always_include_hours: bool = False, decimal
 
 if __name__ == "__main__":
     ### BACKEND... ###
-    pipeline = FlaxWhisperPipline(checkpoint, dtype=jnp.bfloat16, batch_size=BATCH_SIZE) # use jnp.float16 on small GPU
+    # the backend is only imported here: the spawned feature extraction workers re-import this module, and should not
+    # import (and initialise) JAX along with it
+    import jax.numpy as jnp
+    from jax.experimental.compilation_cache import compilation_cache as cc
+    from transformers.pipelines.audio_utils import ffmpeg_read
+    import yt_dlp as youtube_dl
+
+    from whisper_jax import FlaxWhisperPipline, PipelinedExecutor
+
+    cc.initialize_cache("./jax_cache")
+    pipeline = FlaxWhisperPipline(
+        checkpoint, dtype=jnp.bfloat16, batch_size=BATCH_SIZE, num_feature_workers=NUM_PROC
+    )  # use jnp.float16 on small GPU
     stride_length_s = CHUNK_LENGTH_S / 6
     chunk_len = round(CHUNK_LENGTH_S * pipeline.feature_extractor.sampling_rate)
     stride_left = stride_right = round(stride_length_s * pipeline.feature_extractor.sampling_rate)
     step = chunk_len - stride_left - stride_right
-    pool = Pool(NUM_PROC)
 
     # do a pre-compile step so that the first user to use the demo isn't hit with a long transcription time
     logger.info("compiling forward call...")
     start = time.time()
-    random_inputs = {
-        "input_features": np.ones(
-            (BATCH_SIZE, pipeline.model.config.num_mel_bins, 2 * pipeline.model.config.max_source_positions)
-        )
-    }
-    random_timestamps = pipeline.forward(random_inputs, batch_size=BATCH_SIZE, return_timestamps=True)
+    # compile each of the batch size buckets, such that short requests and tail batches are not padded to BATCH_SIZE
+    pipeline.precompile(return_timestamps=True)
     compile_time = time.time() - start
     logger.info(f"compiled in {compile_time}s")
+    executor = PipelinedExecutor(pipeline)
 
     def download_yt_audio(yt_url, filename):
         info_loader = youtube_dl.YoutubeDL()
@@ -132,17 +126,14 @@ if __name__ == "__main__":
                 raise RuntimeError(str(err))
 
     def tqdm_generate(inputs: dict, task: str, return_timestamps: bool):
-        dataloader = pipeline.preprocess_batch(inputs, chunk_length_s=CHUNK_LENGTH_S, batch_size=BATCH_SIZE)
-        logger.info("pre-processing audio file...")
-        dataloader = pool.map(identity, dataloader)
-        logger.info("done post-processing")
-
-        model_outputs = []
         start_time = time.time()
         logger.info("transcribing...")
+        # the features of each batch are computed by the feature extraction workers while the previous batch decodes
+        dataloader = pipeline.preprocess_batch(inputs, chunk_length_s=CHUNK_LENGTH_S, batch_size=BATCH_SIZE)
         # iterate over our chunked audio samples - always predict timestamps to reduce hallucinations
-        for batch in dataloader:
-            model_outputs.append(pipeline.forward(batch, batch_size=BATCH_SIZE, task=task, return_timestamps=True))
+        # the token ids of batch N are fetched in the background while batch N+1 is dispatched
+        model_outputs = executor.map(dataloader, batch_size=BATCH_SIZE, task=task, return_timestamps=True)
+        logger.info(f"host/device overlap ratio {executor.overlap_ratio:.2f}")
         runtime = time.time() - start_time
         logger.info("done transcription")
 
@@ -15,7 +15,55 @@
 
 __version__ = "0.0.1"
 
-from .modeling_flax_whisper import FlaxWhisperForConditionalGeneration
-from .partitioner import PjitPartitioner
-from .pipeline import FlaxWhisperPipline
-from .train_state import InferenceState
+import importlib
+from typing import TYPE_CHECKING
+
+
+# The public classes are imported lazily from their submodules, such that importing a lightweight submodule (e.g. the
+# feature extraction in a spawned pre-processing worker) does not import JAX, Flax and Transformers along with it.
+_import_structure = {
+    "cache": ["ChunkResultCache", "SingleFlight", "TranscriptionCache"],
+    "executor": ["PipelinedExecutor"],
+    "feature_pool": ["FeatureExtractionPool"],
+    "inflight": ["InflightDecodeEngine"],
+    "jobs": ["InMemoryJobStore", "JobQueue", "JobStore"],
+    "live": ["LiveTranscriber"],
+    "media": ["HTTPMediaFetcher", "HTTPStream", "MediaCache", "URLPrefetcher", "YoutubeAudioFetcher"],
+    "modeling_flax_whisper": ["FlaxWhisperForConditionalGeneration"],
+    "partitioner": ["PjitPartitioner"],
+    "pipeline": ["FlaxWhisperPipline"],
+    "scheduler": ["ContinuousBatchScheduler", "InflightBatchScheduler", "TranscriptionRequest"],
+    "train_state": ["InferenceState"],
+    "vad": ["VoiceActivityDetector"],
+}
+_name_to_module = {name: module for module, names in _import_structure.items() for name in names}
+
+__all__ = sorted(_name_to_module)
+
+
+def __getattr__(name):
+    if name not in _name_to_module:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{_name_to_module[name]}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
+
+
+if TYPE_CHECKING:
+    from .cache import ChunkResultCache, SingleFlight, TranscriptionCache
+    from .executor import PipelinedExecutor
+    from .feature_pool import FeatureExtractionPool
+    from .inflight import InflightDecodeEngine
+    from .jobs import InMemoryJobStore, JobQueue, JobStore
+    from .live import LiveTranscriber
+    from .media import HTTPMediaFetcher, HTTPStream, MediaCache, URLPrefetcher, YoutubeAudioFetcher
+    from .modeling_flax_whisper import FlaxWhisperForConditionalGeneration
+    from .partitioner import PjitPartitioner
+    from .pipeline import FlaxWhisperPipline
+    from .scheduler import ContinuousBatchScheduler, InflightBatchScheduler, TranscriptionRequest
+    from .train_state import InferenceState
+    from .vad import VoiceActivityDetector
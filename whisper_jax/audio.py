@@ -0,0 +1,283 @@
+# coding=utf-8
+# Copyright 2023 The HuggingFace Inc. team.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+
+import numpy as np
+
+
+# size of the pieces in which file objects are copied to ffmpeg or to a temporary file
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+class AudioRingBuffer:
+    """
+    Fixed-capacity float32 buffer over a stream of audio samples. Samples are addressed by their absolute index in the
+    stream, and the samples before a given index can be discarded once they have been consumed, which frees their
+    space for new samples.
+
+    Args:
+        capacity (`int`):
+            The maximum number of samples held at any time.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.buffer = np.zeros((capacity,), dtype=np.float32)
+        # absolute indices of the oldest sample held and of the sample after the newest one
+        self.start = 0
+        self.end = 0
+
+    def __len__(self):
+        return self.end - self.start
+
+    @property
+    def free(self):
+        return self.capacity - len(self)
+
+    def write(self, samples):
+        """Appends `samples` to the stream. Raises a `BufferError` if they do not fit in the free space."""
+        if len(samples) > self.free:
+            raise BufferError(f"Cannot write {len(samples)} samples to a ring buffer with {self.free} free samples.")
+        offset = self.end % self.capacity
+        num_head = min(len(samples), self.capacity - offset)
+        self.buffer[offset : offset + num_head] = samples[:num_head]
+        self.buffer[: len(samples) - num_head] = samples[num_head:]
+        self.end += len(samples)
+
+    def read(self, start, length):
+        """Returns a copy of the samples `[start, start + length)`, truncated to the samples written so far."""
+        if start < self.start:
+            raise IndexError(f"Sample {start} has already been discarded, the buffer starts at sample {self.start}.")
+        stop = min(start + length, self.end)
+        idx = np.arange(start, max(stop, start)) % self.capacity
+        return self.buffer[idx]
+
+    def discard(self, until):
+        """Frees the samples before the absolute index `until`."""
+        self.start = max(self.start, min(until, self.end))
+
+
+def ffmpeg_stream(inputs, sampling_rate, block_length=None):
+    """
+    Decodes an audio file with ffmpeg to mono float32 audio at `sampling_rate`, and yields the waveform in blocks as
+    ffmpeg produces them, rather than returning the whole waveform at the end as `ffmpeg_read` does.
+
+    Args:
+        inputs (`bytes`, `str` or file object):
+            The content of the audio file, the path to the audio file, or a binary file object, such as an uploaded
+            file. Bytes and file objects are fed to ffmpeg through a pipe, file objects in fixed-size pieces such that
+            they are never read into memory as a whole. Some containers (e.g. mp4 files with their index at the end)
+            can only be decoded from a seekable input: if nothing could be decoded from the pipe and the file object
+            is seekable, it is copied to a temporary file that ffmpeg reads instead.
+        sampling_rate (`int`):
+            The sampling rate to resample the audio to.
+        block_length (`int`, *optional*):
+            The number of samples per block. Defaults to one second of audio.
+    """
+    block_length = block_length if block_length is not None else sampling_rate
+    start_position = inputs.tell() if _is_seekable(inputs) else None
+
+    num_samples = 0
+    for block in _ffmpeg_blocks(inputs, sampling_rate, block_length):
+        num_samples += len(block)
+        yield block
+
+    if num_samples == 0 and start_position is not None:
+        with tempfile.NamedTemporaryFile(prefix="whisper-jax-") as f:
+            inputs.seek(start_position)
+            shutil.copyfileobj(inputs, f, COPY_BUFFER_SIZE)
+            f.flush()
+            for block in _ffmpeg_blocks(f.name, sampling_rate, block_length):
+                num_samples += len(block)
+                yield block
+
+    if num_samples == 0:
+        raise ValueError(
+            "Soundfile is either not in the correct format or is malformed. Ensure that the soundfile has "
+            "a valid audio file extension (e.g. wav, flac or mp3) and is not corrupted. If reading from a remote "
+            "URL, ensure that the URL is the full address to **download** the audio file."
+        )
+
+
+def hash_audio(inputs, sampling_rate):
+    """
+    Returns the SHA-256 hex digest of the audio in `inputs` decoded with [`ffmpeg_stream`], i.e. of its mono float32
+    PCM at `sampling_rate`. Unlike a hash of the file, the digest does not depend on the container or its metadata, so
+    the same recording uploaded twice hashes the same. The audio is hashed block by block and never held in memory.
+    To hash the audio while it is decoded for transcription instead, see [`hash_blocks`].
+
+    Args:
+        inputs (`bytes`, `str` or file object):
+            The audio file, as accepted by [`ffmpeg_stream`]. A file object must be seekable: it is read to the end
+            and then rewound to its current position, such that it can be decoded again for the transcription.
+        sampling_rate (`int`):
+            The sampling rate the audio is resampled to before hashing.
+    """
+    start_position = None
+    if hasattr(inputs, "read"):
+        if not _is_seekable(inputs):
+            raise ValueError("Cannot hash a file object that is not seekable, as it could not be decoded again.")
+        start_position = inputs.tell()
+
+    digest = hashlib.sha256()
+    try:
+        for _ in hash_blocks(ffmpeg_stream(inputs, sampling_rate), digest):
+            pass
+    finally:
+        if start_position is not None:
+            inputs.seek(start_position)
+    return digest.hexdigest()
+
+
+def hash_blocks(blocks, digest):
+    """
+    Passes through the audio `blocks` of [`ffmpeg_stream`], updating `digest` (a `hashlib` hash object) with each
+    block as it is yielded. Once the blocks are exhausted, a SHA-256 `digest` holds the same digest as
+    [`hash_audio`] over the same file, without decoding it a second time.
+    """
+    for block in blocks:
+        digest.update(np.asarray(block, dtype=np.float32).tobytes())
+        yield block
+
+
+def hash_file(inputs):
+    """
+    Returns the BLAKE2b hex digest of the bytes of the audio file `inputs`, without decoding it. Much cheaper than
+    [`hash_audio`], but the digest changes with the container and its metadata, so it is only suited to recognise
+    re-submissions of the same file.
+
+    Args:
+        inputs (`bytes`, `str` or file object):
+            The content of the audio file, the path to the audio file, or a seekable binary file object, which is read
+            in fixed-size pieces and then rewound to its current position.
+    """
+    digest = hashlib.blake2b()
+    if isinstance(inputs, (bytes, bytearray, memoryview)):
+        digest.update(inputs)
+        return digest.hexdigest()
+    if not hasattr(inputs, "read"):
+        with open(inputs, "rb") as f:
+            return hash_file(f)
+    if not _is_seekable(inputs):
+        raise ValueError("Cannot hash a file object that is not seekable, as it could not be decoded afterwards.")
+    start_position = inputs.tell()
+    try:
+        for piece in iter(lambda: inputs.read(COPY_BUFFER_SIZE), b""):
+            digest.update(piece)
+    finally:
+        inputs.seek(start_position)
+    return digest.hexdigest()
+
+
+def _is_seekable(inputs):
+    return hasattr(inputs, "read") and hasattr(inputs, "seekable") and inputs.seekable()
+
+
+def _ffmpeg_blocks(inputs, sampling_rate, block_length):
+    from_file = isinstance(inputs, (str, os.PathLike))
+    ffmpeg_command = [
+        "ffmpeg",
+        "-i",
+        os.fspath(inputs) if from_file else "pipe:0",
+        "-ac",
+        "1",
+        "-ar",
+        f"{sampling_rate}",
+        "-f",
+        "f32le",
+        "-hide_banner",
+        "-loglevel",
+        "quiet",
+        "pipe:1",
+    ]
+
+    try:
+        ffmpeg_process = subprocess.Popen(
+            ffmpeg_command, stdin=subprocess.DEVNULL if from_file else subprocess.PIPE, stdout=subprocess.PIPE
+        )
+    except FileNotFoundError as error:
+        raise ValueError("ffmpeg was not found but is required to load audio files from filename") from error
+
+    def feed_stdin():
+        try:
+            if isinstance(inputs, (bytes, bytearray, memoryview)):
+                ffmpeg_process.stdin.write(inputs)
+            else:
+                shutil.copyfileobj(inputs, ffmpeg_process.stdin, COPY_BUFFER_SIZE)
+        except (BrokenPipeError, ValueError):
+            # ffmpeg stopped reading, e.g. because the consumer closed the stream
+            pass
+        finally:
+            try:
+                ffmpeg_process.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    # feed the input in a separate thread, ffmpeg would otherwise block on a full stdout pipe while we write stdin
+    writer = None
+    if not from_file:
+        writer = threading.Thread(target=feed_stdin, name="whisper-jax-ffmpeg-stdin", daemon=True)
+        writer.start()
+
+    try:
+        while True:
+            block = ffmpeg_process.stdout.read(4 * block_length)
+            if not block:
+                break
+            yield np.frombuffer(block, dtype=np.float32)
+    finally:
+        if ffmpeg_process.poll() is None:
+            ffmpeg_process.kill()
+        ffmpeg_process.stdout.close()
+        ffmpeg_process.wait()
+        if writer is not None:
+            writer.join()
+
+
+def stream_windows(blocks, window_len, step):
+    """
+    Slices a stream of audio blocks into the windows `[k * step, k * step + window_len)` for `k = 0, 1, ...`, with
+    the same windows as chunking the full waveform. The blocks are buffered in an [`AudioRingBuffer`] of
+    `window_len + step` samples, such that memory is bounded independently of the length of the stream.
+
+    Yields `(window_start, window, num_samples)` tuples. A window is only yielded once the stream has continued past
+    its end, or once the stream has ended, in which case the last windows are shorter than `window_len`.
+    `num_samples` is the total length of the stream once known (i.e. for the windows yielded after the end of the
+    stream), and `None` otherwise.
+    """
+    ring = AudioRingBuffer(window_len + step)
+    window_start = 0
+    for block in blocks:
+        offset = 0
+        while offset < len(block):
+            num_written = min(len(block) - offset, ring.free)
+            ring.write(block[offset : offset + num_written])
+            offset += num_written
+            # the capacity exceeds the window length, so a full buffer always holds a complete window
+            while ring.end > window_start + window_len:
+                yield window_start, ring.read(window_start, window_len), None
+                window_start += step
+                ring.discard(window_start)
+
+    num_samples = ring.end
+    while window_start < num_samples:
+        yield window_start, ring.read(window_start, window_len), num_samples
+        window_start += step
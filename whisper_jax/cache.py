@@ -0,0 +1,299 @@
+# coding=utf-8
+# Copyright 2023 The HuggingFace Inc. team.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import concurrent.futures
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+
+class TranscriptionCache:
+    def __init__(self, max_memory_bytes=256 * 1024 * 1024, cache_dir=None, ttl_s=7 * 24 * 3600, sweep_interval_s=3600):
+        """
+        Two-tier cache of transcriptions, keyed by content (see [`make_key`]) rather than by file name or upload, such
+        that re-submitted recordings are served without running the model again. Values are JSON-serialisable objects.
+
+        The first tier is an in-memory LRU bounded by the total size of the serialised values. The optional second tier
+        keeps one JSON file per entry in `cache_dir`, which survives restarts and is shared by all processes using the
+        same directory. Entries on disk expire `ttl_s` seconds after they were written; expired entries are deleted
+        when they are looked up, and by a sweep of the directory at most every `sweep_interval_s` seconds. Disk hits
+        are promoted to the memory tier.
+
+        Args:
+            max_memory_bytes (`int`, *optional*, defaults to 256MB):
+                The maximum total size of the serialised values held in memory. The least recently used entries are
+                evicted first.
+            cache_dir (`str`, *optional*):
+                The directory of the disk tier. Only the memory tier is used if not set.
+            ttl_s (`float`, *optional*, defaults to 7 days):
+                The time to live of the entries on disk, in seconds.
+            sweep_interval_s (`float`, *optional*, defaults to 3600):
+                The minimum interval between two sweeps of the disk tier for expired entries, in seconds.
+        """
+        self.max_memory_bytes = max_memory_bytes
+        self.cache_dir = cache_dir
+        self.ttl_s = ttl_s
+        self.sweep_interval_s = sweep_interval_s
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+        # key -> (serialised value, size in bytes), in least to most recently used order
+        self._memory = collections.OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._last_sweep = time.time()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(audio_hash, **config):
+        """
+        Returns the cache key of the audio with content hash `audio_hash` (e.g. from [`hash_audio`]) transcribed with
+        the given `config`, e.g. the task, language, timestamps and checkpoint. Every setting that changes the output
+        must be part of the config.
+        """
+        config = json.dumps(config, sort_keys=True, default=str)
+        return hashlib.sha256(f"{audio_hash}:{config}".encode()).hexdigest()
+
+    @property
+    def hit_rate(self):
+        num_lookups = self.memory_hits + self.disk_hits + self.misses
+        if num_lookups == 0:
+            return 0.0
+        return (self.memory_hits + self.disk_hits) / num_lookups
+
+    @property
+    def stats(self):
+        """The hit / miss counts and the size of the memory tier."""
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_bytes,
+        }
+
+    def get(self, key):
+        """Returns the value cached for `key`, or `None` on a miss."""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return json.loads(self._memory[key][0])
+
+        serialised = self._read_disk(key)
+        with self._lock:
+            if serialised is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._put_memory(key, serialised)
+        return json.loads(serialised)
+
+    def put(self, key, value):
+        """Caches `value` for `key` in both tiers."""
+        serialised = json.dumps(value)
+        with self._lock:
+            self._put_memory(key, serialised)
+        if self.cache_dir is not None:
+            self._write_disk(key, serialised)
+            if time.time() - self._last_sweep > self.sweep_interval_s:
+                self.sweep()
+
+    def sweep(self):
+        """Deletes the expired entries of the disk tier."""
+        self._last_sweep = time.time()
+        if self.cache_dir is None:
+            return
+        for dirpath, _, filenames in os.walk(self.cache_dir):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    if self._is_expired(path):
+                        os.remove(path)
+                except FileNotFoundError:
+                    # removed concurrently, e.g. by another process sharing the directory
+                    pass
+
+    def _put_memory(self, key, serialised):
+        size = len(serialised)
+        if key in self._memory:
+            self._memory_bytes -= self._memory.pop(key)[1]
+        if size > self.max_memory_bytes:
+            return
+        self._memory[key] = (serialised, size)
+        self._memory_bytes += size
+        while self._memory_bytes > self.max_memory_bytes:
+            _, (_, evicted_size) = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted_size
+
+    def _path(self, key):
+        # a level of sub-directories keeps the number of files per directory manageable
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _is_expired(self, path):
+        return time.time() - os.path.getmtime(path) > self.ttl_s
+
+    def _read_disk(self, key):
+        if self.cache_dir is None:
+            return None
+        path = self._path(key)
+        try:
+            if self._is_expired(path):
+                os.remove(path)
+                return None
+            with open(path) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _write_disk(self, key, serialised):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file and rename it, such that readers never see a partially written entry
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(serialised)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+
+class ChunkResultCache:
+    def __init__(self, max_entries=10000):
+        """
+        Cache of the token ids decoded for single chunks, keyed by the hash of the audio window of each chunk (see
+        [`hash_window`]) and the config it was decoded with. Chunks whose window was decoded before, e.g. a recurring
+        intro or jingle, or the overlapping part of a re-cut upload, are taken from the cache rather than run on
+        device. The least recently used entries are evicted first.
+
+        The token ids depend on the checkpoint and the maximum generation length, so a cache must not be shared by
+        pipelines that differ in either.
+
+        Args:
+            max_entries (`int`, *optional*, defaults to 10000):
+                The maximum number of chunks held, each taking `4 * max_length` bytes.
+        """
+        self.max_entries = max_entries
+        # key -> token ids, in least to most recently used order
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def hash_window(window):
+        """
+        Returns the hash of the samples of an audio window. Windows are zero-padded to the chunk length before feature
+        extraction, so the unpadded samples determine the model inputs.
+        """
+        window = np.ascontiguousarray(window, dtype=np.float32)
+        return hashlib.blake2b(window.tobytes(), digest_size=16).hexdigest()
+
+    @property
+    def hit_rate(self):
+        num_lookups = self.hits + self.misses
+        if num_lookups == 0:
+            return 0.0
+        return self.hits / num_lookups
+
+    @property
+    def stats(self):
+        """The hit / miss counts and the number of cached chunks."""
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hit_rate, "entries": len(self._entries)}
+
+    def get(self, key):
+        """Returns the token ids cached for `key`, or `None` on a miss."""
+        with self._lock:
+            tokens = self._entries.get(key)
+            if tokens is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return tokens
+
+    def put(self, key, tokens):
+        """Caches the token ids `tokens` of a single chunk for `key`."""
+        # copy, such that the entry does not keep the token ids of the whole batch alive
+        tokens = np.array(tokens)
+        tokens.flags.writeable = False
+        with self._lock:
+            self._entries[key] = tokens
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls of the same computation: the first caller of [`do`] with a given key runs it, and the
+    callers that arrive with the same key while it is still running wait for it and receive its result (or its
+    exception) rather than running it again. Once it has finished, the next call with the key runs it anew, such that
+    results are not cached beyond the calls they were computed for (see [`TranscriptionCache`] for that). The result
+    object is shared by all the coalesced callers, so it must not be modified.
+    """
+
+    def __init__(self):
+        # key -> future of the computation in flight
+        self._calls = {}
+        self._lock = threading.Lock()
+
+        self.num_calls = 0
+        self.num_coalesced = 0
+
+    @property
+    def num_in_flight(self):
+        return len(self._calls)
+
+    def do(self, key, fn):
+        """
+        Returns `(fn(), shared)`, where `fn` is only called if no call with the same `key` is in flight, and `shared`
+        is whether the result was computed for another caller.
+        """
+        with self._lock:
+            self.num_calls += 1
+            future = self._calls.get(key)
+            shared = future is not None
+            if shared:
+                self.num_coalesced += 1
+            else:
+                future = self._calls[key] = concurrent.futures.Future()
+        if shared:
+            return future.result(), True
+
+        try:
+            result = fn()
+        except BaseException as err:
+            future.set_exception(err)
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            with self._lock:
+                del self._calls[key]
+        return result, False
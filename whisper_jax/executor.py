@@ -0,0 +1,149 @@
+# coding=utf-8
+# Copyright 2023 The HuggingFace Inc. team.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import contextlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from transformers.utils import logging
+
+
+logger = logging.get_logger(__name__)
+
+
+class PipelinedExecutor:
+    def __init__(self, pipeline, max_in_flight=2):
+        """
+        Overlaps the host and device work of [`FlaxWhisperPipline`]. Batches are dispatched with
+        [`~FlaxWhisperPipline.forward_async`], which returns as soon as the inputs are copied to device and generation
+        is enqueued. The blocking `jax.device_get` of the token ids is deferred to a background thread, such that the
+        host can pre-process and transfer batch N+1 while batch N is decoded.
+
+        The executor keeps track of the time spent on host work (pre-processing and dispatch), and of how much of it
+        was spent while a batch was being decoded, i.e. was hidden behind device compute. The ratio of the two is
+        reported as the `overlap_ratio`.
+
+        Args
+            pipeline (`FlaxWhisperPipline`):
+                The pipeline used for generation.
+            max_in_flight (`int`, *optional*, defaults to 2):
+                The maximum number of batches that are dispatched but not yet fetched. The default of 2 gives double
+                buffering: one batch decoding on device while the next one is prepared. Dispatching a batch blocks
+                while the limit is reached, which bounds the device memory taken by pending inputs and outputs.
+        """
+        if max_in_flight < 1:
+            raise ValueError(f"`max_in_flight` must be a positive integer, got {max_in_flight}.")
+        self.pipeline = pipeline
+        self.max_in_flight = max_in_flight
+
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._lock = threading.Lock()
+        # a single fetch thread returns the outputs in dispatch order
+        self._fetcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="whisper-jax-fetch")
+        self._num_in_flight = 0
+
+        self.host_time = 0.0
+        self.hidden_host_time = 0.0
+        self.fetch_time = 0.0
+        self.num_batches = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._fetcher.shutdown(wait=True)
+
+    @property
+    def overlap_ratio(self):
+        """Fraction of the host time that was spent while at least one batch was being decoded on device."""
+        if self.host_time == 0:
+            return 0.0
+        return self.hidden_host_time / self.host_time
+
+    @contextlib.contextmanager
+    def host_work(self):
+        """Context manager that records the enclosed host work for the overlap statistics."""
+        with self._lock:
+            overlapped = self._num_in_flight > 0
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.host_time += elapsed
+                if overlapped:
+                    self.hidden_host_time += elapsed
+
+    def submit(self, model_inputs, **forward_kwargs):
+        """
+        Dispatches one batch of pre-processed inputs and returns a `concurrent.futures.Future` that resolves to the
+        output of [`~FlaxWhisperPipline.forward`]. Blocks while `max_in_flight` batches are still pending. Keyword
+        arguments are forwarded to [`~FlaxWhisperPipline.forward_async`].
+        """
+        # waiting for a free slot is waiting on the device, so is not counted as host work
+        self._slots.acquire()
+        try:
+            with self.host_work():
+                outputs = self.pipeline.forward_async(model_inputs, **forward_kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._num_in_flight += 1
+            self.num_batches += 1
+        return self._fetcher.submit(self._fetch, outputs)
+
+    def _fetch(self, outputs):
+        start = time.perf_counter()
+        try:
+            return self.pipeline.fetch_outputs(outputs)
+        finally:
+            with self._lock:
+                self.fetch_time += time.perf_counter() - start
+                self._num_in_flight -= 1
+            self._slots.release()
+
+    def map(self, batches, **forward_kwargs):
+        """
+        Runs generation over an iterable of pre-processed batches, such as the one returned by
+        [`~FlaxWhisperPipline.preprocess_batch`], and returns the list of outputs in order. The batches are pulled from
+        the iterable while the previous batches decode, so lazy pre-processing is overlapped with device compute.
+        """
+        host_time, hidden_host_time = self.host_time, self.hidden_host_time
+        start = time.perf_counter()
+
+        futures = []
+        batches = iter(batches)
+        while True:
+            with self.host_work():
+                batch = next(batches, None)
+            if batch is None:
+                break
+            futures.append(self.submit(batch, **forward_kwargs))
+        model_outputs = [future.result() for future in futures]
+
+        host_time = self.host_time - host_time
+        hidden_host_time = self.hidden_host_time - hidden_host_time
+        logger.info(
+            f"Generated {len(futures)} batches in {time.perf_counter() - start:.2f}s, host time {host_time:.2f}s, "
+            f"overlap ratio {hidden_host_time / host_time if host_time > 0 else 0.0:.2f}"
+        )
+        return model_outputs
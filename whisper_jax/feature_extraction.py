@@ -0,0 +1,170 @@
+# coding=utf-8
+# Copyright 2023 The HuggingFace Inc. team.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+
+
+# this module only depends on NumPy (and optionally SciPy) at import time, such that pre-processing worker processes
+# can use it without importing JAX, see `whisper_jax.feature_worker`
+try:
+    # unlike `numpy.fft`, `scipy.fft` keeps float32 inputs in single precision
+    from scipy import fft as rfft_backend
+except ImportError:
+    rfft_backend = np.fft
+
+# full scale of 16-bit PCM audio
+PCM16_SCALE = 32768.0
+
+
+class WhisperLogMelExtractor:
+    """
+    Vectorized version of the log-mel feature extraction of [`WhisperFeatureExtractor`]. Rather than computing the
+    STFT of each chunk frame-by-frame, all frames of a batch of chunks are taken as strided views over a single padded
+    buffer and transformed with one batched rFFT. The Hann window and mel filterbank are pre-computed, and the
+    computation runs in float32 end to end. The resulting features match those of [`WhisperFeatureExtractor`] within
+    float32 tolerance.
+
+    Args:
+        feature_size (`int`, *optional*, defaults to 80):
+            The number of mel bins.
+        sampling_rate (`int`, *optional*, defaults to 16000):
+            The sampling rate of the audio in Hz.
+        hop_length (`int`, *optional*, defaults to 160):
+            The hop length of the STFT.
+        chunk_length (`int`, *optional*, defaults to 30):
+            The length in seconds that every chunk is padded (or truncated) to.
+        n_fft (`int`, *optional*, defaults to 400):
+            The size of the Fourier transform.
+        mel_filters (`np.ndarray` of shape `(n_fft // 2 + 1, feature_size)`):
+            The mel filterbank. Typically taken from an existing [`WhisperFeatureExtractor`], see
+            [`~WhisperLogMelExtractor.from_feature_extractor`].
+    """
+
+    def __init__(
+        self, feature_size=80, sampling_rate=16000, hop_length=160, chunk_length=30, n_fft=400, mel_filters=None
+    ):
+        if mel_filters is None:
+            raise ValueError("A mel filterbank of shape `(n_fft // 2 + 1, feature_size)` is required.")
+        self.feature_size = feature_size
+        self.sampling_rate = sampling_rate
+        self.hop_length = hop_length
+        self.chunk_length = chunk_length
+        self.n_fft = n_fft
+        self.n_samples = chunk_length * sampling_rate
+        self.nb_max_frames = self.n_samples // hop_length
+
+        # periodic Hann window, as `transformers.audio_utils.window_function(n_fft, "hann")`
+        self.window = np.hanning(n_fft + 1)[:-1].astype(np.float32)
+        self.mel_filters = np.asarray(mel_filters, dtype=np.float32)
+
+    @classmethod
+    def from_feature_extractor(cls, feature_extractor):
+        return cls(
+            feature_size=feature_extractor.feature_size,
+            sampling_rate=feature_extractor.sampling_rate,
+            hop_length=feature_extractor.hop_length,
+            chunk_length=feature_extractor.chunk_length,
+            n_fft=feature_extractor.n_fft,
+            mel_filters=feature_extractor.mel_filters,
+        )
+
+    def pad_chunks(self, inputs, chunk_start_idx, chunk_len, center=True, dtype=np.float32):
+        """
+        Copies the chunks `inputs[start : start + chunk_len]` into a single float32 buffer, zero-padded to
+        `n_samples`. `chunk_len` is either shared by all chunks or given per chunk. If `center=True`, the chunks are
+        additionally reflect-padded by `n_fft // 2` on both sides (as for `center=True` in the STFT), giving a buffer
+        of shape `(num_chunks, n_samples + n_fft)`. With `dtype=np.int16`, the chunks are quantized to 16-bit PCM
+        (see [`~WhisperLogMelExtractor.to_pcm16`]) instead, which halves the size of the buffer.
+        """
+        n_pad = self.n_fft // 2 if center else 0
+        chunk_lens = np.minimum(np.broadcast_to(chunk_len, (len(chunk_start_idx),)), self.n_samples)
+        padded = np.zeros((len(chunk_start_idx), self.n_samples + 2 * n_pad), dtype=dtype)
+        for row, (chunk_start, chunk_len) in enumerate(zip(chunk_start_idx, chunk_lens)):
+            chunk = inputs[chunk_start : chunk_start + chunk_len]
+            if padded.dtype == np.int16:
+                chunk = self.to_pcm16(chunk)
+            padded[row, n_pad : n_pad + chunk.shape[0]] = chunk
+
+        if center:
+            padded[:, :n_pad] = padded[:, 2 * n_pad : n_pad : -1]
+            padded[:, n_pad + self.n_samples :] = padded[:, n_pad + self.n_samples - 2 : self.n_samples - 2 : -1]
+        return padded
+
+    @staticmethod
+    def to_pcm16(waveform):
+        """Quantizes float audio in `[-1, 1]` to 16-bit PCM, clipping the samples outside of this range."""
+        return np.clip(np.rint(waveform * PCM16_SCALE), -PCM16_SCALE, PCM16_SCALE - 1).astype(np.int16)
+
+    def log_mel_spectrogram(self, padded):
+        """Computes the normalised log-mel spectrogram of a batch of padded chunks returned by `pad_chunks`."""
+        # (num_chunks, num_frames, n_fft) view over the padded buffer - only the windowing below makes a copy. The
+        # last frame is dropped, as in the reference implementation.
+        frames = np.lib.stride_tricks.sliding_window_view(padded, self.n_fft, axis=-1)[:, :: self.hop_length]
+        frames = frames[:, : self.nb_max_frames] * self.window
+
+        stft = rfft_backend.rfft(frames, axis=-1)
+        magnitudes = np.square(stft.real, dtype=np.float32)
+        magnitudes += np.square(stft.imag, dtype=np.float32)
+        mel_spec = np.matmul(magnitudes, self.mel_filters)
+
+        log_spec = np.log10(np.maximum(mel_spec, 1e-10))
+        log_spec = np.maximum(log_spec, log_spec.max(axis=(1, 2), keepdims=True) - 8.0)
+        log_spec = (log_spec + 4.0) / 4.0
+        return np.ascontiguousarray(log_spec.transpose(0, 2, 1))
+
+    def __call__(self, inputs, chunk_start_idx, chunk_len):
+        """
+        Args:
+            inputs (`np.ndarray` of shape `(num_samples,)`):
+                The full audio waveform.
+            chunk_start_idx (`np.ndarray` of shape `(num_chunks,)`):
+                The sample index at which each chunk starts.
+            chunk_len (`int` or `np.ndarray` of shape `(num_chunks,)`):
+                The number of samples in each chunk.
+
+        Returns:
+            `np.ndarray` of shape `(num_chunks, feature_size, nb_max_frames)` with the float32 log-mel features.
+        """
+        return self.log_mel_spectrogram(self.pad_chunks(inputs, chunk_start_idx, chunk_len))
+
+    def jax_log_mel_spectrogram(self, waveforms):
+        """
+        JAX version of [`~WhisperLogMelExtractor.log_mel_spectrogram`], such that the feature extraction can be fused
+        into a jitted / pmapped generation function. Takes the (un-centered) chunks returned by `pad_chunks(...,
+        center=False)`, i.e. an array of shape `(num_chunks, n_samples)`, and returns the log-mel features of shape
+        `(num_chunks, feature_size, nb_max_frames)`. The chunks can also be 16-bit PCM (`pad_chunks(...,
+        center=False, dtype=np.int16)`), which is converted back to float32 audio first.
+        """
+        import jax
+        import jax.numpy as jnp
+
+        waveforms = jnp.asarray(waveforms)
+        if jnp.issubdtype(waveforms.dtype, jnp.integer):
+            waveforms = waveforms.astype(jnp.float32) / PCM16_SCALE
+        n_pad = self.n_fft // 2
+        waveforms = jnp.pad(waveforms.astype(jnp.float32), ((0, 0), (n_pad, n_pad)), mode="reflect")
+
+        frame_idx = jnp.arange(self.nb_max_frames)[:, None] * self.hop_length + jnp.arange(self.n_fft)[None, :]
+        frames = waveforms[:, frame_idx] * self.window
+
+        stft = jnp.fft.rfft(frames, axis=-1)
+        magnitudes = jnp.square(stft.real) + jnp.square(stft.imag)
+        # keep the mel projection in full precision, TPUs otherwise default to bfloat16 passes for float32 matmuls
+        mel_spec = jnp.matmul(magnitudes, self.mel_filters, precision=jax.lax.Precision.HIGHEST)
+
+        log_spec = jnp.log10(jnp.maximum(mel_spec, 1e-10))
+        log_spec = jnp.maximum(log_spec, log_spec.max(axis=(1, 2), keepdims=True) - 8.0)
+        log_spec = (log_spec + 4.0) / 4.0
+        return log_spec.transpose(0, 2, 1)
@@ -0,0 +1,148 @@
+# coding=utf-8
+# Copyright 2023 The HuggingFace Inc. team.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import multiprocessing
+import queue
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+from transformers.utils import logging
+
+from .feature_worker import extract_rows, init_worker
+
+
+logger = logging.get_logger(__name__)
+
+
+class FeatureExtractionPool:
+    def __init__(self, log_mel_extractor, num_workers=None, startup_timeout=60.0):
+        """
+        Computes the log-mel features of a batch of chunks in parallel worker processes. The audio spanned by the
+        chunks is copied once into a shared-memory buffer, each worker computes the features of a contiguous range of
+        chunks with [`WhisperLogMelExtractor`] and writes them into a shared output buffer, and the calling process
+        only copies the assembled batch out. Neither the audio nor the features are pickled between processes.
+
+        The workers are started with the `spawn` context rather than forked: a forked worker inherits the memory and
+        threads of a process that has already initialised JAX and loaded the model weights, whereas a spawned worker
+        is a fresh interpreter that only imports NumPy and the feature extraction code (see
+        `whisper_jax.feature_worker`). Each worker reports its startup time and RSS once it is ready, which are kept
+        in `worker_stats`.
+
+        Args:
+            log_mel_extractor (`WhisperLogMelExtractor`):
+                The feature extractor run by the workers.
+            num_workers (`int`, *optional*):
+                The number of worker processes. Defaults to the number of CPUs.
+            startup_timeout (`float`, *optional*, defaults to 60.0):
+                The time in seconds to wait for the startup report of each worker.
+        """
+        self.log_mel_extractor = log_mel_extractor
+        self.num_workers = num_workers if num_workers is not None else multiprocessing.cpu_count()
+        ctx = multiprocessing.get_context("spawn")
+        # start the resource tracker before the workers, such that they share it rather than each starting their own
+        # (which would report the buffers created and unlinked by this process as leaked)
+        resource_tracker.ensure_running()
+        stats_queue = ctx.Queue()
+        self._pool = ctx.Pool(
+            self.num_workers, initializer=init_worker, initargs=(log_mel_extractor, stats_queue, time.time())
+        )
+
+        self.worker_stats = []
+        try:
+            for _ in range(self.num_workers):
+                self.worker_stats.append(stats_queue.get(timeout=startup_timeout))
+        except queue.Empty:
+            logger.warning(
+                f"Only {len(self.worker_stats)} of {self.num_workers} feature extraction workers reported their "
+                f"startup within {startup_timeout}s"
+            )
+        self._log_worker_stats()
+
+    def _log_worker_stats(self):
+        if not self.worker_stats:
+            return
+        startup_times = [stats["startup_time"] for stats in self.worker_stats]
+        rss = [stats["rss_mb"] for stats in self.worker_stats]
+        logger.info(
+            f"Started {len(self.worker_stats)} feature extraction workers: startup time mean "
+            f"{np.mean(startup_times):.2f}s (max {np.max(startup_times):.2f}s), RSS mean {np.mean(rss):.0f}MB (max {np.max(rss):.0f}MB)"
+        )
+        for stats in self.worker_stats:
+            logger.debug(
+                f"Feature extraction worker {stats['pid']}: startup time {stats['startup_time']:.2f}s, "
+                f"RSS {stats['rss_mb']:.0f}MB"
+            )
+        if any(stats["imported_jax"] for stats in self.worker_stats):
+            # spawned workers re-import the `__main__` module of the parent, which should keep its heavy imports
+            # behind `if __name__ == "__main__"`
+            logger.warning(
+                "JAX was imported in the feature extraction workers, most likely through the main module of the "
+                "parent process. This costs startup time and memory in every worker."
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._pool.terminate()
+        self._pool.join()
+
+    def __call__(self, inputs, chunk_start_idx, chunk_lens):
+        """
+        Same as calling the [`WhisperLogMelExtractor`] directly: returns the features of the chunks
+        `inputs[start : start + chunk_len]`, of shape `(num_chunks, feature_size, nb_max_frames)`.
+        """
+        num_chunks = len(chunk_start_idx)
+        chunk_lens = np.broadcast_to(chunk_lens, (num_chunks,))
+        output_shape = (num_chunks, self.log_mel_extractor.feature_size, self.log_mel_extractor.nb_max_frames)
+        if num_chunks == 0:
+            return np.zeros(output_shape, dtype=np.float32)
+
+        # only the audio spanned by the chunks is shared with the workers
+        span_start = int(np.min(chunk_start_idx))
+        span_end = int(min(np.max(np.asarray(chunk_start_idx) + chunk_lens), inputs.shape[0]))
+        chunk_start_idx = np.asarray(chunk_start_idx) - span_start
+        input_len = span_end - span_start
+
+        input_shm = shared_memory.SharedMemory(create=True, size=max(4 * input_len, 1))
+        output_shm = shared_memory.SharedMemory(create=True, size=4 * int(np.prod(output_shape)))
+        try:
+            np.ndarray((input_len,), dtype=np.float32, buffer=input_shm.buf)[:] = inputs[span_start:span_end]
+
+            # contiguous ranges of chunks, one per worker
+            rows = [
+                slice(int(row_range[0]), int(row_range[-1]) + 1)
+                for row_range in np.array_split(np.arange(num_chunks), min(self.num_workers, num_chunks))
+            ]
+            self._pool.starmap(
+                extract_rows,
+                [
+                    (input_shm.name, input_len, output_shm.name, output_shape, chunk_start_idx, chunk_lens, row_range)
+                    for row_range in rows
+                ],
+            )
+            outputs = np.ndarray(output_shape, dtype=np.float32, buffer=output_shm.buf)
+            features = outputs.copy()
+            del outputs
+            return features
+        finally:
+            input_shm.close()
+            input_shm.unlink()
+            output_shm.close()
+            output_shm.unlink()
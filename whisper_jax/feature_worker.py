@@ -0,0 +1,72 @@
+# coding=utf-8
+# Copyright 2023 The HuggingFace Inc. team.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Worker side of [`FeatureExtractionPool`]. The workers are spawned as fresh interpreters, and this module (together with
+the pickled [`WhisperLogMelExtractor`]) is all they import: it must only depend on NumPy and the standard library, and
+never import JAX, Flax or Transformers.
+"""
+
+import os
+import sys
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+# the log-mel extractor of a worker process, set once by the pool initializer
+_log_mel_extractor = None
+
+
+def get_rss_mb():
+    """Returns the resident set size of the current process in MB."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+
+    # peak rather than current RSS, in kB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def init_worker(log_mel_extractor, stats_queue, spawn_time):
+    global _log_mel_extractor
+    _log_mel_extractor = log_mel_extractor
+    stats_queue.put(
+        {
+            "pid": os.getpid(),
+            "startup_time": time.time() - spawn_time,
+            "rss_mb": get_rss_mb(),
+            "imported_jax": "jax" in sys.modules,
+        }
+    )
+
+
+def extract_rows(input_name, input_len, output_name, output_shape, chunk_start_idx, chunk_lens, rows):
+    # the buffers are created and unlinked by the parent process, workers only attach to them
+    input_shm = shared_memory.SharedMemory(name=input_name)
+    output_shm = shared_memory.SharedMemory(name=output_name)
+    try:
+        inputs = np.ndarray((input_len,), dtype=np.float32, buffer=input_shm.buf)
+        outputs = np.ndarray(output_shape, dtype=np.float32, buffer=output_shm.buf)
+        outputs[rows] = _log_mel_extractor(inputs, chunk_start_idx[rows], chunk_lens[rows])
+        del inputs, outputs
+    finally:
+        input_shm.close()
+        output_shm.close()
@@ -0,0 +1,251 @@
+# coding=utf-8
+# Copyright 2023 The HuggingFace Inc. team.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import jax
+import jax.numpy as jnp
+import numpy as np
+from flax import jax_utils
+from flax.core.frozen_dict import FrozenDict, freeze
+from flax.traverse_util import flatten_dict, unflatten_dict
+from jax.sharding import PartitionSpec as P
+
+
+class InflightDecodeEngine:
+    def __init__(
+        self,
+        pipeline,
+        forced_positions,
+        return_timestamps=False,
+        batch_size=None,
+        refill_size=None,
+        max_steps=32,
+    ):
+        """
+        Token-level (in-flight) batching for [`FlaxWhisperPipline`]. The engine holds `batch_size` decoding slots,
+        each of which is at its own decoding step: the self-attention caches use per-row cache indices rather than a
+        single index shared by the batch. As soon as a row emits the EOS token its slot is freed, and can be refilled
+        with a new chunk, which is encoded and prefilled with its decoder prompt while the other rows keep their
+        state. Under sustained load, the device thus never decodes rows that have already finished.
+
+        All rows of an engine share the static layout of the decoder prompt (the positions of the forced tokens) and
+        whether timestamps are predicted. The forced token ids themselves are given per row, so chunks with different
+        languages or tasks are decoded side by side.
+
+        Args
+            pipeline (`FlaxWhisperPipline`):
+                The pipeline holding the model and parameters.
+            forced_positions (`Tuple[int]`):
+                The decoder positions of the forced prompt tokens, see [`~FlaxWhisperPipline.get_forced_decoder_ids`].
+            return_timestamps (`bool`, *optional*, defaults to `False`):
+                Whether to predict timestamp tokens.
+            batch_size (`int`, *optional*, defaults to `pipeline.batch_size`):
+                The number of decoding slots.
+            refill_size (`int`, *optional*):
+                The number of chunks encoded and prefilled per call to `insert`. Defaults to a quarter of the
+                slots, rounded up to a multiple of the number of devices.
+            max_steps (`int`, *optional*, defaults to 32):
+                The maximum number of decoding steps per call to `step`. A call returns early as soon as a row
+                finishes, such that its slot can be refilled.
+        """
+        self.pipeline = pipeline
+        self.model = pipeline.model
+        self.forced_positions = tuple(forced_positions)
+        self.return_timestamps = return_timestamps
+        self.batch_size = batch_size if batch_size is not None else pipeline.batch_size
+        min_batch_size = pipeline.min_batch_size if pipeline.is_sharded else 1
+        if refill_size is None:
+            refill_size = max(self.batch_size // 4, 1)
+            refill_size = -(-refill_size // min_batch_size) * min_batch_size
+        if self.batch_size % min_batch_size != 0 or refill_size % min_batch_size != 0:
+            raise ValueError(
+                f"The number of slots and the refill size must be multiples of the number of JAX devices, but got {self.batch_size} slots, refill size {refill_size} and num devices {min_batch_size}."
+            )
+        self.refill_size = refill_size
+        self.max_steps = max_steps
+
+        if pipeline.is_sharded:
+            self.params = pipeline.params
+        else:
+            # the engine is compiled with jit, so runs on a single device with pmap'd (replicated) parameters
+            self.params = jax_utils.unreplicate(pipeline.params)
+
+        self._init_fn = self._compile(self._init, in_axis_resources=(self._params_spec,), out_axis_resources=P("data"))
+        self._insert_fn = self._compile(
+            self._insert,
+            in_axis_resources=(self._params_spec, P("data"), P("data"), P("data"), None, None),
+            out_axis_resources=P("data"),
+        )
+        self._step_fn = self._compile(
+            self._step,
+            in_axis_resources=(self._params_spec, P("data")),
+            out_axis_resources=(P("data"), None, None),
+        )
+
+        self.state = None
+        self.slots = [None] * self.batch_size
+
+        self.num_steps = 0
+        self.active_row_steps = 0
+
+    @property
+    def _params_spec(self):
+        return self.pipeline.params_spec if self.pipeline.is_sharded else None
+
+    def _compile(self, fn, in_axis_resources, out_axis_resources):
+        if self.pipeline.is_sharded:
+            return self.pipeline.partitioner.partition(
+                fn, in_axis_resources=in_axis_resources, out_axis_resources=out_axis_resources
+            )
+        return jax.jit(fn)
+
+    @property
+    def num_active(self):
+        return sum(tag is not None for tag in self.slots)
+
+    @property
+    def num_free_slots(self):
+        return self.batch_size - self.num_active
+
+    @property
+    def utilization(self):
+        """Fraction of the decoded row-steps that were spent on unfinished rows."""
+        if self.num_steps == 0:
+            return 0.0
+        return self.active_row_steps / (self.num_steps * self.batch_size)
+
+    def _input_shape(self):
+        if self.pipeline.on_device_features:
+            return (self.pipeline.log_mel_extractor.n_samples,)
+        return (self.model.config.num_mel_bins, 2 * self.model.config.max_source_positions)
+
+    def _input_dtype(self):
+        # the audio windows are 16-bit PCM with `on_device_features=True`
+        return np.int16 if self.pipeline.on_device_features else np.float32
+
+    def _prefill(self, params, input_features, row_mask, forced_token_ids):
+        if self.pipeline.on_device_features:
+            input_features = self.pipeline.log_mel_extractor.jax_log_mel_spectrogram(input_features)
+        forced_decoder_ids = [(idx, forced_token_ids[:, i]) for i, idx in enumerate(self.forced_positions)]
+        state = self.model.pipeline_prefill(
+            input_features,
+            forced_decoder_ids,
+            return_timestamps=self.return_timestamps,
+            params=params,
+            max_length=self.pipeline.max_length,
+            row_mask=row_mask,
+        )
+
+        # switch to per-row decoding steps and cache indices, such that every slot can be at a different position
+        batch_size = input_features.shape[0]
+        past_key_values = state.model_kwargs["past_key_values"]
+        flat_past_key_values = flatten_dict(past_key_values)
+        for key, value in flat_past_key_values.items():
+            if key[-1] == "cache_index":
+                flat_past_key_values[key] = jnp.broadcast_to(value, (batch_size,))
+        flat_past_key_values = unflatten_dict(flat_past_key_values)
+        if isinstance(past_key_values, FrozenDict):
+            flat_past_key_values = freeze(flat_past_key_values)
+        model_kwargs = dict(state.model_kwargs, past_key_values=flat_past_key_values)
+        return state.replace(cur_len=jnp.broadcast_to(state.cur_len, (batch_size,)), model_kwargs=model_kwargs)
+
+    def _init(self, params):
+        # all slots start out empty (i.e. finished)
+        input_features = jax.ShapeDtypeStruct((self.batch_size, *self._input_shape()), self._input_dtype())
+        row_mask = jax.ShapeDtypeStruct((self.batch_size,), jnp.bool_)
+        forced_token_ids = jax.ShapeDtypeStruct((self.batch_size, len(self.forced_positions)), jnp.int32)
+        state = jax.eval_shape(self._prefill, params, input_features, row_mask, forced_token_ids)
+        state = jax.tree_util.tree_map(lambda x: jnp.zeros(x.shape, x.dtype), state)
+        return state.replace(is_sent_finished=jnp.ones((self.batch_size,), dtype=jnp.bool_))
+
+    def _insert(self, params, state, input_features, row_mask, slots, forced_token_ids):
+        new_state = self._prefill(params, input_features, row_mask, forced_token_ids)
+        # every leaf of the state is batch-major: scatter the new rows into their slots, padding rows (with an
+        # out-of-range slot index) are dropped
+        return jax.tree_util.tree_map(lambda x, y: x.at[slots].set(y, mode="drop"), state, new_state)
+
+    def _step(self, params, state):
+        return self.model.pipeline_decode_steps(
+            state,
+            self.max_steps,
+            return_timestamps=self.return_timestamps,
+            params=params,
+            max_length=self.pipeline.max_length,
+        )
+
+    def release(self):
+        """Frees the device memory of the decoding state. Only valid once all slots are empty."""
+        if self.num_active > 0:
+            raise RuntimeError("Cannot release the decoding state while slots are still in use.")
+        self.state = None
+
+    def insert(self, input_features, forced_token_ids, tags):
+        """
+        Encodes and prefills new chunks into free slots.
+
+        Args:
+            input_features (`np.ndarray` of shape `(num_chunks, ...)`):
+                The inputs of the chunks, i.e. log-mel features or raw audio windows with `on_device_features=True`.
+            forced_token_ids (`np.ndarray` of shape `(num_chunks, len(forced_positions))`):
+                The forced prompt token ids of each chunk.
+            tags (`List`):
+                One object per chunk, returned together with its tokens by `step` once the chunk is decoded.
+        """
+        if len(tags) > self.num_free_slots:
+            raise ValueError(f"Cannot insert {len(tags)} chunks into {self.num_free_slots} free slots.")
+        if self.state is None:
+            self.state = self._init_fn(self.params)
+
+        free_slots = [slot for slot, tag in enumerate(self.slots) if tag is None]
+        for start in range(0, len(tags), self.refill_size):
+            end = min(start + self.refill_size, len(tags))
+            num_chunks = end - start
+            # pad to the fixed refill size, padding rows are scattered to an out-of-range slot and dropped
+            padded_features = np.zeros((self.refill_size, *input_features.shape[1:]), dtype=self._input_dtype())
+            padded_features[:num_chunks] = input_features[start:end]
+            padded_forced_ids = np.zeros((self.refill_size, len(self.forced_positions)), dtype=np.int32)
+            padded_forced_ids[:num_chunks] = forced_token_ids[start:end]
+            row_mask = np.arange(self.refill_size) < num_chunks
+            slots = np.full((self.refill_size,), self.batch_size, dtype=np.int32)
+            slots[:num_chunks] = free_slots[start:end]
+
+            self.state = self._insert_fn(
+                self.params, self.state, padded_features, row_mask, slots, jnp.asarray(padded_forced_ids)
+            )
+            for slot, tag in zip(free_slots[start:end], tags[start:end]):
+                self.slots[slot] = tag
+
+    def step(self):
+        """
+        Decodes until a row finishes (or for at most `max_steps` steps), and frees the slots of all finished rows.
+        Returns a list of `(tag, tokens)` pairs for the finished chunks, with `tokens` of shape `(max_length,)`.
+        """
+        if self.num_active == 0:
+            return []
+        self.state, num_steps, active_row_steps = self._step_fn(self.params, self.state)
+
+        self.num_steps += int(num_steps)
+        self.active_row_steps += int(active_row_steps)
+
+        is_sent_finished = np.asarray(jax.device_get(self.state.is_sent_finished))
+        finished_slots = [slot for slot, tag in enumerate(self.slots) if tag is not None and is_sent_finished[slot]]
+        if not finished_slots:
+            return []
+
+        sequences = np.asarray(jax.device_get(self.state.sequences))
+        outputs = []
+        for slot in finished_slots:
+            outputs.append((self.slots[slot], sequences[slot]))
+            self.slots[slot] = None
+        return outputs
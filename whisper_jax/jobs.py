@@ -0,0 +1,206 @@
+# coding=utf-8
+# Copyright 2023 The HuggingFace Inc. team.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import copy
+import queue
+import threading
+import time
+import uuid
+
+from transformers.utils import logging
+
+
+logger = logging.get_logger(__name__)
+
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+
+
+class JobStore:
+    """
+    Interface of the store that keeps the state of the jobs of a [`JobQueue`]. A job is a JSON-serialisable `dict`
+    with the keys `id`, `status`, `created_at`, `started_at`, `finished_at`, `progress`, `result` and `error`, such
+    that a store can keep it out of process (e.g. in Redis or a database) for several API servers to share.
+    """
+
+    def create(self, job):
+        """Adds the new `job`."""
+        raise NotImplementedError
+
+    def get(self, job_id):
+        """Returns the job with id `job_id`, or `None` if there is no such job."""
+        raise NotImplementedError
+
+    def update(self, job_id, **fields):
+        """Sets `fields` on the job with id `job_id`."""
+        raise NotImplementedError
+
+    def delete(self, job_id):
+        """Removes the job with id `job_id`, if present."""
+        raise NotImplementedError
+
+
+class InMemoryJobStore(JobStore):
+    """
+    [`JobStore`] that keeps the jobs in a `dict` of the current process. Finished jobs are kept until more than
+    `max_finished_jobs` jobs have finished after them.
+
+    Args:
+        max_finished_jobs (`int`, *optional*, defaults to 1000):
+            The maximum number of finished jobs kept. The oldest finished jobs are dropped first.
+    """
+
+    def __init__(self, max_finished_jobs=1000):
+        self.max_finished_jobs = max_finished_jobs
+        self._jobs = {}
+        # ids of the finished jobs, in the order in which they finished
+        self._finished = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def create(self, job):
+        with self._lock:
+            self._jobs[job["id"]] = copy.deepcopy(job)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return copy.deepcopy(job) if job is not None else None
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job.update(fields)
+            if job["status"] in (JOB_SUCCEEDED, JOB_FAILED):
+                self._finished[job_id] = None
+                while len(self._finished) > self.max_finished_jobs:
+                    oldest_id, _ = self._finished.popitem(last=False)
+                    self._jobs.pop(oldest_id, None)
+
+    def delete(self, job_id):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+            self._finished.pop(job_id, None)
+
+
+class JobQueue:
+    def __init__(self, run_job, store=None, max_queue_size=64):
+        """
+        Asynchronous jobs for long transcriptions. Jobs are submitted to a bounded queue and return a job id straight
+        away, rather than holding a connection for the whole transcription. A single worker thread drains the queue and
+        runs one job at a time, and the status, progress and result of each job are kept in a [`JobStore`] for the
+        client to poll.
+
+        Args:
+            run_job (`Callable`):
+                Runs a job: called in the worker thread as `run_job(payload, report_progress)`, with the payload passed
+                to [`submit`] and a callable that records the progress (a JSON-serialisable `dict`) of the job. Its
+                return value is stored as the result of the job, and any exception it raises fails the job.
+            store ([`JobStore`], *optional*):
+                The store for the job states. Defaults to an [`InMemoryJobStore`].
+            max_queue_size (`int`, *optional*, defaults to 64):
+                The maximum number of jobs waiting to run. [`submit`] raises `queue.Full` beyond that, such that
+                clients are turned away rather than queued for longer than they would wait.
+        """
+        self.run_job = run_job
+        self.store = store if store is not None else InMemoryJobStore()
+        self.max_queue_size = max_queue_size
+
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._thread = None
+        self._running = False
+
+    @property
+    def num_queued(self):
+        return self._queue.qsize()
+
+    def start(self):
+        if self._running:
+            return self
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="whisper-jax-jobs", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops the worker once the current job has finished. Jobs still in the queue are not run."""
+        if not self._running:
+            return
+        self._running = False
+        # wake up the worker if it is waiting for a job
+        try:
+            self._queue.put_nowait(None)
+        except queue.Full:
+            pass
+        self._thread.join()
+        self._thread = None
+
+    def submit(self, payload):
+        """
+        Queues a job with the given `payload` and returns its job id. Raises `queue.Full` if `max_queue_size` jobs are
+        already waiting.
+        """
+        if not self._running:
+            raise RuntimeError("The job queue must be started with `start()` before submitting jobs.")
+        job_id = uuid.uuid4().hex
+        self.store.create(
+            {
+                "id": job_id,
+                "status": JOB_QUEUED,
+                "created_at": time.time(),
+                "started_at": None,
+                "finished_at": None,
+                "progress": {},
+                "result": None,
+                "error": None,
+            }
+        )
+        try:
+            self._queue.put_nowait((job_id, payload))
+        except queue.Full:
+            self.store.delete(job_id)
+            raise
+        return job_id
+
+    def get(self, job_id):
+        """Returns the job with id `job_id` from the store, or `None` if there is no such job."""
+        return self.store.get(job_id)
+
+    def _run(self):
+        while self._running:
+            item = self._queue.get()
+            if item is None:
+                continue
+            job_id, payload = item
+            self.store.update(job_id, status=JOB_RUNNING, started_at=time.time())
+
+            def report_progress(progress, job_id=job_id):
+                self.store.update(job_id, progress=progress)
+
+            try:
+                result = self.run_job(payload, report_progress)
+            except Exception as err:
+                logger.error(f"Job {job_id} failed: {err}")
+                self.store.update(job_id, status=JOB_FAILED, finished_at=time.time(), error=str(err))
+            else:
+                self.store.update(job_id, status=JOB_SUCCEEDED, finished_at=time.time(), result=result)
@@ -0,0 +1,225 @@
+# coding=utf-8
+# Copyright 2023 The HuggingFace Inc. team.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+
+import numpy as np
+
+from .audio import AudioRingBuffer
+
+
+class LiveTranscriber:
+    def __init__(self, pipeline, language=None, task=None, step_s=0.5, min_window_s=1.0, max_window_s=None):
+        """
+        Transcribes a live audio stream (e.g. a microphone) with a [`FlaxWhisperPipline`]. Audio is appended to a
+        rolling [`AudioRingBuffer`] as it arrives, and [`update`] re-decodes the window of audio that has not been
+        committed yet, from its start up to the newest sample. Each decode is a single chunk, so it runs in the
+        smallest compiled batch size bucket of the pipeline.
+
+        The text of consecutive hypotheses only becomes final once they agree on it: the longest common prefix of the
+        current and the previous hypothesis is committed, and the rest is returned as tentative text. Once the
+        committed text spans complete segments, the window is moved up to the end timestamp of the last of them, such
+        that the decoded window stays short and the latency low.
+
+        Args:
+            pipeline (`FlaxWhisperPipline`):
+                The pipeline used for pre-processing and generation.
+            language (`str`, *optional*):
+                The language of the audio, detected by the model if not set.
+            task (`str`, *optional*):
+                The task, `"transcribe"` or `"translate"`.
+            step_s (`float`, *optional*, defaults to 0.5):
+                The minimum duration of new audio in seconds between two decodes.
+            min_window_s (`float`, *optional*, defaults to 1.0):
+                The minimum duration of the window in seconds before it is decoded.
+            max_window_s (`float`, *optional*):
+                The maximum duration of the window in seconds. If the window grows beyond it without a committed
+                segment to move it up to, the current hypothesis is committed as is. Audio beyond it is decoded in
+                the next windows. Defaults to the chunk length of the feature extractor (30 seconds), which it cannot
+                exceed.
+        """
+        self.pipeline = pipeline
+        self.language = language
+        self.task = task
+        self.sampling_rate = pipeline.feature_extractor.sampling_rate
+        self.step_len = round(step_s * self.sampling_rate)
+        self.min_window_len = round(min_window_s * self.sampling_rate)
+        max_window_s = max_window_s if max_window_s is not None else pipeline.feature_extractor.chunk_length
+        self.max_window_len = round(max_window_s * self.sampling_rate)
+        if self.max_window_len > pipeline.feature_extractor.n_samples:
+            raise ValueError(
+                f"The maximum window of {max_window_s}s does not fit in a chunk of "
+                f"{pipeline.feature_extractor.chunk_length}s."
+            )
+        # validate the language / task eagerly, rather than when the first window is decoded
+        forced_positions, _ = pipeline._get_forced_prompt(language=language, task=task, return_timestamps=True)
+        self.prompt_len = max(forced_positions, default=0) + 1
+
+        tokenizer = pipeline.tokenizer
+        self.timestamp_begin = tokenizer.convert_tokens_to_ids("<|notimestamps|>") + 1
+        self.special_ids = set(tokenizer.all_special_ids)
+        self.eos_token_id = pipeline.model.generation_config.eos_token_id
+        self.time_precision = pipeline.feature_extractor.chunk_length / pipeline.model.config.max_source_positions
+
+        # twice the window, such that audio keeps arriving while a full window is decoded
+        self.ring = AudioRingBuffer(2 * self.max_window_len)
+        # absolute sample index of the start of the window, and of its end when it was last decoded
+        self.window_start = 0
+        self.decoded_end = 0
+        # text tokens of the window that are committed, and those of the last hypothesis
+        self.committed_tokens = []
+        self.hypothesis = []
+        self.text = ""
+        self._lock = threading.Lock()
+
+    @property
+    def num_samples(self):
+        """The number of samples received so far."""
+        return self.ring.end
+
+    def add_audio(self, samples):
+        """Appends mono float32 samples at the sampling rate of the pipeline to the stream. Thread-safe."""
+        samples = np.asarray(samples, dtype=np.float32)
+        with self._lock:
+            if len(samples) > self.ring.free:
+                # decoding fell more than a window behind: drop the oldest audio, committing what was heard of it
+                self._commit(self.hypothesis)
+                self._move_window(self.ring.end + len(samples) - self.ring.capacity, len(self.committed_tokens))
+            self.ring.write(samples)
+
+    def update(self):
+        """
+        Decodes the window if at least `step_s` seconds of new audio have arrived since the last decode. Returns
+        `None` if not, and otherwise a `dict` with the newly `"committed"` text, the `"tentative"` text that follows
+        it, the `"audio_time"` up to which the audio was decoded and the `"decode_time"` in seconds.
+        """
+        with self._lock:
+            window_start, window_end = self._next_window()
+            if self.ring.end - self.decoded_end < self.step_len or window_end - window_start < self.min_window_len:
+                return None
+            window = self.ring.read(window_start, window_end - window_start)
+        return self._decode_window(window, window_start, window_end, final=False)
+
+    def finish(self):
+        """Decodes the rest of the stream and commits all of it. Returns the same `dict` as [`update`]."""
+        result = {"committed": "", "tentative": "", "audio_time": self.decoded_end / self.sampling_rate}
+        while True:
+            with self._lock:
+                window_start, window_end = self._next_window()
+                window = self.ring.read(window_start, window_end - window_start)
+            if window_end == self.decoded_end or len(window) == 0:
+                with self._lock:
+                    result["committed"] += self._commit(self.hypothesis)
+                return result
+            # audio beyond the maximum window, if decoding fell behind, is decoded in the next windows
+            window_result = self._decode_window(window, window_start, window_end, final=True)
+            result["committed"] += window_result["committed"]
+            result["audio_time"] = window_result["audio_time"]
+            result["decode_time"] = result.get("decode_time", 0.0) + window_result["decode_time"]
+
+    def _next_window(self):
+        # the window is capped at the maximum length, such that no audio is cut off by the chunk length
+        return self.window_start, min(self.ring.end, self.window_start + self.max_window_len)
+
+    def _decode_window(self, window, window_start, window_end, final):
+        start = time.perf_counter()
+        text_tokens, segment_ends = self._generate(window)
+        decode_time = time.perf_counter() - start
+
+        with self._lock:
+            # only the audio up to `window_end` was decoded, so the window is never moved beyond it
+            self.decoded_end = window_end
+            # the committed tokens are kept even if this hypothesis has changed its mind about them
+            num_committed = len(self.committed_tokens)
+            if final:
+                committed = self._commit(self.committed_tokens + text_tokens[num_committed:])
+            else:
+                # commit the prefix on which this hypothesis agrees with the previous one
+                num_agreed = num_committed
+                while (
+                    num_agreed < min(len(text_tokens), len(self.hypothesis))
+                    and text_tokens[num_agreed] == self.hypothesis[num_agreed]
+                ):
+                    num_agreed += 1
+                committed = self._commit(self.committed_tokens + text_tokens[num_committed:num_agreed])
+            self.hypothesis = self.committed_tokens + text_tokens[len(self.committed_tokens) :]
+            tentative = self._decode_text(self.hypothesis[len(self.committed_tokens) :])
+
+            # move the window up to the end of the last segment that is committed as a whole
+            complete = [(num, end) for num, end in segment_ends if num <= len(self.committed_tokens)]
+            if complete:
+                num_tokens, end_time = complete[-1]
+                self._move_window(min(window_start + round(end_time * self.sampling_rate), window_end), num_tokens)
+            if final or window_end - self.window_start + self.step_len > self.max_window_len:
+                # the stream ends, or the next window would not fit in a chunk: commit the hypothesis and start over
+                # from the end of the decoded audio
+                committed += self._commit(self.hypothesis)
+                tentative = ""
+                self._move_window(window_end, len(self.committed_tokens))
+
+        return {
+            "committed": committed,
+            "tentative": tentative,
+            "audio_time": window_end / self.sampling_rate,
+            "decode_time": decode_time,
+        }
+
+    def _generate(self, window):
+        model_inputs = self.pipeline._preprocess_chunks(window, np.zeros((1,), dtype=np.int64), len(window))
+        outputs = self.pipeline.forward(
+            model_inputs,
+            batch_size=self.pipeline.min_batch_size,
+            language=self.language,
+            task=self.task,
+            return_timestamps=True,
+        )
+        token_ids = outputs["tokens"][0, 0, self.prompt_len :].tolist()
+        if self.eos_token_id in token_ids:
+            token_ids = token_ids[: token_ids.index(self.eos_token_id)]
+
+        # the text tokens, and for each segment the number of text tokens up to its end and its end time
+        text_tokens, segment_ends = [], []
+        previous_is_text = False
+        for token in token_ids:
+            if token >= self.timestamp_begin:
+                if previous_is_text:
+                    segment_ends.append((len(text_tokens), (token - self.timestamp_begin) * self.time_precision))
+                previous_is_text = False
+            elif token not in self.special_ids:
+                text_tokens.append(token)
+                previous_is_text = True
+        return text_tokens, segment_ends
+
+    def _decode_text(self, tokens):
+        return self.pipeline.tokenizer.decode(tokens, skip_special_tokens=True)
+
+    def _commit(self, tokens):
+        # commits the tokens beyond the committed ones, returns the new text
+        if len(tokens) <= len(self.committed_tokens):
+            return ""
+        # the text is decoded as a whole, as a character may span several tokens
+        previous_text = self._decode_text(self.committed_tokens)
+        self.committed_tokens = list(tokens)
+        new_text = self._decode_text(self.committed_tokens)[len(previous_text) :]
+        self.text += new_text
+        return new_text
+
+    def _move_window(self, window_start, num_tokens):
+        # the first `num_tokens` committed tokens were spoken before `window_start`, drop them along with the audio
+        self.window_start = min(max(window_start, self.window_start), self.ring.end)
+        self.ring.discard(self.window_start)
+        self.committed_tokens = self.committed_tokens[num_tokens:]
+        self.hypothesis = self.hypothesis[num_tokens:]
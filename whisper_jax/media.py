@@ -0,0 +1,395 @@
+# coding=utf-8
+# Copyright 2023 The HuggingFace Inc. team.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import concurrent.futures
+import hashlib
+import io
+import itertools
+import os
+import re
+import tempfile
+import threading
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from transformers.utils import logging
+
+
+logger = logging.get_logger(__name__)
+
+# the maximum number of connections kept open per host by the shared session
+POOL_MAXSIZE = 16
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Returns the `requests.Session` shared by all downloads, whose pool keeps the connections to each host open across
+    downloads rather than connecting again for each of them.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_MAXSIZE, pool_maxsize=POOL_MAXSIZE)
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+        return _session
+
+
+class HTTPStream(io.RawIOBase):
+    def __init__(self, url, session=None, headers=None, timeout=30.0, max_resumes=3):
+        """
+        File object over the body of an HTTP response, read from the connection as the bytes arrive rather than
+        downloaded as a whole first. If the connection breaks before the end of the body and the server accepts range
+        requests, the download is resumed from the last byte read with a `Range` request.
+
+        Args:
+            url (`str`):
+                The URL to download.
+            session (`requests.Session`, *optional*):
+                The session used for the requests. Defaults to the shared session of [`get_session`].
+            headers (`dict`, *optional*):
+                Additional headers of the requests.
+            timeout (`float`, *optional*, defaults to 30.0):
+                The timeout in seconds for connecting and for each read from the connection.
+            max_resumes (`int`, *optional*, defaults to 3):
+                The maximum number of times the download is resumed before the error is raised.
+        """
+        super().__init__()
+        self.url = url
+        self.session = session if session is not None else get_session()
+        self.headers = dict(headers or {})
+        self.timeout = timeout
+        self.max_resumes = max_resumes
+
+        self.num_resumes = 0
+        self._position = 0
+        self._response = None
+        self._request()
+        # ranges address the bytes sent, so a download can only be resumed if they are the bytes of the body
+        headers = self._response.headers
+        self._resumable = headers.get("Accept-Ranges") == "bytes" and "Content-Encoding" not in headers
+        self._length = int(headers["Content-Length"]) if self._resumable and "Content-Length" in headers else None
+
+    def _request(self):
+        headers = dict(self.headers)
+        if self._position > 0:
+            headers["Range"] = f"bytes={self._position}-"
+        response = self.session.get(self.url, headers=headers, stream=True, timeout=self.timeout)
+        response.raise_for_status()
+        if self._position > 0 and response.status_code != 206:
+            response.close()
+            raise IOError(f"Cannot resume the download of {self.url}, the server ignored the range request.")
+        # undo any transfer encoding, such as gzip, such that the bytes read are those of the file
+        response.raw.decode_content = True
+        self._response = response
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while True:
+            try:
+                num_bytes = self._response.raw.readinto(buffer)
+                if num_bytes == 0 and self._length is not None and self._position < self._length:
+                    raise urllib3.exceptions.ProtocolError("Connection closed before the end of the body.")
+            except (urllib3.exceptions.HTTPError, ConnectionError) as err:
+                if not self._resumable or self.num_resumes >= self.max_resumes:
+                    raise
+                self.num_resumes += 1
+                logger.warning(f"Resuming the download of {self.url} from byte {self._position} after: {err}")
+                self._response.close()
+                self._request()
+                continue
+            self._position += num_bytes
+            return num_bytes
+
+    def close(self):
+        if not self.closed and self._response is not None:
+            self._response.close()
+        super().close()
+
+
+class HTTPMediaFetcher:
+    """
+    Fetches media files over HTTP for transcription. [`open`] returns a file object over the body of the response,
+    which yields the bytes as they arrive, such that they can be fed to ffmpeg (see
+    [`~whisper_jax.audio.ffmpeg_stream`]) while the download is still running. The URL is taken to be the address of
+    the media file itself; subclasses resolve other URLs, e.g. of a YouTube video, to the address of its media file.
+
+    Args:
+        session (`requests.Session`, *optional*):
+            The session used for the downloads. Defaults to the shared session of [`get_session`].
+        timeout (`float`, *optional*, defaults to 30.0):
+            The timeout in seconds for connecting and for each read from the connection.
+        max_resumes (`int`, *optional*, defaults to 3):
+            The maximum number of times an interrupted download is resumed, see [`HTTPStream`].
+    """
+
+    def __init__(self, session=None, timeout=30.0, max_resumes=3):
+        self.session = session if session is not None else get_session()
+        self.timeout = timeout
+        self.max_resumes = max_resumes
+
+    def media_id(self, url):
+        """Returns a stable ID of the media at `url`, used as its key in a [`MediaCache`]."""
+        return hashlib.sha256(url.encode()).hexdigest()
+
+    def resolve(self, url):
+        """
+        Returns a `dict` with the `"url"` of the media file at `url`, the `"http_headers"` to request it with and its
+        `"duration"` in seconds, or `None` if it is not known before downloading it.
+        """
+        return {"url": url, "http_headers": {}, "duration": None}
+
+    def open(self, media):
+        """Starts downloading the media file resolved by [`resolve`], and returns an [`HTTPStream`] over its bytes."""
+        return HTTPStream(
+            media["url"],
+            session=self.session,
+            headers=media["http_headers"],
+            timeout=self.timeout,
+            max_resumes=self.max_resumes,
+        )
+
+
+class YoutubeAudioFetcher(HTTPMediaFetcher):
+    """
+    [`HTTPMediaFetcher`] for YouTube videos. yt-dlp resolves the URL of a video to its audio-only stream, which is a
+    fraction of the size of the video and is downloaded directly rather than merged into a container first. Requires
+    `yt-dlp`.
+
+    Args:
+        format (`str`, *optional*):
+            The yt-dlp format selector of the stream. Defaults to the best audio-only stream served over plain HTTP,
+            preferring WebM, which unlike MP4 can be decoded from a pipe.
+        kwargs:
+            The arguments of [`HTTPMediaFetcher`].
+    """
+
+    def __init__(self, format="bestaudio[protocol^=http][ext=webm]/bestaudio[protocol^=http]", **kwargs):
+        super().__init__(**kwargs)
+        self.format = format
+
+    def media_id(self, url):
+        from yt_dlp.extractor.youtube import YoutubeIE
+
+        # the many URL forms of a video (youtu.be links, shorts, extra query parameters) share its ID
+        video_id = YoutubeIE.get_temp_id(url)
+        return f"youtube-{video_id}" if video_id else super().media_id(url)
+
+    def resolve(self, url):
+        import yt_dlp
+
+        with yt_dlp.YoutubeDL({"format": self.format, "quiet": True, "noplaylist": True}) as ydl:
+            try:
+                info = ydl.extract_info(url, download=False)
+            except yt_dlp.utils.DownloadError as err:
+                raise RuntimeError(str(err))
+        return {"url": info["url"], "http_headers": info.get("http_headers", {}), "duration": info.get("duration")}
+
+
+class MediaCache:
+    def __init__(self, cache_dir, max_bytes=10 * 1024**3):
+        """
+        On-disk cache of downloaded media files, keyed by media ID (see [`HTTPMediaFetcher.media_id`]), such that
+        media that is requested again is decoded from disk rather than downloaded again. Files are added with [`tee`]
+        while they are downloaded, and the least recently used files are evicted once the cache holds more than
+        `max_bytes`.
+
+        Args:
+            cache_dir (`str`):
+                The directory of the cached files.
+            max_bytes (`int`, *optional*, defaults to 10GB):
+                The maximum total size of the cached files.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def stats(self):
+        """The hit / miss counts and the size of the cache."""
+        files = self._files()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "files": len(files),
+            "bytes": sum(size for _, _, size in files),
+        }
+
+    def get(self, media_id):
+        """Returns the path of the cached file of `media_id`, or `None` on a miss."""
+        path = self._path(media_id)
+        try:
+            # the modification time orders the files for eviction, so hits are moved to the back of the queue
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return path
+
+    def tee(self, media_id, stream):
+        """
+        Returns a file object that reads from `stream`, and copies the bytes read to the cache. The copy becomes the
+        cached file of `media_id` once `stream` has been read to the end, and is discarded if it is closed before.
+        """
+        return _CachingReader(self, media_id, stream)
+
+    def evict(self):
+        """Deletes the least recently used files until the cache holds at most `max_bytes`."""
+        with self._lock:
+            files = sorted(self._files())
+            total_bytes = sum(size for _, _, size in files)
+            for _, path, size in files:
+                if total_bytes <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total_bytes -= size
+
+    def _path(self, media_id):
+        return os.path.join(self.cache_dir, re.sub(r"[^A-Za-z0-9_.-]", "_", media_id))
+
+    def _files(self):
+        # (modification time, path, size) of the cached files, skipping the copies still being written
+        files = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, entry.path, stat.st_size))
+        return files
+
+    def _commit(self, media_id, tmp_path):
+        os.replace(tmp_path, self._path(media_id))
+        self.evict()
+
+
+class _CachingReader(io.RawIOBase):
+    # reads from a stream and copies the bytes read to a temporary file in the cache, see `MediaCache.tee`
+
+    def __init__(self, cache, media_id, stream):
+        super().__init__()
+        self._cache = cache
+        self._media_id = media_id
+        self._stream = stream
+        fd, self._tmp_path = tempfile.mkstemp(dir=cache.cache_dir, suffix=".tmp")
+        self._file = os.fdopen(fd, "wb")
+        self._complete = False
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        data = self._stream.read(size if size is not None and size >= 0 else None)
+        if data:
+            self._file.write(data)
+        elif not self._complete:
+            self._complete = True
+            self._file.close()
+            self._cache._commit(self._media_id, self._tmp_path)
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self._stream.close()
+            if not self._complete:
+                # the stream was not read to the end, so the copy is incomplete
+                self._file.close()
+                os.remove(self._tmp_path)
+        super().close()
+
+
+class URLPrefetcher:
+    def __init__(self, urls, fetcher=None, max_prefetch=4, spool_dir=None):
+        """
+        Downloads the media files at `urls` ahead of their transcription. Iterating yields `(url, file)` pairs in the
+        order of `urls`, where `file` is a seekable file object over the downloaded media, while the next
+        `max_prefetch` files are downloaded in parallel in the background. Each file is deleted once the iteration
+        moves past it. A failed download raises its error when its file would be yielded.
+
+        Args:
+            urls (`Iterable[str]`):
+                The URLs to download.
+            fetcher ([`HTTPMediaFetcher`], *optional*):
+                The fetcher that resolves and downloads each URL. Defaults to an [`HTTPMediaFetcher`].
+            max_prefetch (`int`, *optional*, defaults to 4):
+                The maximum number of files downloaded ahead of the file being consumed, i.e. at most
+                `max_prefetch + 1` downloaded files exist at any time.
+            spool_dir (`str`, *optional*):
+                The directory of the downloaded files. Defaults to the system temporary directory.
+        """
+        self.urls = urls
+        self.fetcher = fetcher if fetcher is not None else HTTPMediaFetcher()
+        self.max_prefetch = max_prefetch
+        self.spool_dir = spool_dir
+
+    def _download(self, url):
+        file = tempfile.TemporaryFile(dir=self.spool_dir)
+        try:
+            with self.fetcher.open(self.fetcher.resolve(url)) as stream:
+                while True:
+                    data = stream.read(1024 * 1024)
+                    if not data:
+                        break
+                    file.write(data)
+        except BaseException:
+            file.close()
+            raise
+        file.seek(0)
+        return file
+
+    def __iter__(self):
+        urls = iter(self.urls)
+        pool = concurrent.futures.ThreadPoolExecutor(self.max_prefetch, thread_name_prefix="whisper-jax-prefetch")
+        pending = collections.deque(
+            (url, pool.submit(self._download, url)) for url in itertools.islice(urls, self.max_prefetch)
+        )
+        try:
+            while pending:
+                url, future = pending.popleft()
+                # keep `max_prefetch` downloads going while this file is consumed
+                for next_url in itertools.islice(urls, 1):
+                    pending.append((next_url, pool.submit(self._download, next_url)))
+                with future.result() as file:
+                    yield url, file
+        finally:
+            for _, future in pending:
+                future.cancel()
+            pool.shutdown(wait=True)
+            # close the files downloaded ahead of an iteration that was stopped early
+            for _, future in pending:
+                if not future.cancelled() and future.exception() is None:
+                    future.result().close()
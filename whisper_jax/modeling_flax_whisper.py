@@ -14,6 +14,7 @@
 # limitations under the License.
 """ Flax whisper model."""
 
+import copy
 import random
 from functools import partial
 from typing import Optional, Tuple
@@ -29,10 +30,10 @@ from jax import lax
 from jax.random import PRNGKey
 from transformers import WhisperConfig
 from transformers.generation.flax_logits_process import (
-    FlaxLogitsProcessor,
     FlaxLogitsProcessorList,
     FlaxWhisperTimeStampLogitsProcessor,
 )
+from transformers.generation.flax_utils import FlaxGreedySearchOutput, GreedyState
 from transformers.modeling_flax_outputs import (
     FlaxBaseModelOutput,
     FlaxBaseModelOutputWithPastAndCrossAttentions,
@@ -182,59 +183,6 @@ WHISPER_DECODE_INPUTS_DOCSTRING = r"""
 """
 
 
-class FlaxStaticForceTokensLogitsProcessor(FlaxLogitsProcessor):
-    r"""
-    [`FlaxLogitsProcessor`] that takes a list of pairs of integers which indicates a mapping from generation indices to
-    token indices that will be forced before sampling. The processor will set their log probs to 0 and all other tokens
-    to `-inf` so that they are sampled at their corresponding index. This is a static version of the `transformers` logit
-    processor [`FlaxForceTokensLogitsProcessor`] that is compatible with sharded forced tokens.
-
-    Args:
-        force_token_map (`list`):
-            Map giving token ids and indices where they will be forced to be sampled.
-    """
-
-    def __init__(self, force_token_map):
-        # The generic `transformers` logit processor builds `force_token_array` as a dictionary - this is not a valid
-        # JAX type, and so we switch to using a JAX array instead
-        force_token_map = jnp.array(force_token_map)
-        # Converts the array of format [[index, token]] containing the tokens to be forced to an array, where the
-        # index of the array corresponds to the index of the token to be forced. For XLA compatibility,
-        # indexes without forced tokens will have a negative value. Note that the last token we ever need to force in
-        # Whisper is at position 3, so we only construct an array up to this index. The native version constructs a tensor
-        # dynamically according to the length of the `force_token_map`. Array shapes need to be concrete for XLA compatibility,
-        # so this is not permitted here.
-        force_token_array = jnp.ones(3, dtype=jnp.int32) * -1
-        for index, token in force_token_map:
-            force_token_array = force_token_array.at[index].set(token)
-        self.force_token_array = jnp.int32(force_token_array)
-
-    def __call__(self, input_ids: jnp.ndarray, scores: jnp.ndarray, cur_len: int) -> jnp.ndarray:
-        def _force_token(generation_idx):
-            batch_size = scores.shape[0]
-            current_token = self.force_token_array[generation_idx]
-
-            new_scores = jnp.ones_like(scores, dtype=scores.dtype) * -float("inf")
-            updates = jnp.zeros((batch_size, 1), dtype=scores.dtype)
-            new_scores = lax.dynamic_update_slice(new_scores, updates, (0, current_token))
-            return new_scores
-
-        scores = lax.cond(
-            cur_len >= self.force_token_array.shape[0],
-            # If the current length is geq than the length of force_token_array, the processor does nothing.
-            lambda: scores,
-            # Otherwise, it may force a certain token.
-            lambda: lax.cond(
-                self.force_token_array[cur_len] >= 0,
-                # Only valid (positive) tokens are forced
-                lambda: _force_token(cur_len),
-                # Otherwise, the processor does nothing.
-                lambda: scores,
-            ),
-        )
-        return scores
-
-
 class FlaxWhisperAttention(nn.Module):
     config: WhisperConfig
     embed_dim: int
@@ -293,16 +241,19 @@ class FlaxWhisperAttention(nn.Module):
 
         query_states = self.q_proj(hidden_states)
 
-        if is_cross_attention:
-            key_states = self.k_proj(key_value_states)
-            value_states = self.v_proj(key_value_states)
-        else:
-            key_states = self.k_proj(hidden_states)
-            value_states = self.v_proj(hidden_states)
-
         query_states = self._split_heads(query_states)
-        key_states = self._split_heads(key_states)
-        value_states = self._split_heads(value_states)
+
+        if is_cross_attention and self.has_variable("cache", "cached_cross_key"):
+            # the cross-attention keys and values only depend on the encoder outputs, so during generation they are
+            # projected once per sequence by `init_cross_attention_cache` and re-used at every decoding step
+            key_states = self.variables["cache"]["cached_cross_key"]
+            value_states = self.variables["cache"]["cached_cross_value"]
+        elif is_cross_attention:
+            key_states = self._split_heads(self.k_proj(key_value_states))
+            value_states = self._split_heads(self.v_proj(key_value_states))
+        else:
+            key_states = self._split_heads(self.k_proj(hidden_states))
+            value_states = self._split_heads(self.v_proj(hidden_states))
 
         query_states = with_sharding_constraint(query_states, ("batch", "length", "heads", "kv"))
         key_states = with_sharding_constraint(key_states, ("batch", "length", "heads", "kv"))
@@ -314,11 +265,17 @@ class FlaxWhisperAttention(nn.Module):
                 mask_shift = self.variables["cache"]["cache_index"]
                 # max_length of cached_key is last dim
                 max_decoder_length = self.variables["cache"]["cached_key"].shape[-1]
-                causal_mask = lax.dynamic_slice(
-                    self.causal_mask,
-                    (0, 0, mask_shift, 0),
-                    (1, 1, query_length, max_decoder_length),
-                )
+                if mask_shift.ndim > 0:
+                    # per-row cache indices: each row attends to the positions up to its own decoding step
+                    query_positions = mask_shift[:, None] + jnp.arange(query_length)
+                    causal_mask = jnp.arange(max_decoder_length)[None, None, :] <= query_positions[:, :, None]
+                    causal_mask = causal_mask[:, None]
+                else:
+                    causal_mask = lax.dynamic_slice(
+                        self.causal_mask,
+                        (0, 0, mask_shift, 0),
+                        (1, 1, query_length, max_decoder_length),
+                    )
             else:
                 causal_mask = self.causal_mask[:, :, :query_length, :key_length]
             causal_mask = jnp.broadcast_to(causal_mask, (batch_size,) + causal_mask.shape[1:])
@@ -373,6 +330,16 @@ class FlaxWhisperAttention(nn.Module):
 
         return attn_output, attn_weights
 
+    def init_cross_attention_cache(self, key_value_states: jnp.ndarray):
+        key_states = self._split_heads(self.k_proj(key_value_states))
+        value_states = self._split_heads(self.v_proj(key_value_states))
+
+        key_states = with_sharding_constraint(key_states, ("batch", "length", "heads", "kv"))
+        value_states = with_sharding_constraint(value_states, ("batch", "length", "heads", "kv"))
+
+        self.put_variable("cache", "cached_cross_key", key_states)
+        self.put_variable("cache", "cached_cross_value", value_states)
+
     def _split_heads(self, hidden_state) -> jnp.ndarray:
         return hidden_state.reshape(hidden_state.shape[:2] + (self.num_heads, self.head_dim))
 
@@ -408,7 +375,8 @@ class FlaxWhisperAttention(nn.Module):
                     f"Autoregressive cache shape error, expected query shape {expected_shape} instead got {query.shape}"
                 )
 
-            # Create a OHE of the current index. NOTE: the index is increased below.
+            # Create a OHE of the current index. NOTE: the index is increased below. The index is either a scalar
+            # shared by all rows, or of shape `(batch_size,)` when every row is at a different decoding step.
             cur_index = cache_index.value
 
             # In order to update the key, value caches with the current key and
@@ -422,8 +390,18 @@ class FlaxWhisperAttention(nn.Module):
             # Update key, value caches with our new 1d spatial slices.
             # We implement an efficient scatter into the cache via one-hot
             # broadcast and addition.
-            if num_updated_cache_vectors > 1:
-                indices = jnp.eye(num_updated_cache_vectors, seq_length)[None, None]
+            if cur_index.ndim > 0:
+                # per-row updates are written to positions [cur_index[b], cur_index[b] + num_updated_cache_vectors)
+                indices = jax.nn.one_hot(
+                    cur_index[:, None] + jnp.arange(num_updated_cache_vectors), seq_length, dtype=key.dtype
+                )[:, None]
+                key = cached_key.value + jnp.matmul(one_token_key, indices)
+                value = cached_value.value + jnp.matmul(one_token_value, indices)
+            elif num_updated_cache_vectors > 1:
+                # multi-token (prefill) updates are written to positions [cur_index, cur_index + num_updated_cache_vectors)
+                indices = jax.nn.one_hot(
+                    cur_index + jnp.arange(num_updated_cache_vectors), seq_length, dtype=key.dtype
+                )[None, None]
                 key = cached_key.value + jnp.matmul(one_token_key, indices)
                 value = cached_value.value + jnp.matmul(one_token_value, indices)
             else:
@@ -442,8 +420,9 @@ class FlaxWhisperAttention(nn.Module):
             # causal mask for cached decoder self-attention: our single query position should only
             # attend to those key positions that have already been generated and cached, not the
             # remaining zero elements.
+            pad_mask = jnp.arange(seq_length) < jnp.expand_dims(cur_index + num_updated_cache_vectors, -1)
             pad_mask = jnp.broadcast_to(
-                jnp.arange(seq_length) < cur_index + num_updated_cache_vectors,
+                pad_mask.reshape(pad_mask.shape[:-1] + (1, 1, seq_length)),
                 (batch_size,) + (1, num_updated_cache_vectors, seq_length),
             )
             attention_mask = combine_masks(pad_mask, attention_mask)
@@ -767,6 +746,10 @@ class FlaxWhisperDecoderLayerCollection(nn.Module):
             cross_attentions=all_cross_attentions,
         )
 
+    def init_cross_attention_cache(self, encoder_hidden_states: jnp.ndarray):
+        for decoder_layer in self.layers:
+            decoder_layer.encoder_attn.init_cross_attention_cache(encoder_hidden_states)
+
 
 class FlaxWhisperEncoder(nn.Module):
     config: WhisperConfig
@@ -928,6 +911,9 @@ class FlaxWhisperDecoder(nn.Module):
             cross_attentions=outputs.cross_attentions,
         )
 
+    def init_cross_attention_cache(self, encoder_hidden_states: jnp.ndarray):
+        self.layers.init_cross_attention_cache(encoder_hidden_states)
+
 
 class FlaxWhisperModule(nn.Module):
     config: WhisperConfig
@@ -1084,6 +1070,35 @@ class FlaxWhisperPreTrainedModel(FlaxPreTrainedModel):
         )
         return unfreeze(init_variables["cache"])
 
+    def init_cross_attention_cache(self, encoder_outputs, params: dict = None):
+        r"""
+        Args:
+            encoder_outputs (`Union[FlaxBaseModelOutput, tuple(tuple(jnp.ndarray)]`):
+                `encoder_outputs` consists of (`last_hidden_state`, *optional*: `hidden_states`, *optional*:
+                `attentions`). `last_hidden_state` of shape `(batch_size, sequence_length, hidden_size)`, *optional*)
+                is a sequence of hidden-states at the output of the last layer of the encoder. Used in the
+                cross-attention of the decoder.
+            params (`dict`, *optional*):
+                The model parameters used to project the encoder outputs to the cross-attention keys and values.
+
+        Returns:
+            The cross-attention keys and values of every decoder layer, in the same format as the cache returned by
+            [`init_cache`]. Note that the cache holds `2 * decoder_layers` tensors of shape `(batch_size,
+            sequence_length, num_heads, head_dim)`, trading device memory for the repeated projections.
+        """
+
+        def _cross_cache_forward(module, encoder_hidden_states):
+            decoder_module = module._get_decoder_module()
+            return decoder_module.init_cross_attention_cache(encoder_hidden_states)
+
+        _, cross_attention_cache = self.module.apply(
+            {"params": params or self.params},
+            encoder_hidden_states=encoder_outputs[0],
+            mutable=["cache"],
+            method=_cross_cache_forward,
+        )
+        return unfreeze(cross_attention_cache["cache"])
+
     @add_start_docstrings(WHISPER_ENCODE_INPUTS_DOCSTRING)
     @replace_return_docstrings(output_type=FlaxBaseModelOutput, config_class=WhisperConfig)
     def encode(
@@ -1592,34 +1607,272 @@ class FlaxWhisperForConditionalGeneration(FlaxWhisperPreTrainedModel):
             **kwargs,
         )
 
-    def pipeline_generate(
+    def _get_pipeline_generation_setup(self, generation_config, return_timestamps, max_length):
+        if generation_config is None:
+            generation_config = self.generation_config
+        generation_config = copy.deepcopy(generation_config)
+
+        # override the generation config forced decoder ids in preference of the ones we have set
+        generation_config.forced_decoder_ids = None
+        max_length = max_length if max_length is not None else generation_config.max_length
+
+        logits_processor = FlaxLogitsProcessorList()
+        if hasattr(generation_config, "return_timestamps") and return_timestamps:
+            logits_processor.append(FlaxWhisperTimeStampLogitsProcessor(generation_config, self.config, 1))
+        # positions are counted from the `<|startoftranscript|>` token, i.e. as for a decoder input of length 1
+        logits_processor = self._get_logits_processor(generation_config, 1, logits_processor)
+        return generation_config, logits_processor, max_length
+
+    def _pipeline_greedy_step(self, generation_config, logits_processor, sequences, is_sent_finished, logits, cur_len):
+        eos_token_id = generation_config.eos_token_id
+        pad_token_id = generation_config.pad_token_id if generation_config.pad_token_id is not None else eos_token_id
+
+        logits = logits_processor(sequences, logits, cur_len)
+        next_token = jnp.argmax(logits, axis=-1)
+        next_token = next_token * ~is_sent_finished + pad_token_id * is_sent_finished
+        next_is_sent_finished = is_sent_finished | (next_token == eos_token_id)
+        next_token = next_token[:, None]
+        next_sequences = lax.dynamic_update_slice(sequences, next_token, (0, cur_len))
+        return next_token, next_sequences, next_is_sent_finished
+
+    def pipeline_prefill(
         self,
         input_features,
         forced_decoder_ids,
         return_timestamps=False,
         generation_config=None,
-        **kwargs,
+        params=None,
+        max_length=None,
+        row_mask=None,
+        encoder_outputs=None,
     ):
-        if generation_config is None:
-            generation_config = self.generation_config
+        r"""
+        Runs the encoder and the prefill of the decoder prompt for [`~FlaxWhisperForConditionalGeneration.pipeline_generate`],
+        and returns the `GreedyState` from which free-running generation continues. Rather than forcing the tokens of
+        the decoder prompt (`<|startoftranscript|>`, language, task and `<|notimestamps|>`) one decoding step at a
+        time, each contiguous run of forced tokens is run through the decoder in a single parallel prefill pass.
 
-        # override the generation config forced decoder ids in preference of the ones we have set
-        generation_config.forced_decoder_ids = None
+        Takes the same arguments as [`~FlaxWhisperForConditionalGeneration.pipeline_generate`].
+        """
+        generation_config, logits_processor, max_length = self._get_pipeline_generation_setup(
+            generation_config, return_timestamps, max_length
+        )
+        eos_token_id = generation_config.eos_token_id
+        pad_token_id = generation_config.pad_token_id if generation_config.pad_token_id is not None else eos_token_id
+
+        # run the encoder and project the cross-attention keys / values once, rather than at every decoding step
+        if encoder_outputs is None:
+            encoder_outputs = self.encode(input_features, params=params, return_dict=True)
+        cross_attention_cache = self.init_cross_attention_cache(encoder_outputs, params=params)
+
+        batch_size = encoder_outputs.last_hidden_state.shape[0]
+        forced_tokens = {int(idx): token for idx, token in forced_decoder_ids}
+        last_forced_idx = max(forced_tokens, default=0)
+
+        decoder_input_ids = jnp.full((batch_size, 1), generation_config.decoder_start_token_id, dtype="i4")
+        model_kwargs = self.prepare_inputs_for_generation(
+            decoder_input_ids,
+            max_length,
+            encoder_outputs=encoder_outputs,
+            cross_attention_cache=cross_attention_cache,
+        )
 
-        logits_processor = FlaxLogitsProcessorList()
+        sequences = jnp.full((batch_size, max_length), pad_token_id, dtype=jnp.int32)
+        if row_mask is None:
+            is_sent_finished = jnp.zeros((batch_size,), dtype=jnp.bool_)
+        else:
+            is_sent_finished = ~jnp.asarray(row_mask, dtype=jnp.bool_)
+
+        # prefill: feed each run of forced tokens in one decoder pass, and generate the free token that follows it
+        # (e.g. the language token when no language is specified). The layout of the prompt is static, so this is
+        # unrolled at trace time.
+        cur_len = 0
+        prefill_ids = decoder_input_ids
+        while True:
+            while cur_len + prefill_ids.shape[1] in forced_tokens:
+                # the forced token id is either shared by all rows or given per row
+                forced_token = forced_tokens[cur_len + prefill_ids.shape[1]]
+                forced_token = jnp.broadcast_to(jnp.asarray(forced_token, dtype="i4"), (batch_size,))[:, None]
+                forced_token = jnp.where(is_sent_finished[:, None], pad_token_id, forced_token)
+                prefill_ids = jnp.concatenate([prefill_ids, forced_token], axis=-1)
+
+            sequences = lax.dynamic_update_slice(sequences, prefill_ids, (0, cur_len))
+            num_prefill_tokens = prefill_ids.shape[1]
+            model_kwargs["decoder_position_ids"] = jnp.broadcast_to(
+                jnp.arange(cur_len, cur_len + num_prefill_tokens, dtype="i4")[None, :],
+                (batch_size, num_prefill_tokens),
+            )
+            model_outputs = self.decode(prefill_ids, params=params, **model_kwargs)
+            model_kwargs = self.update_inputs_for_generation(model_outputs, model_kwargs)
+            cur_len += num_prefill_tokens
 
-        logits_processor.append(FlaxStaticForceTokensLogitsProcessor(forced_decoder_ids))
+            prefill_ids, sequences, is_sent_finished = self._pipeline_greedy_step(
+                generation_config, logits_processor, sequences, is_sent_finished, model_outputs.logits[:, -1], cur_len
+            )
+            if cur_len >= last_forced_idx or cur_len + 1 >= max_length:
+                break
+
+        return GreedyState(
+            cur_len=jnp.array(cur_len + 1),
+            sequences=sequences,
+            running_token=prefill_ids,
+            is_sent_finished=is_sent_finished,
+            model_kwargs=model_kwargs,
+        )
 
-        if hasattr(generation_config, "return_timestamps") and return_timestamps:
-            logits_processor.append(FlaxWhisperTimeStampLogitsProcessor(generation_config, self.config, 1))
+    def pipeline_generate(
+        self,
+        input_features,
+        forced_decoder_ids,
+        return_timestamps=False,
+        generation_config=None,
+        params=None,
+        max_length=None,
+        row_mask=None,
+        encoder_outputs=None,
+    ):
+        r"""
+        Greedy generation used by [`FlaxWhisperPipline`]. Rather than forcing the tokens of the decoder prompt
+        (`<|startoftranscript|>`, language, task and `<|notimestamps|>`) one decoding step at a time, each contiguous
+        run of forced tokens is run through the decoder in a single parallel prefill pass. Free-running generation
+        then starts directly after the last forced token. Each row is finished as soon as it emits the EOS token, and
+        decoding stops once all rows are finished.
 
-        return super().generate(
+        Args:
+            input_features (`jnp.ndarray` of shape `(batch_size, feature_size, sequence_length)`):
+                Float values of the log-mel features. Can be `None` if `encoder_outputs` are given.
+            forced_decoder_ids (`list`):
+                List of `(index, token_id)` pairs giving the tokens forced at each decoder position. The indices must
+                be Python integers, since they determine the (static) layout of the prefill passes, but the token ids
+                may be traced, such that changing the language or task does not trigger a re-compilation. A token id
+                can also be an array of shape `(batch_size,)` to force a different token in each row.
+            return_timestamps (`bool`, *optional*, defaults to `False`):
+                Whether to predict timestamp tokens.
+            generation_config (`GenerationConfig`, *optional*):
+                The generation config to use. Defaults to `self.generation_config`.
+            params (`dict`, *optional*):
+                The model parameters.
+            max_length (`int`, *optional*):
+                The maximum number of tokens to generate. Defaults to `generation_config.max_length`.
+            row_mask (`jnp.ndarray` of shape `(batch_size,)`, *optional*):
+                Boolean mask that is `False` for rows that only pad the batch to a fixed shape. Padding rows are
+                marked as finished from the first step, such that they neither generate tokens nor keep the decoding
+                loop running.
+            encoder_outputs (`FlaxBaseModelOutput`, *optional*):
+                Pre-computed outputs of the encoder, e.g. to decode the same audio with several decoder prompts
+                without re-running the encoder. If given, `input_features` are not used.
+        """
+        generation_config, logits_processor, max_length = self._get_pipeline_generation_setup(
+            generation_config, return_timestamps, max_length
+        )
+        state = self.pipeline_prefill(
             input_features,
-            generation_config,
-            logits_processor=logits_processor,
-            **kwargs,
+            forced_decoder_ids,
+            return_timestamps=return_timestamps,
+            generation_config=generation_config,
+            params=params,
+            max_length=max_length,
+            row_mask=row_mask,
+            encoder_outputs=encoder_outputs,
         )
 
+        def greedy_search_cond_fn(state):
+            """state termination condition fn."""
+            has_reached_max_length = state.cur_len == max_length
+            all_sequence_finished = jnp.all(state.is_sent_finished)
+            finish_generation = jnp.logical_or(has_reached_max_length, all_sequence_finished)
+            return ~finish_generation
+
+        def greedy_search_body_fn(state):
+            """state update fn."""
+            model_outputs = self.decode(state.running_token, params=params, **state.model_kwargs)
+            next_token, next_sequences, next_is_sent_finished = self._pipeline_greedy_step(
+                generation_config,
+                logits_processor,
+                state.sequences,
+                state.is_sent_finished,
+                model_outputs.logits[:, -1],
+                state.cur_len,
+            )
+            next_model_kwargs = self.update_inputs_for_generation(model_outputs, state.model_kwargs)
+            return GreedyState(
+                cur_len=state.cur_len + 1,
+                sequences=next_sequences,
+                running_token=next_token,
+                is_sent_finished=next_is_sent_finished,
+                model_kwargs=next_model_kwargs,
+            )
+
+        state = lax.while_loop(greedy_search_cond_fn, greedy_search_body_fn, state)
+
+        return FlaxGreedySearchOutput(sequences=state.sequences)
+
+    def pipeline_decode_steps(
+        self,
+        state,
+        max_steps,
+        return_timestamps=False,
+        generation_config=None,
+        params=None,
+        max_length=None,
+    ):
+        r"""
+        Free-running greedy decoding for in-flight batching, where every row of the batch is at its own decoding step.
+        Continues from a `GreedyState` whose `cur_len` is of shape `(batch_size,)` and whose self-attention caches have
+        per-row cache indices (see [`InflightDecodeEngine`]). A row is finished once it emits the EOS token or fills
+        `max_length` tokens. Decoding stops after `max_steps` steps, as soon as any row finishes (such that its slot
+        can be refilled) or once all rows are finished.
+
+        Returns:
+            A tuple of the updated `GreedyState`, the number of decoding steps run and the number of row-steps that
+            were spent on unfinished rows.
+        """
+        generation_config, logits_processor, max_length = self._get_pipeline_generation_setup(
+            generation_config, return_timestamps, max_length
+        )
+
+        def row_step(sequences, is_sent_finished, logits, cur_len):
+            # the logits processors expect a single `cur_len` for the batch, so they are applied row by row
+            _, next_sequences, next_is_sent_finished = self._pipeline_greedy_step(
+                generation_config, logits_processor, sequences[None], is_sent_finished[None], logits[None], cur_len
+            )
+            # finished rows are left untouched, in particular rows that filled `max_length` must not overwrite their
+            # last token (the update index is clipped to the sequence length)
+            next_sequences = jnp.where(is_sent_finished, sequences, next_sequences[0])
+            return next_sequences, next_is_sent_finished[0]
+
+        def cond_fn(carry):
+            state, num_steps, _ = carry
+            any_newly_finished = jnp.any(state.is_sent_finished & ~start_is_sent_finished)
+            return (num_steps < max_steps) & ~any_newly_finished & ~jnp.all(state.is_sent_finished)
+
+        def body_fn(carry):
+            state, num_steps, active_row_steps = carry
+            model_kwargs = state.model_kwargs
+            model_kwargs["decoder_position_ids"] = state.cur_len[:, None] - 1
+            model_outputs = self.decode(state.running_token, params=params, **model_kwargs)
+
+            next_sequences, next_is_sent_finished = jax.vmap(row_step)(
+                state.sequences, state.is_sent_finished, model_outputs.logits[:, -1], state.cur_len
+            )
+            next_token = jnp.take_along_axis(
+                next_sequences, jnp.minimum(state.cur_len, max_length - 1)[:, None], axis=-1
+            )
+            next_cur_len = jnp.where(state.is_sent_finished, state.cur_len, state.cur_len + 1)
+            next_is_sent_finished = next_is_sent_finished | (next_cur_len >= max_length)
+            next_model_kwargs = self.update_inputs_for_generation(model_outputs, model_kwargs)
+            next_state = GreedyState(
+                cur_len=next_cur_len,
+                sequences=next_sequences,
+                running_token=next_token,
+                is_sent_finished=next_is_sent_finished,
+                model_kwargs=next_model_kwargs,
+            )
+            return next_state, num_steps + 1, active_row_steps + jnp.sum(~state.is_sent_finished)
+
+        start_is_sent_finished = state.is_sent_finished
+        return lax.while_loop(cond_fn, body_fn, (state, jnp.array(0), jnp.array(0)))
+
     def prepare_inputs_for_generation(
         self,
         decoder_input_ids,
@@ -1627,12 +1880,15 @@ class FlaxWhisperForConditionalGeneration(FlaxWhisperPreTrainedModel):
         attention_mask: Optional[jax.Array] = None,
         decoder_attention_mask: Optional[jax.Array] = None,
         encoder_outputs=None,
+        cross_attention_cache=None,
         **kwargs,
     ):
         # initializing the cache
         batch_size, seq_length = decoder_input_ids.shape
 
         past_key_values = self.init_cache(batch_size, max_length, encoder_outputs)
+        if cross_attention_cache is not None:
+            past_key_values = unflatten_dict({**flatten_dict(past_key_values), **flatten_dict(cross_attention_cache)})
         # Note that usually one would have to put 0's in the attention_mask for x > input_ids.shape[-1] and x < cache_length.
         # But since the decoder uses a causal mask, those positions are masked anyways.
         # Thus we can create a single static attention_mask here, which is more efficient for compilation
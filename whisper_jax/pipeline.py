@@ -14,24 +14,38 @@
 # limitations under the License.
 
 
+import itertools
 import math
 
 import jax
 import jax.numpy as jnp
 import numpy as np
-import requests
 from flax import jax_utils
 from flax.core.frozen_dict import freeze
 from flax.training.common_utils import shard
+from jax.sharding import NamedSharding
 from jax.sharding import PartitionSpec as P
 from transformers import WhisperProcessor, is_tokenizers_available, WhisperFeatureExtractor, WhisperTokenizerFast
-from transformers.models.whisper.tokenization_whisper import TO_LANGUAGE_CODE, WhisperTokenizer
+from transformers.modeling_flax_outputs import FlaxBaseModelOutput
+from transformers.models.whisper.tokenization_whisper import (
+    LANGUAGES,
+    TO_LANGUAGE_CODE,
+    WhisperTokenizer,
+    _find_longest_common_sequence,
+)
 from transformers.pipelines.audio_utils import ffmpeg_read
 from transformers.utils import logging
 
+from .audio import ffmpeg_stream, hash_blocks, stream_windows
+from .cache import ChunkResultCache
+from .executor import PipelinedExecutor
+from .feature_extraction import WhisperLogMelExtractor
+from .feature_pool import FeatureExtractionPool
+from .media import HTTPStream, URLPrefetcher
 from .modeling_flax_whisper import FlaxWhisperForConditionalGeneration
 from .partitioner import PjitPartitioner
 from .train_state import InferenceState
+from .vad import VoiceActivityDetector, find_chunk_boundaries
 
 
 logger = logging.get_logger(__name__)
@@ -52,6 +66,122 @@ logical_axis_rules_dp = (
 )
 
 
+class IncrementalASRDecoder:
+    def __init__(self, tokenizer, time_precision, return_language=None):
+        """
+        Resumable version of the `_decode_asr` stitching of the Whisper tokenizer for segment-level timestamps. The
+        state of the stitching is kept between calls to [`~IncrementalASRDecoder.add`], such that every chunk is
+        merged once, in order, and the segments it closes are returned straight away. A closed segment is never
+        changed by the chunks that follow, so the segments returned by `add` and [`~IncrementalASRDecoder.finish`]
+        are the same as the `"chunks"` returned by `_decode_asr` for all the chunks at once.
+
+        Args
+            tokenizer (`WhisperTokenizer`):
+                The tokenizer used to decode the text of each segment.
+            time_precision (`float`):
+                The time in seconds between two consecutive timestamp tokens.
+            return_language (`bool`, *optional*):
+                Whether to keep the language of each segment.
+        """
+        self.tokenizer = tokenizer
+        self.time_precision = time_precision
+        self.return_language = return_language
+
+        self.timestamp_begin = tokenizer.convert_tokens_to_ids("<|notimestamps|>") + 1
+        self.all_special_ids = set(tokenizer.all_special_ids)
+        self.prompt_token_id = tokenizer.convert_tokens_to_ids("<|startofprev|>")
+        self.decoder_start_token_id = tokenizer.convert_tokens_to_ids("<|startoftranscript|>")
+
+        # the state of `_decode_asr` between two chunks
+        self.last_language = None
+        self.segment = self._new_segment()
+        self.time_offset = 0.0
+        self.previous_tokens = []
+        self.skip = False
+
+    def _new_segment(self):
+        return {"language": self.last_language, "timestamp": [None, None], "text": ""}
+
+    def _close_segment(self):
+        segment = self.segment
+        segment["text"] = self.tokenizer.decode(_find_longest_common_sequence(self.previous_tokens))
+        segment["timestamp"] = tuple(segment["timestamp"])
+        if not self.return_language:
+            segment.pop("language")
+        return segment
+
+    def add(self, output):
+        """
+        Merges the next chunk, a `dict` with the `"tokens"` of the chunk and its `"stride"` in seconds as in
+        [`FlaxWhisperPipline.postprocess`], and returns the segments it closes.
+        """
+        segments = []
+        token_ids = output["tokens"][0].tolist()
+        token_ids = self.tokenizer._strip_prompt(token_ids, self.prompt_token_id, self.decoder_start_token_id)
+
+        # timestamps in the strides are not split on, but resolved once out of both strides
+        last_timestamp = None
+        first_timestamp = self.timestamp_begin
+        if "stride" in output:
+            chunk_len, stride_left, stride_right = output["stride"]
+            self.time_offset -= stride_left
+            right_stride_start = chunk_len - stride_right
+            if stride_left:
+                first_timestamp = stride_left / self.time_precision + self.timestamp_begin
+            if stride_right:
+                for token in reversed(token_ids):
+                    if token >= self.timestamp_begin:
+                        if (
+                            last_timestamp is not None
+                            and (token - self.timestamp_begin) * self.time_precision < right_stride_start
+                        ):
+                            break
+                        last_timestamp = token
+
+        current_tokens = []
+        for token in token_ids:
+            if token in self.all_special_ids:
+                language = LANGUAGES.get(self.tokenizer.decode([token])[2:-2], None)
+                if language is not None:
+                    self.segment["language"] = language
+                    self.last_language = language
+            elif token >= self.timestamp_begin:
+                time = round((token - self.timestamp_begin) * self.time_precision + self.time_offset, 2)
+                if last_timestamp and token >= last_timestamp:
+                    # the timestamp falls in the right stride, so it is skipped together with the one following it
+                    self.skip = True
+                elif self.skip or (self.previous_tokens and token < first_timestamp):
+                    self.skip = False
+                elif self.segment["timestamp"][0] is None:
+                    self.segment["timestamp"][0] = time
+                elif time != self.segment["timestamp"][0]:
+                    # a repeated start timestamp is not an end, it is kept as the start
+                    self.segment["timestamp"][1] = time
+                    self.previous_tokens.append(current_tokens)
+                    segments.append(self._close_segment())
+                    self.previous_tokens = []
+                    current_tokens = []
+                    self.segment = self._new_segment()
+            else:
+                current_tokens.append(token)
+
+        if "stride" in output:
+            self.time_offset += chunk_len - stride_right
+
+        if current_tokens:
+            self.previous_tokens.append(current_tokens)
+        elif not any(tokens for tokens in self.previous_tokens):
+            self.segment = self._new_segment()
+            self.previous_tokens = []
+        return segments
+
+    def finish(self):
+        """Returns the last segment, which is left open if the tokens of the last chunk did not end it."""
+        if not self.previous_tokens:
+            return []
+        return [self._close_segment()]
+
+
 class FlaxWhisperPipline:
     def __init__(
         self,
@@ -59,6 +189,11 @@ class FlaxWhisperPipline:
         dtype=jnp.float32,
         batch_size=None,
         max_length=None,
+        on_device_features=False,
+        batch_buckets=None,
+        vad=None,
+        num_feature_workers=None,
+        chunk_cache=None,
     ):
         """
         Args
@@ -75,12 +210,50 @@ class FlaxWhisperPipline:
                 a batch size in the `__init__` method will be superseded by any batch size passed to the `__call__` method.
             max_length (`int`, *optional*):
                 The maximum numbers of tokens to generate. Defaults to `model.config.max_length`.
+            on_device_features (`bool`, *optional*, defaults to `False`):
+                Whether to compute the log-mel features on the accelerator. If `True`, the pre-processing only slices
+                the audio into zero-padded 16kHz windows of 16-bit PCM, and the conversion to float, STFT, mel
+                projection and normalisation run in JAX as part of the same compiled program as generation. This removes the host-side feature extraction, which
+                otherwise dominates the runtime for long audio files.
+            batch_buckets (`List[int]`, *optional*):
+                The ladder of batch sizes that generation is compiled for. Each batch is padded to the smallest bucket
+                that fits it, rather than to the full `batch_size`, such that short inputs and the last partial batch
+                of a long input only pay for the rows they use. Each bucket must be a multiple of the number of JAX
+                devices. Defaults to the powers of two times the number of devices up to `batch_size`, e.g. `[1, 2, 4,
+                8, 16, 32]` for `batch_size=32` on a single device. Use [`~FlaxWhisperPipline.precompile`] to compile
+                all buckets ahead of time.
+            vad (`bool` or [`VoiceActivityDetector`], *optional*):
+                Whether to skip the chunks that hold no speech. If set, an energy / spectral-flux voice activity
+                detector scores the audio before batching, and chunks without speech are not run through the model:
+                they are decoded as empty chunks, which keeps the timestamps of the remaining chunks aligned to the
+                original audio. Pass `True` for the default detector, or a [`VoiceActivityDetector`] to tune it.
+            num_feature_workers (`int`, *optional*):
+                The number of worker processes that compute the log-mel features of each batch in parallel, see
+                [`FeatureExtractionPool`]. Defaults to computing them in the calling process. Not used with
+                `on_device_features=True`, where the host only slices the audio.
+            chunk_cache (`bool` or [`ChunkResultCache`], *optional*):
+                Whether to cache the token ids of each chunk by the hash of its audio window and decoding config. If
+                set, chunked inputs are hashed window by window, and the chunks found in the cache are taken out of
+                their batch and only the others are run on device. Pass `True` for a cache with the default size, or
+                a [`ChunkResultCache`] to size it.
         """
         self.checkpoint = checkpoint
         self.dtype = dtype
 
         self.processor = WhisperProcessor.from_pretrained(self.checkpoint)
         self.feature_extractor = self.processor.feature_extractor
+        self.log_mel_extractor = WhisperLogMelExtractor.from_feature_extractor(self.feature_extractor)
+        self.on_device_features = on_device_features
+        # start the workers before the model is loaded, such that they do not inherit the parameters
+        self.feature_pool = None
+        if num_feature_workers and not on_device_features:
+            self.feature_pool = FeatureExtractionPool(self.log_mel_extractor, num_workers=num_feature_workers)
+        if vad is True:
+            vad = VoiceActivityDetector(sampling_rate=self.feature_extractor.sampling_rate)
+        self.vad = vad or None
+        if chunk_cache is True:
+            chunk_cache = ChunkResultCache()
+        self.chunk_cache = chunk_cache or None
         # potentially load fast tokenizer if available
         tokenizer_cls = WhisperTokenizerFast if is_tokenizers_available() else WhisperTokenizer
         self.tokenizer = tokenizer_cls.from_pretrained(checkpoint)
@@ -97,11 +270,25 @@ class FlaxWhisperPipline:
             batch_size if batch_size is not None else self.min_batch_size
         )  # we need a minimum of 1 batch per-device
 
-        def generate(params, input_features, forced_decoder_ids, return_timestamps):
+        if batch_buckets is not None:
+            for bucket in batch_buckets:
+                if bucket % self.min_batch_size != 0:
+                    raise ValueError(
+                        f"Batch buckets must be multiples of the number of JAX devices, but got bucket {bucket} and num devices {self.min_batch_size}."
+                    )
+            self.batch_buckets = sorted(set(batch_buckets))
+        else:
+            self.batch_buckets = self.default_batch_buckets(self.batch_size)
+
+        def generate(params, input_features, row_mask, forced_token_ids, forced_positions, return_timestamps):
+            if self.on_device_features:
+                # the inputs are raw audio windows, which we convert to log-mel features within the compiled program
+                input_features = self.log_mel_extractor.jax_log_mel_spectrogram(input_features)
             output_ids = self.model.pipeline_generate(
                 input_features,
                 params=params,
-                forced_decoder_ids=forced_decoder_ids,
+                row_mask=row_mask,
+                forced_decoder_ids=list(zip(forced_positions, forced_token_ids)),
                 return_timestamps=return_timestamps,
                 max_length=self.max_length,
             )
@@ -110,7 +297,12 @@ class FlaxWhisperPipline:
         # use pmap for DP by default - this is compatible on a Colab TPU v2
         self.params = jax_utils.replicate(self.params)
         self.p_generate = jax.pmap(
-            generate, "input_features", in_axes=(0, 0, None), out_axes=0, static_broadcasted_argnums=(3,)
+            generate, "input_features", in_axes=(0, 0, 0, None), out_axes=0, static_broadcasted_argnums=(4, 5)
+        )
+        # separately compiled encoder and decoder stages, to decode the same audio with several decoder prompts
+        self.p_encode = jax.pmap(self._encode_fn, "input_features", in_axes=(0, 0), out_axes=0)
+        self.p_decode = jax.pmap(
+            self._decode_fn, "input_features", in_axes=(0, 0, 0, None), out_axes=0, static_broadcasted_argnums=(4, 5)
         )
         self.is_sharded = False
 
@@ -162,12 +354,19 @@ class FlaxWhisperPipline:
         # This will auto-magically run in mesh context
         self.params = p_shard_params(freeze(jax_utils.unreplicate(self.params)))
         self.is_sharded = True
-
-        def generate(params, input_features, forced_decoder_ids, return_timestamps):
+        self.partitioner = partitioner
+        self.params_spec = params_spec
+        self.input_sharding = NamedSharding(partitioner.mesh, P("data"))
+
+        def generate(params, input_features, row_mask, forced_token_ids, forced_positions, return_timestamps):
+            if self.on_device_features:
+                # the inputs are raw audio windows, which we convert to log-mel features within the compiled program
+                input_features = self.log_mel_extractor.jax_log_mel_spectrogram(input_features)
             output_ids = self.model.pipeline_generate(
                 input_features,
                 params=params,
-                forced_decoder_ids=forced_decoder_ids,
+                row_mask=row_mask,
+                forced_decoder_ids=list(zip(forced_positions, forced_token_ids)),
                 return_timestamps=return_timestamps,
                 max_length=self.max_length,
             )
@@ -176,28 +375,168 @@ class FlaxWhisperPipline:
         # Use pjit for generate only once we've sharded the params
         self.p_generate = partitioner.partition(
             generate,
-            in_axis_resources=(params_spec, P("data"), None),
+            in_axis_resources=(params_spec, P("data"), P("data"), None),
             out_axis_resources=P("data"),
-            static_argnums=(3,),
+            static_argnums=(4, 5),
+        )
+        self.p_encode = partitioner.partition(
+            self._encode_fn, in_axis_resources=(params_spec, P("data")), out_axis_resources=P("data")
+        )
+        self.p_decode = partitioner.partition(
+            self._decode_fn,
+            in_axis_resources=(params_spec, P("data"), P("data"), None),
+            out_axis_resources=P("data"),
+            static_argnums=(4, 5),
+        )
+
+    def _encode_fn(self, params, input_features):
+        if self.on_device_features:
+            input_features = self.log_mel_extractor.jax_log_mel_spectrogram(input_features)
+        return self.model.encode(input_features, params=params, return_dict=True).last_hidden_state
+
+    def _decode_fn(
+        self, params, encoder_hidden_states, row_mask, forced_token_ids, forced_positions, return_timestamps
+    ):
+        return self.model.pipeline_generate(
+            None,
+            params=params,
+            row_mask=row_mask,
+            forced_decoder_ids=list(zip(forced_positions, forced_token_ids)),
+            return_timestamps=return_timestamps,
+            max_length=self.max_length,
+            encoder_outputs=FlaxBaseModelOutput(last_hidden_state=encoder_hidden_states),
         )
 
-    def generate(self, input_features, language=None, task=None, return_timestamps=False):
+    def _device_put_inputs(self, input_features):
+        # the copy to device is asynchronous, such that the next batch can be transferred while the current one decodes
+        if not self.is_sharded:
+            # with pmap we need to manually split the batch across the local devices
+            return jax.device_put_sharded(list(shard(input_features)), jax.local_devices())
+        return jax.device_put(input_features, self.input_sharding)
+
+    def generate_async(self, input_features, language=None, task=None, return_timestamps=False, row_mask=None):
+        """
+        Dispatches generation for a batch of inputs and returns immediately with the (on-device) output token ids of
+        shape `(batch_size, max_length)`. Relies on JAX's asynchronous dispatch: the host is free to prepare the next
+        batch while this one is decoded, and only blocks once the token ids are fetched with `jax.device_get`.
+
+        `row_mask` is an optional boolean array of shape `(batch_size,)` that is `False` for padding rows. Padding rows
+        are finished from the first decoding step, so they never keep the decoding loop running.
+        """
+        # note that `input_features` are the 16-bit PCM audio windows of shape `(batch_size, n_samples)` when using
+        # `on_device_features=True`
+        forced_positions, forced_token_ids = self._get_forced_prompt(language, task, return_timestamps)
+        if row_mask is None:
+            row_mask = np.ones((input_features.shape[0],), dtype=bool)
+        input_features = self._device_put_inputs(input_features)
+        row_mask = self._device_put_inputs(row_mask)
+        output_ids = self.p_generate(
+            freeze(self.params), input_features, row_mask, forced_token_ids, forced_positions, return_timestamps
+        ).sequences
+        if not self.is_sharded:
+            # merge the device axis back into the batch axis
+            output_ids = output_ids.reshape(-1, self.max_length)
+        return output_ids
+
+    def _get_forced_prompt(self, language=None, task=None, return_timestamps=False):
         forced_decoder_ids = self.get_forced_decoder_ids(
             language=language, task=task, return_timestamps=return_timestamps
         )
+        # the positions of the forced tokens fix the (static) layout of the prompt prefill, whereas the token ids are
+        # traced so that switching between languages or tasks does not trigger a re-compilation
+        forced_positions = tuple(idx for idx, _ in forced_decoder_ids)
+        forced_token_ids = [token for _, token in forced_decoder_ids]
+        return forced_positions, forced_token_ids
+
+    def encode(self, input_features):
+        """
+        Runs the encoder on a batch of inputs, and returns the encoder hidden states. The hidden states are left on
+        device (in the layout expected by [`~FlaxWhisperPipline.decode`]), such that they can be decoded several
+        times, e.g. for both transcription and translation, while running the encoder only once.
+        """
+        return self.p_encode(freeze(self.params), self._device_put_inputs(input_features))
+
+    def decode_async(self, encoder_outputs, language=None, task=None, return_timestamps=False, row_mask=None):
+        """
+        Same as [`~FlaxWhisperPipline.generate_async`], but decodes encoder hidden states returned by
+        [`~FlaxWhisperPipline.encode`] rather than running the encoder.
+        """
+        forced_positions, forced_token_ids = self._get_forced_prompt(language, task, return_timestamps)
+        if row_mask is None:
+            # with pmap, the encoder outputs carry a leading device axis
+            batch_size = (
+                encoder_outputs.shape[0] if self.is_sharded else encoder_outputs.shape[0] * encoder_outputs.shape[1]
+            )
+            row_mask = np.ones((batch_size,), dtype=bool)
+        output_ids = self.p_decode(
+            freeze(self.params),
+            encoder_outputs,
+            self._device_put_inputs(row_mask),
+            forced_token_ids,
+            forced_positions,
+            return_timestamps,
+        ).sequences
+        if not self.is_sharded:
+            # merge the device axis back into the batch axis
+            output_ids = output_ids.reshape(-1, self.max_length)
+        return output_ids
+
+    def generate(self, input_features, language=None, task=None, return_timestamps=False, row_mask=None):
+        output_ids = self.generate_async(
+            input_features, language=language, task=task, return_timestamps=return_timestamps, row_mask=row_mask
+        )
         if not self.is_sharded:
-            # if we're using pmap we need to manually replicate the input data across devices and gather the output tokens
-            output_ids = self.p_generate(
-                freeze(self.params), shard(input_features), forced_decoder_ids, return_timestamps
-            ).sequences
-            output_ids = jax.device_get(output_ids.reshape(-1, self.max_length))
-        else:
-            # pjit handles replication / gathering for us auto-magically
-            output_ids = self.p_generate(
-                freeze(self.params), input_features, forced_decoder_ids, return_timestamps
-            ).sequences
+            # if we're using pmap we need to manually gather the output tokens
+            output_ids = jax.device_get(output_ids)
+        # pjit handles replication / gathering for us auto-magically
         return output_ids
 
+    def default_batch_buckets(self, batch_size):
+        buckets = []
+        bucket = self.min_batch_size
+        while bucket < batch_size:
+            buckets.append(bucket)
+            bucket *= 2
+        return buckets + [batch_size]
+
+    def get_batch_bucket(self, num_rows, batch_size=None):
+        """Returns the smallest compiled batch size that holds `num_rows`, capped at `batch_size`."""
+        batch_size = batch_size if batch_size is not None else self.batch_size
+        for bucket in self.batch_buckets:
+            if num_rows <= bucket < batch_size:
+                return bucket
+        return batch_size
+
+    def precompile(self, batch_sizes=None, language=None, task=None, return_timestamps=False):
+        """
+        Compiles generation for each of the batch size buckets by running it on dummy inputs, such that the first
+        requests are not hit with the compilation time. Since `return_timestamps` and the layout of the forced decoder
+        ids are static, they should match the configuration used at inference.
+
+        Args:
+            batch_sizes (`List[int]`, *optional*, defaults to `batch_buckets`):
+                The batch sizes to compile.
+            language (`str`, *optional*):
+                The language to compile for. Only whether a language is set matters, not which one.
+            task (`str`, *optional*):
+                The task to compile for. Only whether a task is set matters, not which one.
+            return_timestamps (`bool`, *optional*, defaults to `False`):
+                Whether to compile generation with timestamp prediction.
+        """
+        batch_sizes = batch_sizes if batch_sizes is not None else self.batch_buckets
+        if self.on_device_features:
+            input_shape, input_dtype = (self.log_mel_extractor.n_samples,), np.int16
+        else:
+            input_shape = (self.model.config.num_mel_bins, 2 * self.model.config.max_source_positions)
+            input_dtype = np.float32
+
+        for batch_size in batch_sizes:
+            input_features = np.ones((batch_size, *input_shape), dtype=input_dtype)
+            output_ids = self.generate(
+                input_features, language=language, task=task, return_timestamps=return_timestamps
+            )
+            jax.block_until_ready(output_ids)
+
     def get_forced_decoder_ids(self, generation_config=None, task=None, language=None, return_timestamps=False):
         if generation_config is None:
             generation_config = self.model.generation_config
@@ -245,38 +584,156 @@ class FlaxWhisperPipline:
 
         return forced_decoder_ids
 
-    def chunk_iter_with_batch(self, inputs, chunk_len, stride_left, stride_right, batch_size):
+    def chunk_iter_with_batch(self, inputs, chunk_len, stride_left, stride_right, batch_size, chunk_start_idx=None):
         inputs_len = inputs.shape[0]
-        step = chunk_len - stride_left - stride_right
-
-        all_chunk_start_idx = np.arange(0, inputs_len, step)
+        if chunk_start_idx is None:
+            step = chunk_len - stride_left - stride_right
+            all_chunk_start_idx = np.arange(0, inputs_len, step)
+            all_chunk_end_idx = all_chunk_start_idx + chunk_len
+        else:
+            # pre-computed (adaptive) chunks tile the input, each chunk ending where the next one starts
+            all_chunk_start_idx = np.asarray(chunk_start_idx)
+            all_chunk_end_idx = np.append(all_chunk_start_idx[1:], inputs_len)
+        all_chunk_lens = np.minimum(all_chunk_end_idx, inputs_len) - all_chunk_start_idx
         num_samples = len(all_chunk_start_idx)
 
-        num_batches = math.ceil(num_samples / batch_size)
-        batch_idx = np.array_split(np.arange(num_samples), num_batches)
+        if self.vad is None:
+            speech_mask = None
+            num_batches = math.ceil(num_samples / batch_size)
+            batch_idx = np.array_split(np.arange(num_samples), num_batches)
+        else:
+            speech_mask = self.vad.window_speech_mask(inputs, all_chunk_start_idx, all_chunk_lens)
+            num_speech = int(speech_mask.sum())
+            if num_speech < num_samples:
+                logger.info(f"Skipping {num_samples - num_speech} of {num_samples} chunks without speech")
+            # fill every batch with up to `batch_size` speech chunks, the silent chunks in between ride along with
+            # the batch they fall in but are not run through the model
+            num_batches = max(math.ceil(num_speech / batch_size), 1)
+            speech_idx = np.array_split(np.flatnonzero(speech_mask), num_batches)
+            batch_ends = [idx[-1] + 1 for idx in speech_idx[:-1]] + [num_samples]
+            batch_idx = np.split(np.arange(num_samples), batch_ends[:-1])
 
         for idx in batch_idx:
             chunk_start_idx = all_chunk_start_idx[idx]
-            chunk_end_idx = chunk_start_idx + chunk_len
+            chunk_end_idx = all_chunk_end_idx[idx]
+            chunk_lens = all_chunk_lens[idx]
+            # only the chunks that hold speech are pre-processed
+            model_idx = slice(None) if speech_mask is None else speech_mask[idx]
+            processed = self._preprocess_chunks(inputs, chunk_start_idx[model_idx], chunk_lens[model_idx])
+            if speech_mask is not None:
+                processed["speech_mask"] = speech_mask[idx]
+            if self.chunk_cache is not None:
+                processed["chunk_hash"] = self._hash_chunks(inputs, chunk_start_idx[model_idx], chunk_lens[model_idx])
+
+            strides = self._get_chunk_strides(
+                chunk_start_idx, chunk_end_idx, chunk_lens, inputs_len, stride_left, stride_right
+            )
+            yield {"stride": strides, **processed}
 
-            chunks = [inputs[chunk_start:chunk_end] for chunk_start, chunk_end in zip(chunk_start_idx, chunk_end_idx)]
-            processed = self.feature_extractor(
-                chunks, sampling_rate=self.feature_extractor.sampling_rate, return_tensors="np"
+    def chunk_iter_from_stream(self, blocks, chunk_len, stride_left, stride_right, batch_size):
+        """
+        Same as `chunk_iter_with_batch`, but over a stream of audio blocks such as the one returned by
+        [`~whisper_jax.audio.ffmpeg_stream`]. Each batch is yielded as soon as its chunks have been decoded, and only
+        the chunks of the current batch are held in memory. With a voice activity detector, the noise floor is
+        estimated over the chunks of each batch rather than over the whole input.
+        """
+        step = chunk_len - stride_left - stride_right
+        windows = stream_windows(blocks, chunk_len, step)
+        while True:
+            batch = list(itertools.islice(windows, batch_size))
+            if not batch:
+                break
+            chunk_start_idx = np.array([chunk_start for chunk_start, _, _ in batch])
+            chunk_lens = np.array([len(chunk) for _, chunk, _ in batch])
+            # the length of the stream is only known once it has ended, until then more audio follows every chunk
+            inputs_len = batch[-1][2] if batch[-1][2] is not None else np.iinfo(np.int64).max
+
+            # lay the chunks out back to back, such that they are pre-processed like slices of a single waveform
+            inputs = np.concatenate([chunk for _, chunk, _ in batch])
+            offsets = np.concatenate([[0], np.cumsum(chunk_lens)[:-1]])
+            speech_mask = None if self.vad is None else self.vad.window_speech_mask(inputs, offsets, chunk_lens)
+            model_idx = slice(None) if speech_mask is None else speech_mask
+            processed = self._preprocess_chunks(inputs, offsets[model_idx], chunk_lens[model_idx])
+            if speech_mask is not None:
+                processed["speech_mask"] = speech_mask
+            if self.chunk_cache is not None:
+                processed["chunk_hash"] = self._hash_chunks(inputs, offsets[model_idx], chunk_lens[model_idx])
+
+            strides = self._get_chunk_strides(
+                chunk_start_idx, chunk_start_idx + chunk_len, chunk_lens, inputs_len, stride_left, stride_right
             )
+            yield {"stride": strides, **processed}
 
-            _stride_left = np.where(chunk_start_idx == 0, 0, stride_left)
-            is_last = np.where(stride_right > 0, chunk_end_idx > inputs_len, chunk_end_idx >= inputs_len)
-            _stride_right = np.where(is_last, 0, stride_right)
+    def _preprocess_chunks(self, inputs, chunk_start_idx, chunk_lens):
+        if self.on_device_features:
+            # the log-mel features are computed on device, so we only need to slice the audio into windows, sent as
+            # 16-bit PCM to halve the size of the copy to device
+            return {
+                "input_values": self.log_mel_extractor.pad_chunks(
+                    inputs, chunk_start_idx, chunk_lens, center=False, dtype=np.int16
+                )
+            }
+        # extract the features of all chunks in the batch in one vectorized pass over the waveform, split across the
+        # worker processes if there are any
+        log_mel_extractor = self.feature_pool if self.feature_pool is not None else self.log_mel_extractor
+        return {"input_features": log_mel_extractor(inputs, chunk_start_idx, chunk_lens)}
+
+    def _hash_chunks(self, inputs, chunk_start_idx, chunk_lens):
+        # one hash per pre-processed chunk, in the order of the rows of its features
+        return [
+            self.chunk_cache.hash_window(inputs[chunk_start : chunk_start + chunk_len])
+            for chunk_start, chunk_len in zip(chunk_start_idx, chunk_lens)
+        ]
 
-            chunk_lens = [chunk.shape[0] for chunk in chunks]
-            strides = [
-                (chunk_l, _stride_l, _stride_r)
-                for chunk_l, _stride_l, _stride_r in zip(chunk_lens, _stride_left, _stride_right)
-            ]
+    def chunk_cache_keys(self, chunk_hashes, language=None, task=None, return_timestamps=False):
+        """Returns the keys of the chunks with the given window hashes in the `chunk_cache`, for a decoding config."""
+        return [(chunk_hash, language, task, bool(return_timestamps)) for chunk_hash in chunk_hashes]
 
-            yield {"stride": strides, **processed}
+    @staticmethod
+    def _get_chunk_strides(chunk_start_idx, chunk_end_idx, chunk_lens, inputs_len, stride_left, stride_right):
+        _stride_left = np.where(chunk_start_idx == 0, 0, stride_left)
+        is_last = np.where(stride_right > 0, chunk_end_idx > inputs_len, chunk_end_idx >= inputs_len)
+        _stride_right = np.where(is_last, 0, stride_right)
+
+        return [
+            (chunk_l, _stride_l, _stride_r)
+            for chunk_l, _stride_l, _stride_r in zip(chunk_lens, _stride_left, _stride_right)
+        ]
+
+    def _get_chunk_params(self, chunk_length_s, stride_length_s):
+        if stride_length_s is None:
+            stride_length_s = chunk_length_s / 6
 
-    def preprocess_batch(self, inputs, chunk_length_s=30.0, stride_length_s=None, batch_size=None):
+        if isinstance(stride_length_s, (int, float)):
+            stride_length_s = [stride_length_s, stride_length_s]
+
+        chunk_len = round(chunk_length_s * self.feature_extractor.sampling_rate)
+        stride_left = round(stride_length_s[0] * self.feature_extractor.sampling_rate)
+        stride_right = round(stride_length_s[1] * self.feature_extractor.sampling_rate)
+
+        if chunk_len < stride_left + stride_right:
+            raise ValueError("Chunk length must be superior to stride length")
+        return chunk_len, stride_left, stride_right
+
+    def num_fixed_chunks(self, num_samples, chunk_length_s=30.0, stride_length_s=None):
+        """Returns the number of chunks that fixed-length chunking with overlapping strides splits `num_samples` into."""
+        if stride_length_s is None:
+            stride_length_s = chunk_length_s / 6
+        if isinstance(stride_length_s, (int, float)):
+            stride_length_s = [stride_length_s, stride_length_s]
+        sampling_rate = self.feature_extractor.sampling_rate
+        step = round(chunk_length_s * sampling_rate) - sum(round(stride * sampling_rate) for stride in stride_length_s)
+        return math.ceil(num_samples / step)
+
+    def preprocess_batch(
+        self,
+        inputs,
+        chunk_length_s=30.0,
+        stride_length_s=None,
+        batch_size=None,
+        adaptive_chunking=False,
+        audio_digest=None,
+    ):
         if isinstance(inputs, np.ndarray):
             logger.warning(
                 "Numpy array passed as input - no sampling rate checks will be performed."
@@ -290,11 +747,37 @@ class FlaxWhisperPipline:
             if inputs.startswith("http://") or inputs.startswith("https://"):
                 # We need to actually check for a real protocol, otherwise it's impossible to use a local file
                 # like http_huggingface_co.png
-                inputs = requests.get(inputs).content
-            else:
+                # The body is read through the pooled connections of the shared session as it arrives, such that it
+                # is decoded while it downloads rather than once it has been downloaded as a whole
+                with HTTPStream(inputs) as stream:
+                    yield from self.preprocess_batch(
+                        stream,
+                        chunk_length_s=chunk_length_s,
+                        stride_length_s=stride_length_s,
+                        batch_size=batch_size,
+                        adaptive_chunking=adaptive_chunking,
+                        audio_digest=audio_digest,
+                    )
+                return
+            elif not chunk_length_s or adaptive_chunking:
                 with open(inputs, "rb") as f:
                     inputs = f.read()
 
+        is_file = hasattr(inputs, "read")
+        if (isinstance(inputs, (bytes, str)) or is_file) and chunk_length_s and not adaptive_chunking:
+            # fixed-length chunks are cut while ffmpeg decodes the file, such that batches are dispatched before
+            # decoding has finished and the full waveform is never held in memory
+            chunk_len, stride_left, stride_right = self._get_chunk_params(chunk_length_s, stride_length_s)
+            blocks = ffmpeg_stream(inputs, self.feature_extractor.sampling_rate)
+            if audio_digest is not None:
+                # the decoded audio is hashed as it streams past, see `whisper_jax.audio.hash_blocks`
+                blocks = hash_blocks(blocks, audio_digest)
+            yield from self.chunk_iter_from_stream(blocks, chunk_len, stride_left, stride_right, batch_size)
+            return
+
+        if is_file:
+            inputs = inputs.read()
+
         if isinstance(inputs, bytes):
             inputs = ffmpeg_read(inputs, self.feature_extractor.sampling_rate)
 
@@ -332,6 +815,8 @@ class FlaxWhisperPipline:
             raise ValueError(f"We expect a numpy ndarray as input, got `{type(inputs)}`")
         if len(inputs.shape) != 1:
             raise ValueError("We expect a single channel audio input for AutomaticSpeechRecognitionPipeline")
+        if audio_digest is not None:
+            audio_digest.update(inputs.astype(np.float32).tobytes())
 
         if stride is not None:
             if stride[0] + stride[1] > inputs.shape[0]:
@@ -343,20 +828,22 @@ class FlaxWhisperPipline:
             # of the original length in the stride so we can cut properly.
             stride = (inputs.shape[0], int(round(stride[0] * ratio)), int(round(stride[1] * ratio)))
 
-        if chunk_length_s:
-            if stride_length_s is None:
-                stride_length_s = chunk_length_s / 6
-
-            if isinstance(stride_length_s, (int, float)):
-                stride_length_s = [stride_length_s, stride_length_s]
-
+        if chunk_length_s and adaptive_chunking:
+            if stride_length_s is not None:
+                raise ValueError("Adaptive chunking places chunk boundaries in pauses and does not use strides.")
             chunk_len = round(chunk_length_s * self.feature_extractor.sampling_rate)
-            stride_left = round(stride_length_s[0] * self.feature_extractor.sampling_rate)
-            stride_right = round(stride_length_s[1] * self.feature_extractor.sampling_rate)
-
-            if chunk_len < stride_left + stride_right:
-                raise ValueError("Chunk length must be superior to stride length")
+            # search the last third of each chunk for the quietest point to end it at
+            chunk_start_idx = find_chunk_boundaries(inputs, chunk_len, search_len=chunk_len // 3)
 
+            num_fixed_chunks = self.num_fixed_chunks(inputs.shape[0], chunk_length_s)
+            logger.info(
+                f"Adaptive chunking: {len(chunk_start_idx)} chunks instead of {num_fixed_chunks} with overlapping "
+                f"strides ({1 - len(chunk_start_idx) / num_fixed_chunks:.0%} less compute)"
+            )
+            for item in self.chunk_iter_with_batch(inputs, chunk_len, 0, 0, batch_size, chunk_start_idx):
+                yield item
+        elif chunk_length_s:
+            chunk_len, stride_left, stride_right = self._get_chunk_params(chunk_length_s, stride_length_s)
             for item in self.chunk_iter_with_batch(
                 inputs,
                 chunk_len,
@@ -365,6 +852,15 @@ class FlaxWhisperPipline:
                 batch_size,
             ):
                 yield item
+        elif self.on_device_features:
+            processed = {
+                "input_values": self.log_mel_extractor.pad_chunks(
+                    inputs, [0], inputs.shape[0], center=False, dtype=np.int16
+                )
+            }
+            if stride is not None:
+                processed["stride"] = stride
+            yield processed
         else:
             processed = self.feature_extractor(
                 inputs, sampling_rate=self.feature_extractor.sampling_rate, return_tensors="np"
@@ -373,11 +869,10 @@ class FlaxWhisperPipline:
                 processed["stride"] = stride
             yield processed
 
-    def postprocess(self, model_outputs, return_timestamps=None, return_language=None):
+    def _unpack_model_outputs(self, model_outputs):
         # unpack the outputs from list(dict(list)) to list(dict)
         model_outputs = [dict(zip(output, t)) for output in model_outputs for t in zip(*output.values())]
 
-        time_precision = self.feature_extractor.chunk_length / self.model.config.max_source_positions
         # Send the chunking back to seconds, it's easier to handle in whisper
         sampling_rate = self.feature_extractor.sampling_rate
         for output in model_outputs:
@@ -388,6 +883,21 @@ class FlaxWhisperPipline:
                 stride_left /= sampling_rate
                 stride_right /= sampling_rate
                 output["stride"] = chunk_len, stride_left, stride_right
+        return model_outputs
+
+    @property
+    def time_precision(self):
+        return self.feature_extractor.chunk_length / self.model.config.max_source_positions
+
+    def postprocess(self, model_outputs, return_timestamps=None, return_language=None):
+        model_outputs = self._unpack_model_outputs(model_outputs)
+        time_precision = self.time_precision
+
+        strides = [output.get("stride") for output in model_outputs]
+        if len(model_outputs) > 1 and all(stride is not None and stride[1:] == (0, 0) for stride in strides):
+            # chunks without overlap (e.g. from adaptive chunking) have nothing to merge, so rather than searching
+            # for overlapping tokens, every chunk is decoded on its own and shifted to its start time
+            return self._stitch_by_timestamps(model_outputs, return_timestamps, return_language, time_precision)
 
         text, optional = self.tokenizer._decode_asr(
             model_outputs,
@@ -397,21 +907,148 @@ class FlaxWhisperPipline:
         )
         return {"text": text, **optional}
 
-    def forward(self, model_inputs, batch_size=None, language=None, task=None, return_timestamps=False):
-        # We need to keep track of some additional input arguments for post-processing so need to forward these on after running generation
-        input_features = model_inputs.pop("input_features")
+    def postprocess_stream(self, model_outputs_iter, return_language=None):
+        """
+        Incremental version of [`postprocess`] with timestamps. Consumes the decoded chunks of a file in order, as
+        successive lists in the `model_outputs` format (e.g. from [`TranscriptionRequest.iter_model_outputs`]), and
+        yields each timestamped segment (a `dict` with `"timestamp"` and `"text"`) as soon as it is stable, i.e. as
+        soon as merging the chunks still to come can no longer change it.
+
+        Overlapping chunks are merged one at a time by an [`IncrementalASRDecoder`], which keeps the state of the
+        stitching between chunks and returns each segment once it is closed. Chunks without overlap are decoded on
+        their own, so all of their segments are stable right away. Each chunk is therefore stitched once, and the
+        concatenated segments are the same as the `"chunks"` returned by [`postprocess`] for all the chunks at once.
+        """
+        time_precision = self.time_precision
+        outputs = (output for outputs in model_outputs_iter for output in self._unpack_model_outputs(outputs))
+
+        def has_overlap(output):
+            return output.get("stride") is None or output["stride"][1:] != (0, 0)
+
+        # `postprocess` only stitches chunks by their timestamps if there are several chunks and none overlap, so the
+        # second chunk is needed to decide when the first has no overlap
+        head = list(itertools.islice(outputs, 1))
+        if head and not has_overlap(head[0]):
+            head += list(itertools.islice(outputs, 1))
+
+        if len(head) > 1 and not any(has_overlap(output) for output in head):
+            time_offset = 0.0
+            for output in itertools.chain(head, outputs):
+                segments = self._stitch_by_timestamps(
+                    [output], True, return_language, time_precision, time_offset=time_offset
+                )
+                yield from segments.get("chunks", [])
+                time_offset += output["stride"][0]
+            return
+
+        decoder = IncrementalASRDecoder(self.tokenizer, time_precision, return_language=return_language)
+        for output in itertools.chain(head, outputs):
+            yield from decoder.add(output)
+        yield from decoder.finish()
+
+    def _stitch_by_timestamps(
+        self, model_outputs, return_timestamps, return_language, time_precision, time_offset=0.0
+    ):
+        text, chunks = "", None
+        for output in model_outputs:
+            chunk_len = output["stride"][0]
+            chunk_text, optional = self.tokenizer._decode_asr(
+                [output],
+                return_timestamps=return_timestamps,
+                return_language=return_language,
+                time_precision=time_precision,
+            )
+            text += chunk_text
+            if "chunks" in optional:
+                chunks = chunks if chunks is not None else []
+                for chunk in optional["chunks"]:
+                    if "timestamp" in chunk:
+                        start, end = chunk["timestamp"]
+                        # a segment left open at the end of the chunk is closed at the chunk boundary
+                        end = end if end is not None else chunk_len
+                        chunk = dict(chunk, timestamp=(round(start + time_offset, 2), round(end + time_offset, 2)))
+                    chunks.append(chunk)
+            time_offset += chunk_len
+        return {"text": text} if chunks is None else {"text": text, "chunks": chunks}
+
+    def _pad_model_inputs(self, model_inputs, batch_size=None):
+        # raw audio windows when computing the log-mel features on device, log-mel features otherwise
+        if "input_values" in model_inputs:
+            input_features = model_inputs.pop("input_values")
+        else:
+            input_features = model_inputs.pop("input_features")
         input_batch_size = input_features.shape[0]
+        # pad to the smallest compiled batch size that fits, rather than always to the full batch size
+        padded_batch_size = self.get_batch_bucket(input_batch_size, batch_size)
 
-        if input_batch_size != batch_size:
-            padding = np.zeros([batch_size - input_batch_size, *input_features.shape[1:]], input_features.dtype)
+        if input_batch_size != padded_batch_size:
+            padding = np.zeros([padded_batch_size - input_batch_size, *input_features.shape[1:]], input_features.dtype)
             input_features = np.concatenate([input_features, padding])
 
-        pred_ids = self.generate(input_features, language=language, task=task, return_timestamps=return_timestamps)[
-            :input_batch_size
-        ]
+        # the padding rows are marked as finished from the start, such that only the real rows drive the decoding loop
+        row_mask = np.arange(padded_batch_size) < input_batch_size
+        return input_features, row_mask
 
-        # tokenizer's decode method expects an extra dim - we insert it here for convenience
-        out = {"tokens": pred_ids[:, None, :]}
+    def silent_chunk_tokens(self, num_rows, length=None):
+        """
+        Returns the token ids of `num_rows` empty chunks, i.e. the decoder start token followed by EOS, as decoded for
+        the chunks skipped by the voice activity detector.
+        """
+        generation_config = self.model.generation_config
+        length = length if length is not None else self.max_length
+        tokens = np.full((num_rows, length), generation_config.pad_token_id, dtype=np.int32)
+        tokens[:, 0] = generation_config.decoder_start_token_id
+        tokens[:, 1] = generation_config.eos_token_id
+        return tokens
+
+    def _merge_silent_rows(self, pred_ids, speech_mask):
+        # scatter the decoded speech chunks back in between the (empty) chunks skipped by the VAD
+        tokens = self.silent_chunk_tokens(len(speech_mask), length=pred_ids.shape[-1])
+        tokens[speech_mask] = pred_ids
+        return tokens
+
+    def _merge_cached_rows(self, pred_ids, keys, cached_tokens, cache_mask):
+        # store the chunks decoded on device, and scatter them back in between the chunks taken from the cache
+        for key, tokens in zip(itertools.compress(keys, ~cache_mask), pred_ids):
+            self.chunk_cache.put(key, tokens)
+        if not cache_mask.any():
+            return pred_ids
+        tokens = self.silent_chunk_tokens(len(cache_mask), length=pred_ids.shape[-1])
+        tokens[~cache_mask] = pred_ids
+        tokens[cache_mask] = np.stack([cached for cached in cached_tokens if cached is not None])
+        return tokens
+
+    def forward_async(self, model_inputs, batch_size=None, language=None, task=None, return_timestamps=False):
+        """
+        Same as [`~FlaxWhisperPipline.forward`], but returns as soon as generation has been dispatched. The returned
+        `"tokens"` are still on device (and include the padded rows), use [`~FlaxWhisperPipline.fetch_outputs`] to
+        retrieve them.
+        """
+        # We need to keep track of some additional input arguments for post-processing so need to forward these on after running generation
+        speech_mask = model_inputs.pop("speech_mask", None)
+        chunk_hash = model_inputs.pop("chunk_hash", None)
+        model_input_name = "input_values" if "input_values" in model_inputs else "input_features"
+        out = {}
+        if self.chunk_cache is not None and chunk_hash is not None:
+            # only the chunks that are not in the cache are run on device
+            keys = self.chunk_cache_keys(chunk_hash, language=language, task=task, return_timestamps=return_timestamps)
+            cached_tokens = [self.chunk_cache.get(key) for key in keys]
+            cache_mask = np.array([tokens is not None for tokens in cached_tokens], dtype=bool)
+            model_inputs[model_input_name] = model_inputs[model_input_name][~cache_mask]
+            out["chunk_cache"] = (keys, cached_tokens, cache_mask)
+
+        if len(model_inputs[model_input_name]) > 0:
+            input_features, row_mask = self._pad_model_inputs(model_inputs, batch_size)
+            out["tokens"] = self.generate_async(
+                input_features, language=language, task=task, return_timestamps=return_timestamps, row_mask=row_mask
+            )
+            out["num_rows"] = int(row_mask.sum())
+        else:
+            # every chunk of the batch was skipped by the VAD or found in the cache, so there is nothing to run on device
+            out["tokens"], out["num_rows"] = None, 0
+
+        if speech_mask is not None:
+            out["speech_mask"] = speech_mask
 
         stride = model_inputs.pop("stride", None)
         if stride is not None:
@@ -419,6 +1056,294 @@ class FlaxWhisperPipline:
 
         return out
 
+    def fetch_outputs(self, model_outputs):
+        """Blocks until the generation dispatched by `forward_async` has finished and copies the token ids to host."""
+        out = dict(model_outputs)
+        tokens, num_rows = out.pop("tokens"), out.pop("num_rows")
+        pred_ids = jax.device_get(tokens)[:num_rows] if tokens is not None else self.silent_chunk_tokens(0)
+        chunk_cache = out.pop("chunk_cache", None)
+        if chunk_cache is not None:
+            keys, cached_tokens, cache_mask = chunk_cache
+            pred_ids = self._merge_cached_rows(pred_ids, keys, cached_tokens, cache_mask)
+        speech_mask = out.pop("speech_mask", None)
+        if speech_mask is not None:
+            pred_ids = self._merge_silent_rows(pred_ids, speech_mask)
+            if chunk_cache is not None:
+                speech_cache_mask, cache_mask = cache_mask, np.zeros(len(speech_mask), dtype=bool)
+                cache_mask[speech_mask] = speech_cache_mask
+        if chunk_cache is not None:
+            # whether each chunk was taken from the cache, to report the hit rate of a transcription
+            out["cached"] = cache_mask
+        # tokenizer's decode method expects an extra dim - we insert it here for convenience
+        out["tokens"] = pred_ids[:, None, :]
+        return out
+
+    def forward(self, model_inputs, batch_size=None, language=None, task=None, return_timestamps=False):
+        return self.fetch_outputs(
+            self.forward_async(
+                model_inputs, batch_size=batch_size, language=language, task=task, return_timestamps=return_timestamps
+            )
+        )
+
+    def forward_multi(self, model_inputs, generate_configs, batch_size=None):
+        """
+        Runs the encoder once on a batch of pre-processed inputs, and decodes the encoder outputs once for each of the
+        `generate_configs`. Returns one output dict per config, in the format of [`~FlaxWhisperPipline.forward`].
+
+        Args:
+            model_inputs (`dict`):
+                A batch of inputs as returned by [`~FlaxWhisperPipline.preprocess_batch`].
+            generate_configs (`List[dict]`):
+                The decoder prompt configurations, each a dict with optional keys `"language"`, `"task"` and
+                `"return_timestamps"`, e.g. `[{"task": "transcribe"}, {"task": "translate"}]`.
+            batch_size (`int`, *optional*):
+                The batch size to pad the inputs to.
+        """
+        stride = model_inputs.pop("stride", None)
+        speech_mask = model_inputs.pop("speech_mask", None)
+        # every config is decoded from the same encoder pass, so the chunk cache is not used here
+        model_inputs.pop("chunk_hash", None)
+        if speech_mask is None or speech_mask.any():
+            input_features, row_mask = self._pad_model_inputs(model_inputs, batch_size)
+            input_batch_size = int(row_mask.sum())
+
+            encoder_outputs = self.encode(input_features)
+            # dispatch all decodes before fetching any of them, such that they are queued back-to-back on device
+            output_ids = [
+                self.decode_async(encoder_outputs, row_mask=row_mask, **config) for config in generate_configs
+            ]
+        else:
+            input_batch_size = 0
+            output_ids = [self.silent_chunk_tokens(0) for _ in generate_configs]
+
+        outputs = []
+        for pred_ids in output_ids:
+            pred_ids = jax.device_get(pred_ids)[:input_batch_size]
+            if speech_mask is not None:
+                pred_ids = self._merge_silent_rows(pred_ids, speech_mask)
+            # tokenizer's decode method expects an extra dim - we insert it here for convenience
+            out = {"tokens": pred_ids[:, None, :]}
+            if stride is not None:
+                out["stride"] = stride
+            outputs.append(out)
+        return outputs
+
+    def transcribe_multi(
+        self,
+        inputs,
+        generate_configs,
+        chunk_length_s=30.0,
+        stride_length_s=None,
+        batch_size=None,
+        adaptive_chunking=False,
+    ):
+        """
+        Transcribes an audio input under several decoder prompt configurations, e.g. to both transcribe and translate
+        it, or to transcribe it in several languages. The audio is pre-processed and encoded only once, and only the
+        decoder is run once per configuration.
+
+        Args:
+            inputs (`np.ndarray` or `bytes` or `str` or `dict`):
+                The audio input, see [`~FlaxWhisperPipline.__call__`].
+            generate_configs (`List[dict]`):
+                The decoder prompt configurations, each a dict with optional keys `"language"`, `"task"` and
+                `"return_timestamps"`.
+            chunk_length_s (`float`, *optional*, defaults to 30.0):
+                The input length for each chunk, see [`~FlaxWhisperPipline.__call__`].
+            stride_length_s (`float`, *optional*, defaults to `chunk_length_s / 6`):
+                The length of stride on the left and right of each chunk, see [`~FlaxWhisperPipline.__call__`].
+            batch_size (`int`, *optional*):
+                The batch size to be used in chunking transcription.
+            adaptive_chunking (`bool`, *optional*, defaults to `False`):
+                Whether to place the chunk boundaries in pauses, see [`~FlaxWhisperPipline.__call__`].
+
+        Return:
+            `List[Dict]`: One post-processed output per configuration, in the format of
+            [`~FlaxWhisperPipline.__call__`].
+        """
+        batch_size = batch_size if batch_size is not None else self.batch_size
+        if batch_size % self.min_batch_size != 0:
+            raise ValueError(
+                f"Batch size must be a multiple of the number of JAX devices, but got batch size {batch_size} and num devices {self.min_batch_size}."
+            )
+
+        dataloader = self.preprocess_batch(
+            inputs,
+            chunk_length_s=chunk_length_s,
+            stride_length_s=stride_length_s,
+            batch_size=batch_size,
+            adaptive_chunking=adaptive_chunking,
+        )
+        model_outputs = [[] for _ in generate_configs]
+        for batch in dataloader:
+            for config_outputs, out in zip(model_outputs, self.forward_multi(batch, generate_configs, batch_size)):
+                config_outputs.append(out)
+
+        return [
+            self.postprocess(config_outputs, return_timestamps=config.get("return_timestamps"))
+            for config_outputs, config in zip(model_outputs, generate_configs)
+        ]
+
+    def _pack_batches(self, dataloaders, batch_size, packed_chunks):
+        # re-packs the chunks of the batches of several inputs into batches of `batch_size` chunks, regardless of the
+        # input they belong to, such that short inputs share batches rather than each padding their own. The input
+        # index and stride of the chunks of each packed batch are appended to `packed_chunks`
+        rows = []
+        num_speech = 0
+        for input_idx, dataloader in enumerate(dataloaders):
+            for batch in dataloader:
+                model_input_name = "input_values" if "input_values" in batch else "input_features"
+                input_features = batch[model_input_name]
+                # kept to build the features of a packed batch that only holds chunks skipped by the VAD
+                empty_features = input_features[:0]
+                speech_mask = batch.get("speech_mask", None)
+                if speech_mask is None:
+                    speech_mask = np.ones((len(input_features),), dtype=bool)
+                strides = batch.get("stride", None)
+                if strides is None or isinstance(strides, tuple):
+                    # un-chunked inputs are a single row, with a single stride if any
+                    strides = [strides] * len(speech_mask)
+                input_features = iter(input_features)
+                chunk_hash = iter(batch.get("chunk_hash", []))
+
+                for stride, is_speech in zip(strides, speech_mask):
+                    features = next(input_features) if is_speech else None
+                    rows.append((input_idx, stride, features, next(chunk_hash, None) if is_speech else None))
+                    num_speech += int(is_speech)
+                    if num_speech == batch_size:
+                        yield self._pack_rows(rows, model_input_name, empty_features, packed_chunks)
+                        rows, num_speech = [], 0
+        if rows:
+            yield self._pack_rows(rows, model_input_name, empty_features, packed_chunks)
+
+    @staticmethod
+    def _pack_rows(rows, model_input_name, empty_features, packed_chunks):
+        speech_mask = np.array([features is not None for _, _, features, _ in rows])
+        features = [features for _, _, features, _ in rows if features is not None]
+        batch = {model_input_name: np.stack(features) if features else empty_features}
+        if not speech_mask.all():
+            batch["speech_mask"] = speech_mask
+        chunk_hash = [chunk_hash for _, _, features, chunk_hash in rows if features is not None]
+        if chunk_hash and None not in chunk_hash:
+            batch["chunk_hash"] = chunk_hash
+        packed_chunks.append([(input_idx, stride) for input_idx, stride, _, _ in rows])
+        return batch
+
+    def transcribe_batch(
+        self,
+        inputs,
+        chunk_length_s=30.0,
+        stride_length_s=None,
+        batch_size=None,
+        language=None,
+        task=None,
+        return_timestamps=None,
+        adaptive_chunking=False,
+        max_prefetch=4,
+    ):
+        """
+        Transcribes several audio inputs at once. The chunks of all inputs are packed into shared batches of
+        `batch_size` chunks, rather than each input running its own batches, such that many short inputs (e.g.
+        voicemail clips, which are a single chunk each) fill a batch together instead of each padding one. The
+        outputs are split back per input and post-processed separately, with timestamps relative to the start of each
+        input. URL inputs are downloaded by a [`URLPrefetcher`], such that the next ones download while the current
+        one is transcribed.
+
+        Args:
+            inputs (`List`):
+                The audio inputs, each in one of the formats accepted by [`~FlaxWhisperPipline.__call__`].
+            chunk_length_s (`float`, *optional*, defaults to 30.0):
+                The input length for each chunk, see [`~FlaxWhisperPipline.__call__`].
+            stride_length_s (`float`, *optional*, defaults to `chunk_length_s / 6`):
+                The length of stride on the left and right of each chunk, see [`~FlaxWhisperPipline.__call__`].
+            batch_size (`int`, *optional*):
+                The number of chunks per batch, across all inputs.
+            language (`str`, *optional*):
+                Language token to use for generation, see [`~FlaxWhisperPipline.__call__`].
+            task (`str`, *optional*):
+                Task to use for generation, see [`~FlaxWhisperPipline.__call__`].
+            return_timestamps (*optional*, `bool`):
+                Whether to return timestamps in the prediction, see [`~FlaxWhisperPipline.__call__`].
+            adaptive_chunking (`bool`, *optional*, defaults to `False`):
+                Whether to place the chunk boundaries in pauses, see [`~FlaxWhisperPipline.__call__`].
+            max_prefetch (`int`, *optional*, defaults to 4):
+                The maximum number of URL inputs downloaded ahead of the input being transcribed.
+
+        Return:
+            `List[Dict]`: One post-processed output per input, in the format of [`~FlaxWhisperPipline.__call__`].
+        """
+        batch_size = batch_size if batch_size is not None else self.batch_size
+        if batch_size % self.min_batch_size != 0:
+            raise ValueError(
+                f"Batch size must be a multiple of the number of JAX devices, but got batch size {batch_size} and num devices {self.min_batch_size}."
+            )
+
+        inputs = list(inputs)
+        # each input is pre-processed once the chunks of the previous ones have been packed
+        dataloaders = (
+            self.preprocess_batch(
+                audio,
+                chunk_length_s=chunk_length_s,
+                stride_length_s=stride_length_s,
+                batch_size=batch_size,
+                adaptive_chunking=adaptive_chunking,
+            )
+            for audio in self._prefetch_urls(inputs, max_prefetch)
+        )
+        packed_chunks = []
+        with PipelinedExecutor(self) as executor:
+            model_outputs = executor.map(
+                self._pack_batches(dataloaders, batch_size, packed_chunks),
+                batch_size=batch_size,
+                language=language,
+                task=task,
+                return_timestamps=return_timestamps,
+            )
+        self._log_chunk_cache_hits(model_outputs)
+
+        # route the decoded chunks back to their inputs, in order
+        tokens = [[] for _ in inputs]
+        strides = [[] for _ in inputs]
+        for outputs, chunks in zip(model_outputs, packed_chunks):
+            for chunk_tokens, (input_idx, stride) in zip(outputs["tokens"], chunks):
+                tokens[input_idx].append(chunk_tokens)
+                strides[input_idx].append(stride)
+
+        post_processed = []
+        for input_tokens, input_strides in zip(tokens, strides):
+            outputs = {"tokens": np.stack(input_tokens)}
+            if all(stride is not None for stride in input_strides):
+                outputs["stride"] = input_strides
+            post_processed.append(self.postprocess([outputs], return_timestamps=return_timestamps))
+        return post_processed
+
+    @staticmethod
+    def _prefetch_urls(inputs, max_prefetch):
+        # yields the inputs in order, with the URL inputs replaced by their downloaded files
+        urls = [audio for audio in inputs if isinstance(audio, str) and audio.startswith(("http://", "https://"))]
+        if not urls:
+            yield from inputs
+            return
+        prefetcher = iter(URLPrefetcher(urls, max_prefetch=max_prefetch))
+        try:
+            for audio in inputs:
+                if isinstance(audio, str) and audio.startswith(("http://", "https://")):
+                    # the file is deleted once the next URL input is requested, i.e. once its chunks have been packed
+                    _, audio = next(prefetcher)
+                yield audio
+        finally:
+            # cancels the downloads of the inputs that are not reached, e.g. after an error
+            prefetcher.close()
+
+    def _log_chunk_cache_hits(self, model_outputs):
+        if self.chunk_cache is None:
+            return
+        cached = np.concatenate([output["cached"] for output in model_outputs if "cached" in output] or [[]])
+        if len(cached) > 0:
+            logger.info(
+                f"Chunk cache: {int(cached.sum())} of {len(cached)} chunks cached ({cached.mean():.0%} hit rate)"
+            )
+
     def __call__(
         self,
         inputs,
@@ -429,6 +1354,7 @@ class FlaxWhisperPipline:
         task=None,
         return_timestamps=None,
         generate_kwargs=None,
+        adaptive_chunking=False,
     ):
         """
         Transcribe an audio input sequence to a text transcription, optionally with timestamps.
@@ -438,8 +1364,12 @@ class FlaxWhisperPipline:
                 The inputs is either:
                     - `str` that is the filename of the audio file, the file will be read at the correct sampling rate
                       to get the waveform using *ffmpeg*. This requires *ffmpeg* to be installed on the system.
+                    - `str` that is an `http://` or `https://` URL is downloaded through the pooled connections of a shared
+                      session, and streamed to *ffmpeg* as it arrives.
                     - `bytes` is the byte content of an audio file and is interpreted by *ffmpeg* in the
                       same way.
+                    - a binary file object (e.g. an uploaded file) is streamed to *ffmpeg* in pieces, without being
+                      read into memory as a whole.
                     - (`np.ndarray` of shape (n, ) of type `np.float32` or `np.float64`)
                         Raw audio assumed to be at the correct sampling rate (16kHz). Note that no further sampling
                         rate check will be done.
@@ -475,6 +1405,11 @@ class FlaxWhisperPipline:
                 Whether to return timestamps in the prediction. Defaults to False. If set to true, the pipeline
                 will return two keys in the output dictionary: `"text"` containing the text transcription, and `"chunks"`
                 containing the transcription segments chunked by their utterance-level timestamps.
+            adaptive_chunking (`bool`, *optional*, defaults to `False`):
+                Whether to place the chunk boundaries at the quietest point of the last third of each chunk, rather
+                than every `chunk_length_s` seconds with overlapping strides. Chunks then tile the input without
+                overlap (`stride_length_s` must not be set) and are stitched together by their timestamps, which
+                avoids spending about a third of the compute on stride audio that is discarded in post-processing.
 
         Return:
             `Dict`: A dictionary with the following keys:
@@ -492,15 +1427,17 @@ class FlaxWhisperPipline:
             )
 
         dataloader = self.preprocess_batch(
-            inputs, chunk_length_s=chunk_length_s, stride_length_s=stride_length_s, batch_size=batch_size
+            inputs,
+            chunk_length_s=chunk_length_s,
+            stride_length_s=stride_length_s,
+            batch_size=batch_size,
+            adaptive_chunking=adaptive_chunking,
         )
-        model_outputs = []
-        # iterate over our chunked audio samples
-        for batch in dataloader:
-            model_outputs.append(
-                self.forward(
-                    batch, batch_size=batch_size, language=language, task=task, return_timestamps=return_timestamps
-                )
+        # iterate over our chunked audio samples, pre-processing batch N+1 while batch N is decoded on device
+        with PipelinedExecutor(self) as executor:
+            model_outputs = executor.map(
+                dataloader, batch_size=batch_size, language=language, task=task, return_timestamps=return_timestamps
             )
+        self._log_chunk_cache_hits(model_outputs)
         post_processed = self.postprocess(model_outputs, return_timestamps=return_timestamps)
         return post_processed
@@ -0,0 +1,615 @@
+# coding=utf-8
+# Copyright 2023 The HuggingFace Inc. team.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import threading
+import time
+
+import numpy as np
+from transformers.utils import logging
+
+from .executor import PipelinedExecutor
+from .inflight import InflightDecodeEngine
+
+
+logger = logging.get_logger(__name__)
+
+
+class TranscriptionRequest:
+    """
+    Handle for a single transcription submitted to a [`ContinuousBatchScheduler`]. The chunks of the request are
+    decoded together with the chunks of all other in-flight requests, and the decoded tokens are routed back here
+    until every chunk of the request has been transcribed.
+    """
+
+    def __init__(self, language=None, task=None, return_timestamps=False):
+        self.language = language
+        self.task = task
+        self.return_timestamps = return_timestamps
+
+        self.num_chunks = 0
+        self.tokens = {}
+        self.strides = {}
+        # keys in the chunk cache of the pipeline of the chunks queued for decoding, and the lookup counts
+        self.cache_keys = {}
+        self.num_cache_lookups = 0
+        self.num_cached_chunks = 0
+        self.done_submitting = False
+        self.error = None
+        self.submit_time = time.time()
+        self.finish_time = None
+        self._finished = threading.Event()
+        # notified whenever chunks are decoded, see `iter_model_outputs`
+        self._updated = threading.Condition()
+
+    @property
+    def generation_key(self):
+        # chunks can only share a batch if they are decoded with the same forced decoder ids and logits processors
+        return self.language, self.task, bool(self.return_timestamps)
+
+    @property
+    def runtime(self):
+        if self.finish_time is None:
+            return None
+        return self.finish_time - self.submit_time
+
+    @property
+    def chunk_hit_rate(self):
+        """Fraction of the chunks looked up in the chunk cache of the pipeline that were found in it."""
+        if self.num_cache_lookups == 0:
+            return 0.0
+        return self.num_cached_chunks / self.num_cache_lookups
+
+    @property
+    def progress(self):
+        """The number of chunks submitted and decoded so far. The total is only known once `done_submitting`."""
+        return {
+            "num_chunks": self.num_chunks,
+            "num_decoded": len(self.tokens),
+            "done_submitting": self.done_submitting,
+        }
+
+    def _maybe_finish(self):
+        if self.error is not None or (self.done_submitting and len(self.tokens) == self.num_chunks):
+            self.finish_time = time.time()
+            self._finished.set()
+        with self._updated:
+            self._updated.notify_all()
+
+    def done(self):
+        return self._finished.is_set()
+
+    def wait_done(self, timeout=None):
+        """Same as [`wait`], but returns whether the request has finished instead of raising on timeout or error."""
+        return self._finished.wait(timeout)
+
+    def wait(self, timeout=None):
+        if not self._finished.wait(timeout):
+            raise TimeoutError("Transcription request did not complete within the timeout.")
+        if self.error is not None:
+            raise self.error
+
+    def model_outputs(self):
+        """Returns the decoded chunks in the `list(dict)` format expected by [`FlaxWhisperPipline.postprocess`]."""
+        self.wait()
+        if self.num_chunks == 0:
+            return []
+        order = range(self.num_chunks)
+        return [self._gather(order)]
+
+    def iter_model_outputs(self):
+        """
+        Yields the decoded chunks in order while the request is still running: each time the chunks following the
+        ones already yielded have been decoded, they are yielded in the format of [`model_outputs`]. Used to
+        post-process the transcription incrementally with [`FlaxWhisperPipline.postprocess_stream`].
+        """
+        next_idx = 0
+        while True:
+            with self._updated:
+                self._updated.wait_for(lambda: next_idx in self.tokens or self.done())
+            if self.error is not None:
+                raise self.error
+            stop_idx = next_idx
+            while stop_idx in self.tokens:
+                stop_idx += 1
+            if stop_idx > next_idx:
+                yield [self._gather(range(next_idx, stop_idx))]
+                next_idx = stop_idx
+            elif self.done():
+                return
+
+    def _gather(self, order):
+        outputs = {"tokens": np.stack([self.tokens[idx] for idx in order])}
+        if all(idx in self.strides for idx in order):
+            outputs["stride"] = [self.strides[idx] for idx in order]
+        return outputs
+
+
+class ContinuousBatchScheduler:
+    def __init__(self, pipeline, batch_size=None, max_wait_s=0.01, max_in_flight=2, max_pending_chunks=None):
+        """
+        Cross-request batching for [`FlaxWhisperPipline`]. Chunks from all in-flight requests are collected in a
+        shared queue and packed into fixed-shape batches, such that a single `generate` call serves many requests at
+        once. Since every batch has the same shape, no recompilation is triggered regardless of the request mix.
+
+        Args
+            pipeline (`FlaxWhisperPipline`):
+                The pipeline used for pre-processing, generation and post-processing.
+            batch_size (`int`, *optional*, defaults to `pipeline.batch_size`):
+                The number of chunks packed into each call to `generate`. Must be a multiple of the number of JAX
+                devices.
+            max_wait_s (`float`, *optional*, defaults to 0.01):
+                Maximum time the device loop waits for a partially filled batch to fill up before dispatching it.
+            max_in_flight (`int`, *optional*, defaults to 2):
+                The maximum number of batches decoding on device at once, see [`PipelinedExecutor`].
+            max_pending_chunks (`int`, *optional*, defaults to `2 * batch_size`):
+                The maximum number of chunks of a single request waiting in the queue. Pre-processing of the request
+                blocks until the device loop has taken its pending chunks, such that the features of a long file are
+                not all held in memory at once.
+        """
+        self.pipeline = pipeline
+        self.batch_size = batch_size if batch_size is not None else pipeline.batch_size
+        if self.batch_size % pipeline.min_batch_size != 0:
+            raise ValueError(
+                f"Batch size must be a multiple of the number of JAX devices, but got batch size {self.batch_size} and num devices {pipeline.min_batch_size}."
+            )
+        self.max_wait_s = max_wait_s
+        self.max_in_flight = max_in_flight
+        self.max_pending_chunks = max_pending_chunks if max_pending_chunks is not None else 2 * self.batch_size
+
+        # pending chunks per generation config, with one FIFO per request such that batches are filled fairly
+        self._queues = collections.OrderedDict()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._executor = None
+        self._running = False
+
+        self.num_batches = 0
+        self.num_chunks = 0
+        self.num_rows = 0
+
+    @property
+    def fill_ratio(self):
+        """Fraction of the rows sent to the device that held real (non-padding) chunks."""
+        if self.num_batches == 0:
+            return 0.0
+        return self.num_chunks / self.num_rows
+
+    @property
+    def overlap_ratio(self):
+        """Fraction of the batching and dispatch time of the device loop that was hidden behind device compute."""
+        if self._executor is None:
+            return 0.0
+        return self._executor.overlap_ratio
+
+    def start(self):
+        with self._condition:
+            if self._running:
+                return self
+            self._running = True
+        self._executor = PipelinedExecutor(self.pipeline, max_in_flight=self.max_in_flight)
+        self._thread = threading.Thread(target=self._run, name="whisper-jax-scheduler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._executor is not None:
+            # wait for the batches that are still decoding
+            self._executor.close()
+        with self._condition:
+            # the requests with chunks that were queued but never taken by the device loop would never finish
+            for requests in self._queues.values():
+                for request in requests:
+                    request.error = RuntimeError("The scheduler was stopped before the request was transcribed.")
+                    request._maybe_finish()
+            self._queues.clear()
+
+    def submit(
+        self,
+        inputs,
+        chunk_length_s=30.0,
+        stride_length_s=None,
+        language=None,
+        task=None,
+        return_timestamps=False,
+        adaptive_chunking=False,
+        progress_callback=None,
+        audio_digest=None,
+    ):
+        """
+        Pre-processes `inputs` in the calling thread and enqueues its chunks for decoding. Returns a
+        [`TranscriptionRequest`] that completes once every chunk has been decoded. Arguments are the same as for
+        [`FlaxWhisperPipline.__call__`], and `progress_callback` is called with the request after each batch of its
+        chunks has been queued, since pre-processing a long file can take a while by itself. If given, `audio_digest`
+        (a `hashlib` hash object) is updated with the decoded audio, see [`~whisper_jax.audio.hash_blocks`], and holds
+        its digest once this method returns.
+        """
+        request = self._new_request(language=language, task=task, return_timestamps=return_timestamps)
+        self._submit_chunks(
+            request,
+            inputs,
+            chunk_length_s=chunk_length_s,
+            stride_length_s=stride_length_s,
+            adaptive_chunking=adaptive_chunking,
+            progress_callback=progress_callback,
+            audio_digest=audio_digest,
+        )
+        return request
+
+    def submit_nowait(
+        self,
+        inputs,
+        chunk_length_s=30.0,
+        stride_length_s=None,
+        language=None,
+        task=None,
+        return_timestamps=False,
+        adaptive_chunking=False,
+        progress_callback=None,
+        audio_digest=None,
+    ):
+        """
+        Same as [`submit`], but pre-processes `inputs` in a background thread and returns the [`TranscriptionRequest`]
+        straight away, such that its first chunks can be consumed (e.g. with
+        [`~TranscriptionRequest.iter_model_outputs`]) while the rest of the file is still being pre-processed.
+        Pre-processing errors are raised by the request rather than by this method.
+        """
+        request = self._new_request(language=language, task=task, return_timestamps=return_timestamps)
+
+        def submit_chunks():
+            try:
+                self._submit_chunks(
+                    request,
+                    inputs,
+                    chunk_length_s=chunk_length_s,
+                    stride_length_s=stride_length_s,
+                    adaptive_chunking=adaptive_chunking,
+                    progress_callback=progress_callback,
+                    audio_digest=audio_digest,
+                )
+            except Exception as err:
+                logger.error(f"Pre-processing failed: {err}")
+
+        threading.Thread(target=submit_chunks, name="whisper-jax-submit", daemon=True).start()
+        return request
+
+    def _new_request(self, language=None, task=None, return_timestamps=False):
+        if not self._running:
+            raise RuntimeError("The scheduler must be started with `start()` before submitting requests.")
+        # validate the language / task eagerly so that errors are raised in the caller rather than the device loop
+        self.pipeline.get_forced_decoder_ids(language=language, task=task, return_timestamps=return_timestamps)
+        return TranscriptionRequest(language=language, task=task, return_timestamps=return_timestamps)
+
+    def _submit_chunks(
+        self,
+        request,
+        inputs,
+        chunk_length_s=30.0,
+        stride_length_s=None,
+        adaptive_chunking=False,
+        progress_callback=None,
+        audio_digest=None,
+    ):
+        dataloader = self.pipeline.preprocess_batch(
+            inputs,
+            chunk_length_s=chunk_length_s,
+            stride_length_s=stride_length_s,
+            batch_size=self.batch_size,
+            adaptive_chunking=adaptive_chunking,
+            audio_digest=audio_digest,
+        )
+        try:
+            for batch in dataloader:
+                model_input_name = "input_values" if "input_values" in batch else "input_features"
+                input_features = batch[model_input_name]
+                strides = batch.get("stride", None)
+                if isinstance(strides, tuple):
+                    # un-chunked inputs carry a single stride for the single row
+                    strides = [strides]
+                # chunks skipped by the VAD are not queued, they are decoded as empty chunks straight away
+                speech_mask = batch.get("speech_mask", None)
+                if speech_mask is None:
+                    speech_mask = np.ones((len(input_features),), dtype=bool)
+                input_features = iter(input_features)
+                # chunks found in the chunk cache are not queued either, they are taken from the cache
+                chunk_keys = None
+                if batch.get("chunk_hash", None) is not None:
+                    chunk_keys = iter(
+                        self.pipeline.chunk_cache_keys(
+                            batch["chunk_hash"],
+                            language=request.language,
+                            task=request.task,
+                            return_timestamps=request.return_timestamps,
+                        )
+                    )
+                items = []
+                for row, is_speech in enumerate(speech_mask):
+                    idx = request.num_chunks
+                    request.num_chunks += 1
+                    if strides is not None:
+                        request.strides[idx] = strides[row]
+                    if is_speech:
+                        features = next(input_features)
+                        key = next(chunk_keys) if chunk_keys is not None else None
+                        cached_tokens = None
+                        if key is not None:
+                            request.num_cache_lookups += 1
+                            cached_tokens = self.pipeline.chunk_cache.get(key)
+                        if cached_tokens is not None:
+                            with self._condition:
+                                request.num_cached_chunks += 1
+                                request.tokens[idx] = cached_tokens[None]
+                                request._maybe_finish()
+                        else:
+                            if key is not None:
+                                request.cache_keys[idx] = key
+                            items.append((request, idx, features))
+                    else:
+                        with self._condition:
+                            request.tokens[idx] = self.pipeline.silent_chunk_tokens(1)
+                            request._maybe_finish()
+                self._enqueue((model_input_name, *request.generation_key), items)
+                if progress_callback is not None:
+                    progress_callback(request)
+        except Exception as err:
+            request.error = err
+            raise
+        finally:
+            with self._condition:
+                request.done_submitting = True
+                request._maybe_finish()
+
+    def transcribe(self, inputs, return_timestamps=False, **kwargs):
+        """Blocking version of [`submit`]: returns the post-processed transcription of `inputs`."""
+        request = self.submit(inputs, return_timestamps=return_timestamps, **kwargs)
+        return self.pipeline.postprocess(request.model_outputs(), return_timestamps=return_timestamps)
+
+    def _enqueue(self, key, items):
+        with self._condition:
+            for item in items:
+                request = item[0]
+                # block pre-processing of the request until the device loop has taken its pending chunks
+                self._condition.wait_for(
+                    lambda: not self._running or self._num_pending(key, request) < self.max_pending_chunks
+                )
+                if not self._running:
+                    # the device loop has exited, so the chunk would never be decoded
+                    raise RuntimeError("The scheduler was stopped before all chunks of the request were queued.")
+                requests = self._queues.setdefault(key, collections.OrderedDict())
+                requests.setdefault(request, collections.deque()).append(item)
+                self._condition.notify_all()
+
+    def _num_pending(self, key=None, request=None):
+        if request is not None:
+            return len(self._queues.get(key, {}).get(request, ()))
+        return sum(len(queue) for requests in self._queues.values() for queue in requests.values())
+
+    def _next_key(self):
+        # generation configs with pending chunks are served in turn, see `_pop_items`
+        return next(iter(self._queues))
+
+    def _pop_items(self, key, num_items):
+        # take one chunk per request in turn rather than draining the oldest request first, such that a short request
+        # is not queued behind every chunk of a long one
+        requests = self._queues[key]
+        items = []
+        while requests and len(items) < num_items:
+            request, queue = next(iter(requests.items()))
+            items.append(queue.popleft())
+            if queue:
+                requests.move_to_end(request)
+            else:
+                del requests[request]
+        if requests:
+            self._queues.move_to_end(key)
+        else:
+            del self._queues[key]
+        # wake up the requests blocked in `_enqueue`
+        self._condition.notify_all()
+        return items
+
+    def _next_batch(self):
+        with self._condition:
+            while self._running and self._num_pending() == 0:
+                self._condition.wait()
+            if not self._running:
+                return None, None
+
+            # give concurrent requests a brief window to top up a partially filled batch
+            deadline = time.time() + self.max_wait_s
+            while self._running and self._num_pending() < self.batch_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+            key = self._next_key()
+            return key, self._pop_items(key, self.batch_size)
+
+    def _run(self):
+        while True:
+            key, items = self._next_batch()
+            if items is None:
+                return
+
+            model_input_name, language, task, return_timestamps = key
+            try:
+                # generation is dispatched asynchronously, so the next batch is assembled while this one decodes
+                with self._executor.host_work():
+                    model_inputs = {model_input_name: np.stack([features for _, _, features in items])}
+                future = self._executor.submit(
+                    model_inputs,
+                    batch_size=self.batch_size,
+                    language=language,
+                    task=task,
+                    return_timestamps=return_timestamps,
+                )
+            except Exception as err:
+                self._fail(items, err)
+                continue
+            future.add_done_callback(lambda future, items=items: self._route(items, future))
+
+    def _fail(self, items, err):
+        logger.error(f"Generation failed for a batch of {len(items)} chunks: {err}")
+        with self._condition:
+            for request, _, _ in items:
+                request.error = err
+                request._maybe_finish()
+
+    def _route(self, items, future):
+        # runs in the fetch thread of the executor once the token ids of the batch are on host
+        err = future.exception()
+        if err is not None:
+            self._fail(items, err)
+            return
+
+        outputs = future.result()
+        with self._condition:
+            self.num_batches += 1
+            self.num_chunks += len(items)
+            # partial batches are only padded up to the smallest compiled batch size that fits them
+            self.num_rows += self.pipeline.get_batch_bucket(len(items), self.batch_size)
+            for row, (request, idx, _) in enumerate(items):
+                self._finish_chunk(request, idx, outputs["tokens"][row])
+
+    def _finish_chunk(self, request, idx, tokens):
+        # `tokens` are the token ids of the chunk with an extra leading dim, as expected by post-processing
+        request.tokens[idx] = tokens
+        key = request.cache_keys.pop(idx, None)
+        if key is not None:
+            self.pipeline.chunk_cache.put(key, tokens[0])
+        request._maybe_finish()
+
+
+class InflightBatchScheduler(ContinuousBatchScheduler):
+    def __init__(self, pipeline, batch_size=None, refill_size=None, max_steps=32, max_pending_chunks=None):
+        """
+        Token-level variant of [`ContinuousBatchScheduler`]. Rather than decoding fixed batches until their longest
+        chunk finishes, chunks are decoded by an [`InflightDecodeEngine`]: whenever a chunk emits the EOS token, its
+        slot is refilled with the next pending chunk, such that the device keeps decoding unfinished chunks only.
+
+        Chunks share the engine if their decoder prompts have the same layout, which holds for all languages and tasks
+        at a given `return_timestamps`. Chunks with a different layout are decoded once the engine has drained.
+
+        Args
+            pipeline (`FlaxWhisperPipline`):
+                The pipeline used for pre-processing, generation and post-processing.
+            batch_size (`int`, *optional*, defaults to `pipeline.batch_size`):
+                The number of decoding slots.
+            refill_size (`int`, *optional*):
+                The number of chunks encoded per refill, see [`InflightDecodeEngine`].
+            max_steps (`int`, *optional*, defaults to 32):
+                The maximum number of decoding steps between two refills.
+            max_pending_chunks (`int`, *optional*, defaults to `2 * batch_size`):
+                The maximum number of chunks of a single request waiting in the queue, see
+                [`ContinuousBatchScheduler`].
+        """
+        super().__init__(pipeline, batch_size=batch_size, max_wait_s=0.0, max_pending_chunks=max_pending_chunks)
+        self.refill_size = refill_size
+        self.max_steps = max_steps
+        self._engines = {}
+
+    @property
+    def fill_ratio(self):
+        """Fraction of the decoded row-steps that were spent on unfinished chunks."""
+        num_steps = sum(engine.num_steps for engine in self._engines.values())
+        if num_steps == 0:
+            return 0.0
+        active_row_steps = sum(engine.active_row_steps for engine in self._engines.values())
+        return active_row_steps / (num_steps * self.batch_size)
+
+    def _layout(self, key):
+        _, language, task, return_timestamps = key
+        forced_decoder_ids = self.pipeline.get_forced_decoder_ids(
+            language=language, task=task, return_timestamps=return_timestamps
+        )
+        return tuple(idx for idx, _ in forced_decoder_ids), return_timestamps
+
+    def _get_engine(self, layout):
+        if layout not in self._engines:
+            forced_positions, return_timestamps = layout
+            self._engines[layout] = InflightDecodeEngine(
+                self.pipeline,
+                forced_positions,
+                return_timestamps=return_timestamps,
+                batch_size=self.batch_size,
+                refill_size=self.refill_size,
+                max_steps=self.max_steps,
+            )
+        return self._engines[layout]
+
+    def _next_items(self, engine, layout):
+        # pop pending chunks for the free slots in turn, stopping at the first chunk with a different prompt layout
+        # such that it is not starved by a sustained stream of chunks with the engine's layout
+        items = []
+        while len(items) < engine.num_free_slots and self._queues:
+            key = self._next_key()
+            if self._layout(key) != layout:
+                break
+            items.extend((key, item) for item in self._pop_items(key, 1))
+        return items
+
+    def _run(self):
+        engine = layout = None
+        while True:
+            with self._condition:
+                while self._running and self._num_pending() == 0 and (engine is None or engine.num_active == 0):
+                    self._condition.wait()
+                if not self._running:
+                    return
+
+                if engine is None or engine.num_active == 0:
+                    # switch to the prompt layout of the next pending chunk
+                    key = self._next_key()
+                    if engine is not None and self._layout(key) != layout:
+                        engine.release()
+                    layout = self._layout(key)
+                    engine = self._get_engine(layout)
+                items = self._next_items(engine, layout)
+
+            try:
+                if items:
+                    forced_token_ids = []
+                    for (_, language, task, return_timestamps), _ in items:
+                        forced_decoder_ids = self.pipeline.get_forced_decoder_ids(
+                            language=language, task=task, return_timestamps=return_timestamps
+                        )
+                        forced_token_ids.append([token for _, token in forced_decoder_ids])
+                    engine.insert(
+                        np.stack([features for _, (_, _, features) in items]),
+                        np.array(forced_token_ids, dtype=np.int32).reshape(len(items), len(layout[0])),
+                        [(request, idx) for _, (request, idx, _) in items],
+                    )
+                finished = engine.step()
+            except Exception as err:
+                # the decoding state is lost, so all chunks in the engine fail
+                failed = [(request, idx, None) for _, (request, idx, _) in items]
+                failed += [(request, idx, None) for request, idx in filter(None, engine.slots)]
+                engine.slots = [None] * engine.batch_size
+                engine.release()
+                self._fail(failed, err)
+                continue
+
+            with self._condition:
+                for (request, idx), tokens in finished:
+                    self.num_chunks += 1
+                    # post-processing expects the tokens of each chunk with an extra leading dim
+                    self._finish_chunk(request, idx, tokens[None])
@@ -0,0 +1,149 @@
+# coding=utf-8
+# Copyright 2023 The HuggingFace Inc. team.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+
+
+class VoiceActivityDetector:
+    """
+    Lightweight energy / spectral-flux voice activity detector, used to skip the windows of an audio file that hold no
+    speech before they are batched for the model. All frames of the waveform are scored in a single vectorized pass:
+
+    - the log-energy of each frame is compared to the noise floor of the file (a low percentile of the frame energies).
+      Frames well above the floor are counted as speech.
+    - frames that are only moderately above the floor are counted as speech if their spectral flux is high, i.e. the
+      coarse spectrum changes quickly, as it does at speech onsets but not for stationary background noise.
+
+    A window is kept if it holds at least `min_speech_s` seconds of speech frames. The detector is deliberately
+    conservative: it is meant to skip silence and stationary noise, not to segment speech.
+
+    Args:
+        sampling_rate (`int`, *optional*, defaults to 16000):
+            The sampling rate of the audio in Hz.
+        frame_length_s (`float`, *optional*, defaults to 0.02):
+            The length of the (non-overlapping) analysis frames in seconds.
+        margin_db (`float`, *optional*, defaults to 15.0):
+            The energy above the noise floor (in dB) from which a frame counts as speech. Frames above half the margin
+            count as speech if their spectral flux exceeds `flux_threshold`.
+        min_energy_db (`float`, *optional*, defaults to -60.0):
+            The energy (in dB relative to full scale) below which a frame is always silence.
+        flux_threshold (`float`, *optional*, defaults to 0.2):
+            The normalised spectral flux, between 0 and 1, above which a moderately loud frame counts as speech.
+        num_bands (`int`, *optional*, defaults to 16):
+            The number of frequency bands the spectrum is pooled into before computing the flux. Pooling removes the
+            bin-to-bin fluctuations of noise, which would otherwise dominate the flux.
+        noise_percentile (`float`, *optional*, defaults to 10.0):
+            The percentile of the frame energies taken as the noise floor.
+        min_speech_s (`float`, *optional*, defaults to 0.2):
+            The minimum duration of speech frames in seconds for a window to be kept.
+    """
+
+    def __init__(
+        self,
+        sampling_rate=16000,
+        frame_length_s=0.02,
+        margin_db=15.0,
+        min_energy_db=-60.0,
+        flux_threshold=0.2,
+        num_bands=16,
+        noise_percentile=10.0,
+        min_speech_s=0.2,
+    ):
+        self.sampling_rate = sampling_rate
+        self.frame_length = int(round(frame_length_s * sampling_rate))
+        self.margin_db = margin_db
+        self.min_energy_db = min_energy_db
+        self.flux_threshold = flux_threshold
+        self.num_bands = num_bands
+        self.noise_percentile = noise_percentile
+        self.min_speech_frames = max(int(round(min_speech_s / frame_length_s)), 1)
+
+    def frame_speech_mask(self, waveform):
+        """Returns a boolean array of shape `(num_frames,)` that is `True` for the frames classified as speech."""
+        num_frames = waveform.shape[0] // self.frame_length
+        if num_frames == 0:
+            return np.zeros((0,), dtype=bool)
+        frames = waveform[: num_frames * self.frame_length].reshape(num_frames, self.frame_length)
+        frames = frames.astype(np.float32, copy=False)
+
+        energy_db = 10.0 * np.log10(np.mean(np.square(frames), axis=-1) + 1e-10)
+        noise_floor_db = np.percentile(energy_db, self.noise_percentile)
+
+        # spectral flux of the band-pooled, normalised magnitude spectrum
+        magnitudes = np.abs(np.fft.rfft(frames, axis=-1))
+        num_bins = magnitudes.shape[-1] - magnitudes.shape[-1] % self.num_bands
+        bands = magnitudes[:, :num_bins].reshape(num_frames, self.num_bands, -1).sum(axis=-1)
+        bands /= bands.sum(axis=-1, keepdims=True) + 1e-10
+        flux = np.zeros((num_frames,), dtype=np.float32)
+        flux[1:] = np.maximum(bands[1:] - bands[:-1], 0.0).sum(axis=-1)
+
+        loud = energy_db > noise_floor_db + self.margin_db
+        onset = (energy_db > noise_floor_db + self.margin_db / 2) & (flux > self.flux_threshold)
+        return (loud | onset) & (energy_db > self.min_energy_db)
+
+    def window_speech_mask(self, waveform, window_start_idx, window_len):
+        """
+        Returns a boolean array of shape `(num_windows,)` that is `True` for the windows
+        `waveform[start : start + window_len]` that hold at least `min_speech_s` seconds of speech.
+        """
+        frame_mask = self.frame_speech_mask(waveform)
+        # number of speech frames up to each frame boundary, such that the count of any window is a difference
+        speech_frames = np.concatenate([[0], np.cumsum(frame_mask)])
+        first_frame = np.minimum(np.asarray(window_start_idx) // self.frame_length, len(frame_mask))
+        last_frame = np.minimum((np.asarray(window_start_idx) + window_len) // self.frame_length, len(frame_mask))
+        return speech_frames[last_frame] - speech_frames[first_frame] >= self.min_speech_frames
+
+
+def find_chunk_boundaries(waveform, max_chunk_len, search_len, frame_length=160, smoothing_frames=25):
+    """
+    Splits a waveform into consecutive, non-overlapping chunks of at most `max_chunk_len` samples, placing each
+    boundary at the quietest point of the last `search_len` samples of the chunk. Boundaries thus fall into pauses
+    between words rather than through them, which removes the need for overlapping strides between chunks.
+
+    Args:
+        waveform (`np.ndarray` of shape `(num_samples,)`):
+            The audio waveform.
+        max_chunk_len (`int`):
+            The maximum number of samples in a chunk.
+        search_len (`int`):
+            The number of samples at the end of each chunk that are searched for a boundary.
+        frame_length (`int`, *optional*, defaults to 160):
+            The number of samples per energy frame, and thus the resolution of the boundaries.
+        smoothing_frames (`int`, *optional*, defaults to 25):
+            The number of frames the energy is averaged over, such that boundaries are placed in pauses rather than
+            in the short dips between syllables.
+
+    Returns:
+        `np.ndarray` of shape `(num_chunks,)` with the start sample of each chunk. The last chunk ends at the end of
+        the waveform.
+    """
+    if not frame_length <= search_len < max_chunk_len:
+        raise ValueError(f"The search length must be in [{frame_length}, {max_chunk_len}), got {search_len}.")
+    num_samples = waveform.shape[0]
+    num_frames = num_samples // frame_length
+    frames = waveform[: num_frames * frame_length].reshape(num_frames, frame_length).astype(np.float32, copy=False)
+    energy = np.mean(np.square(frames), axis=-1)
+    # centred moving average of the frame energies
+    energy = np.convolve(energy, np.ones(smoothing_frames, dtype=np.float32) / smoothing_frames, mode="same")
+
+    chunk_start_idx = [0]
+    while num_samples - chunk_start_idx[-1] > max_chunk_len:
+        chunk_end = chunk_start_idx[-1] + max_chunk_len
+        first_frame = -(-(chunk_end - search_len) // frame_length)
+        last_frame = chunk_end // frame_length
+        # take the last of equally quiet frames, such that chunks in long silences are as long as possible
+        quietest_frame = last_frame - 1 - int(np.argmin(energy[first_frame:last_frame][::-1]))
+        chunk_start_idx.append(quietest_frame * frame_length)
+    return np.asarray(chunk_start_idx)